@@ -0,0 +1,364 @@
+"""Host-local coordination broker for bot processes.
+
+One process on the host (whichever first takes an flock on broker.lock) serves a Unix socket, and every
+process - including that one - talks to it through BrokerClient. The broker keeps the actual state, so waiters
+are queued FIFO and woken the moment a slot frees, without anyone polling files. If the broker process dies,
+its flock is released, and the next client to notice takes over.
+
+Semaphores ("acquire"/"release"): `slots` concurrent holders, with a minimum interval between grants enforced
+by a token bucket (burst `slots`, refilled at `slots / interval` per second) instead of by holding a slot.
+Slots held by a connection that goes away are released, so a crashed process can't leak them.
+
+Token buckets ("take"): a shared rate limit with `burst` capacity, refilled at `rate` tokens per second. Each
+request takes `cost` tokens; requests are served FIFO, so a cheap request can't starve an expensive one queued
+ahead of it. Taken tokens are spent, there is nothing to release.
+
+Messages are newline-delimited JSON. Client -> broker: {"op", "id", ...}. Broker -> client: {"id", "ok"}.
+"""
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, Optional, Set, Tuple
+from bot.utils.metrics import register_metrics
+import asyncio
+import logging
+import fcntl
+import json
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+BROKER_DIR = Path(os.getenv('BROKER_DIR', '/tmp/clyppybot_locks'))
+
+
+class BrokerUnavailable(ConnectionError):
+    """The connection to the broker was lost. State held through it is gone, callers should retry."""
+
+
+class _Conn:
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.requests: Dict[int, str] = {}  # request id -> semaphore name (waiting or held)
+        self.takes: Dict[int, str] = {}  # request id -> bucket name (waiting)
+
+    def send(self, msg: dict):
+        if not self.writer.is_closing():
+            self.writer.write(json.dumps(msg).encode() + b'\n')
+
+
+class _Semaphore:
+    def __init__(self, name: str, slots: int, interval: float):
+        self.name = name
+        self.holders: Set[Tuple[_Conn, int]] = set()
+        self.waiters: Deque[Tuple[_Conn, int]] = deque()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.configure(slots, interval)
+        self.tokens = float(self.slots)
+        self.updated = time.monotonic()
+
+    def configure(self, slots: int, interval: float):
+        self.slots = max(1, int(slots))
+        self.rate = self.slots / interval if interval > 0 else float('inf')
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(float(self.slots), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class _Bucket:
+    def __init__(self, name: str, rate: float, burst: float):
+        self.name = name
+        self.waiters: Deque[Tuple[_Conn, int, float]] = deque()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.configure(rate, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def configure(self, rate: float, burst: float):
+        self.rate = max(float(rate), 1e-6)
+        self.burst = max(float(burst), 1.0)
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def withdraw(self, conn: _Conn, req_id: int):
+        for waiter in self.waiters:
+            if waiter[0] is conn and waiter[1] == req_id:
+                self.waiters.remove(waiter)
+                return
+
+
+class LockBroker:
+    """The server side. Lives in whichever process won the election."""
+
+    def __init__(self):
+        self.semaphores: Dict[str, _Semaphore] = {}
+        self.buckets: Dict[str, _Bucket] = {}
+        self.grants = 0
+        self.tokens_taken = 0.0
+        self._handlers: Set[asyncio.Task] = set()
+
+    def accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # handlers are our own tasks (not the ones start_unix_server would make) so a shutdown just cancels them
+        task = asyncio.create_task(self.handle(reader, writer))
+        self._handlers.add(task)
+        task.add_done_callback(self._handlers.discard)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        conn = _Conn(writer)
+        try:
+            async for line in reader:
+                try:
+                    msg = json.loads(line)
+                except ValueError:
+                    continue
+                self.dispatch(conn, msg)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass  # the client went away, or this process's loop is shutting down
+        finally:
+            self.drop(conn)
+            writer.close()
+
+    def dispatch(self, conn: _Conn, msg: dict):
+        op = msg.get('op')
+        if op == 'acquire':
+            sem = self.semaphores.get(msg['name'])
+            if sem is None:
+                sem = self.semaphores[msg['name']] = _Semaphore(msg['name'], msg.get('slots', 1), msg.get('interval', 0))
+            else:
+                sem.configure(msg.get('slots', sem.slots), msg.get('interval', 0))
+            conn.requests[msg['id']] = sem.name
+            sem.waiters.append((conn, msg['id']))
+            self._grant(sem)
+        elif op == 'take':
+            bucket = self.buckets.get(msg['name'])
+            if bucket is None:
+                bucket = self.buckets[msg['name']] = _Bucket(msg['name'], msg.get('rate', 1), msg.get('burst', 1))
+            else:
+                bucket.configure(msg.get('rate', bucket.rate), msg.get('burst', bucket.burst))
+            # a request bigger than the bucket could never be served, so it just drains the bucket completely
+            cost = min(max(float(msg.get('cost', 1)), 0.0), bucket.burst)
+            conn.takes[msg['id']] = bucket.name
+            bucket.waiters.append((conn, msg['id'], cost))
+            self._drain(bucket)
+        elif op == 'release':
+            bucket = self.buckets.get(conn.takes.pop(msg['id'], None))
+            if bucket is not None:
+                bucket.withdraw(conn, msg['id'])  # cancelled while waiting for tokens
+                self._drain(bucket)
+                return
+            name = conn.requests.pop(msg['id'], None)
+            sem = self.semaphores.get(name)
+            if sem is not None:
+                sem.holders.discard((conn, msg['id']))
+                try:
+                    sem.waiters.remove((conn, msg['id']))  # released before it was granted (cancelled)
+                except ValueError:
+                    pass
+                self._grant(sem)
+
+    def drop(self, conn: _Conn):
+        """Forget everything a closed connection held or waited for"""
+        for req_id, name in list(conn.requests.items()):
+            sem = self.semaphores.get(name)
+            if sem is None:
+                continue
+            sem.holders.discard((conn, req_id))
+            try:
+                sem.waiters.remove((conn, req_id))
+            except ValueError:
+                pass
+            self._grant(sem)
+        conn.requests.clear()
+        for req_id, name in list(conn.takes.items()):
+            bucket = self.buckets.get(name)
+            if bucket is not None:
+                bucket.withdraw(conn, req_id)
+                self._drain(bucket)
+        conn.takes.clear()
+
+    def _grant(self, sem: _Semaphore):
+        if sem.timer is not None:
+            sem.timer.cancel()
+            sem.timer = None
+        sem.refill()
+        while sem.waiters and len(sem.holders) < sem.slots:
+            if sem.tokens < 1:
+                # wake up exactly when the next token is due
+                delay = (1 - sem.tokens) / sem.rate
+                sem.timer = asyncio.get_running_loop().call_later(delay, self._grant, sem)
+                return
+            conn, req_id = sem.waiters.popleft()
+            sem.tokens -= 1
+            sem.holders.add((conn, req_id))
+            self.grants += 1
+            conn.send({'id': req_id, 'ok': True})
+
+    def _drain(self, bucket: _Bucket):
+        if bucket.timer is not None:
+            bucket.timer.cancel()
+            bucket.timer = None
+        bucket.refill()
+        while bucket.waiters:
+            conn, req_id, cost = bucket.waiters[0]
+            if bucket.tokens < cost:
+                delay = (cost - bucket.tokens) / bucket.rate
+                bucket.timer = asyncio.get_running_loop().call_later(delay, self._drain, bucket)
+                return
+            bucket.waiters.popleft()
+            conn.takes.pop(req_id, None)
+            bucket.tokens -= cost
+            self.tokens_taken += cost
+            conn.send({'id': req_id, 'ok': True})
+
+
+class BrokerClient:
+    """Per-process connection to the broker, electing this process as the broker when there is none"""
+
+    def __init__(self, directory: Path = BROKER_DIR):
+        self.directory = directory
+        self.socket_path = directory / 'broker.sock'
+        self.lock_path = directory / 'broker.lock'
+        self._pid = os.getpid()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._connecting: Optional[asyncio.Lock] = None
+        self._pending: Dict[int, asyncio.Future] = {}
+        self._next_id = 0
+        self._election_file = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self.broker: Optional[LockBroker] = None
+        self.reconnects = 0
+
+    @property
+    def is_broker(self) -> bool:
+        return self._server is not None
+
+    def _reset_for_loop(self):
+        if self._pid != os.getpid():
+            # forked: the parent's connection, server and election lock belong to the parent
+            self._pid = os.getpid()
+            self._loop = None
+            if self._election_file is not None:
+                self._election_file.close()  # only drops our copy, the parent keeps its lock
+                self._election_file = None
+            self._server = None
+            self.broker = None
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # a new event loop (e.g. a second asyncio.run()): nothing from the old one can be reused
+            self._loop = loop
+            self._writer = None
+            self._reader_task = None
+            self._connecting = asyncio.Lock()
+            self._pending.clear()
+            if self._server is not None:
+                self._server = None
+                self.broker = None
+
+    async def _serve(self) -> bool:
+        """Become the broker if nobody else is. Returns False if another process holds the election lock."""
+        if self._election_file is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            f = open(self.lock_path, 'w')
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+                return False
+            self._election_file = f  # held for the life of the process, released by the OS if we die
+        if self._server is None:
+            try:
+                self.socket_path.unlink()  # left behind by a broker that died
+            except FileNotFoundError:
+                pass
+            self.broker = LockBroker()
+            self._server = await asyncio.start_unix_server(self.broker.accept, path=str(self.socket_path))
+            logger.info(f"[Broker] This process (pid {os.getpid()}) is now the lock broker")
+        return True
+
+    async def _connect(self):
+        self._reset_for_loop()
+        async with self._connecting:
+            if self._writer is not None and not self._writer.is_closing():
+                return
+            delay = 0.01
+            while True:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(str(self.socket_path))
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if not await self._serve():
+                        # another process won the election and is about to start listening
+                        await asyncio.sleep(delay)
+                        delay = min(0.5, delay * 2)
+            self._writer = writer
+            self._reader_task = asyncio.create_task(self._read(reader, writer))
+
+    async def _read(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            async for line in reader:
+                msg = json.loads(line)
+                fut = self._pending.pop(msg.get('id'), None)
+                if fut is not None and not fut.done():
+                    fut.set_result(msg)
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            if self._writer is writer:
+                self._writer = None
+                self.reconnects += 1
+            for fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(BrokerUnavailable("Lost connection to the lock broker"))
+            self._pending.clear()
+
+    def _send(self, msg: dict):
+        if self._writer is None or self._writer.is_closing():
+            raise BrokerUnavailable("Not connected to the lock broker")
+        self._writer.write(json.dumps(msg).encode() + b'\n')
+
+    async def request(self, op: str, **fields) -> int:
+        """Send a request and wait until the broker grants it. Returns the request id."""
+        await self._connect()
+        self._next_id += 1
+        req_id = self._next_id
+        fut = self._loop.create_future()
+        self._pending[req_id] = fut
+        self._send({'op': op, 'id': req_id, **fields})
+        try:
+            await fut
+        except asyncio.CancelledError:
+            self._pending.pop(req_id, None)
+            self.release(req_id)  # withdraws the request, or gives the slot back if it was just granted
+            raise
+        return req_id
+
+    def release(self, req_id: int):
+        try:
+            self._send({'op': 'release', 'id': req_id})
+        except BrokerUnavailable:
+            pass  # the broker that granted it is gone, and took the grant with it
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {'is_broker': self.is_broker, 'pending': len(self._pending), 'reconnects': self.reconnects}
+        if self.broker is not None:
+            stats['grants'] = self.broker.grants
+            stats['semaphores'] = {
+                name: {'slots': s.slots, 'held': len(s.holders), 'waiting': len(s.waiters)}
+                for name, s in self.broker.semaphores.items()
+            }
+            stats['tokens_taken'] = round(self.broker.tokens_taken, 2)
+            stats['buckets'] = {
+                name: {'rate': b.rate, 'burst': b.burst, 'tokens': round(b.tokens, 2), 'waiting': len(b.waiters)}
+                for name, b in self.broker.buckets.items()
+            }
+        return stats
+
+
+broker_client = BrokerClient()
+register_metrics('lock_broker', broker_client.stats)
@@ -1,7 +1,8 @@
 from abc import ABC, abstractmethod
 
 from yt_dlp import YoutubeDL
-from typing import Optional, Union
+from yt_dlp.utils import DownloadCancelled
+from typing import Callable, Optional, Union
 from pathlib import Path
 from PIL import Image
 from time import time
@@ -10,25 +11,32 @@ from moviepy.video.io.VideoFileClip import VideoFileClip
 from interactions import Message, SlashContext, TYPE_THREAD_CHANNEL, Embed, Permissions, Button, ButtonStyle, EmbedFooter
 from interactions.api.events import MessageCreate
 
-from bot.io.io import author_has_enough_tokens_for_ai_extend, check_text_is_nsfw
+from bot.io.io import author_has_enough_tokens_for_ai_extend, check_url_is_nsfw as nsfw_check_url
 from bot.tools.embedder import AutoEmbedder
+from bot.tools.scheduler import Priority
+from bot.tools import executors
+from bot.tools.executors import CancelToken
+from bot.tools.overload import controller as overload_controller
+from bot.utils import deadline
+from bot.utils.adaptive import leave_platform_slot
 from bot.io.cdn import CdnSpacesClient
-from bot.io import get_aiohttp_session, get_token_cost, push_interaction_error, author_has_enough_tokens, fetch_video_status
+from bot.io import get_aiohttp_session, get_token_cost, push_interaction_error, author_has_enough_tokens, fetch_video_statuses, token_ledger
+from bot.io.webhooks import webhook_aggregator
 from bot.types import LocalFileInfo, DownloadResponse, GuildType, COLOR_GREEN, COLOR_RED
 from bot.env import (EMBED_TXT_COMMAND, create_nexus_comps, APPUSE_LOG_WEBHOOK, EMBED_TOKEN_COST, MAX_VIDEO_LEN_SEC,
                      EMBED_TOTAL_MAX_LENGTH, EMBED_W_TOKEN_MAX_LEN, LOGGER_WEBHOOK, SUPPORT_SERVER_URL, VERSION,
                      CLYPPY_VOTE_URL, DL_SERVER_ID, YT_DLP_MAX_FILESIZE, MAX_FILE_SIZE_FOR_DISCORD, YT_DLP_USER_AGENT,
+                     YT_DLP_SOCKET_TIMEOUT,
                      MAX_VIDEO_LEN_FOR_EXTEND, MIN_VIDEO_LEN_FOR_EXTEND, BUY_TOKENS_URL, AI_EXTEND_TOKENS_COST,
                      GITHUB_URL, is_contrib_instance, log_api_bypass)
 from bot.errors import (NoDuration, UnknownError, UploadFailed, NoPermsToView, VideoTooLong, VideoLongerThanMaxLength,
                         IPBlockedError, VideoUnavailable, InvalidFileType, UnsupportedError, RemoteTimeoutError,
-                        YtDlpForbiddenError, UrlUnparsable, VideoSaidUnavailable, DefinitelyNoDuration,
+                        YtDlpForbiddenError, UrlUnparsable, VideoSaidUnavailable, DefinitelyNoDuration, DeadlineExceeded,
                         handle_yt_dlp_err, VideoTooShortForExtend, VideoTooLongForExtend, VideoExtensionFailed,
                         VideoContainsNSFWContent, ExceptionHandled)
 
-from urllib.parse import urlparse
 import hashlib
-import aiohttp
+import glob
 import logging
 import asyncio
 import random
@@ -41,6 +49,35 @@ def tryremove(f):
         pass
 
 
+def cancellable_ydl_opts(ydl_opts: dict, token: CancelToken, files: set, on_bytes: Callable[[int], None] = None) -> dict:
+    """
+    ydl_opts plus hooks that abort the download at its next progress update once token is cancelled,
+    and collect the files it writes in `files` so they can be removed if it doesn't finish.
+    on_bytes, if given, is called with the bytes downloaded so far.
+    """
+    def hook(status):
+        for key in ('tmpfilename', 'filename'):
+            if status.get(key):
+                files.add(status[key])
+        if on_bytes is not None and status.get('downloaded_bytes') is not None:
+            on_bytes(status['downloaded_bytes'])
+        if token.cancelled:
+            raise DownloadCancelled('Download cancelled')
+
+    return {
+        **ydl_opts,
+        'progress_hooks': [*ydl_opts.get('progress_hooks', []), hook],
+        'postprocessor_hooks': [*ydl_opts.get('postprocessor_hooks', []), hook],
+    }
+
+
+def remove_partial_files(files):
+    """Remove what an unfinished yt-dlp download left behind: the files themselves, .part/.ytdl and fragments"""
+    for f in files:
+        for path in (f, f + '.ytdl', *glob.glob(glob.escape(f) + '-Frag*'), *glob.glob(glob.escape(f) + '.part*')):
+            tryremove(path)
+
+
 def get_random_face():
     faces = ['(⌯˃̶᷄ ﹏ ˂̶᷄⌯)', '`ヽ(゜～゜o)ノ`', '( ͡ಠ ͜ʖ ͡ಠ)', '(╯°□°)╯︵ ┻━┻', '乁( ⁰͡ Ĺ̯ ⁰͡ ) ㄏ', r'¯\_(ツ)_/¯']
     return f'{random.choice(faces)}'
@@ -145,6 +182,9 @@ async def send_webhook(logger, content: Optional[str] = None, title: Optional[st
 
     if url is None:
         url = LOGGER_WEBHOOK
+    if url is None:
+        logger.info(f"No webhook url configured, not sending: {title}")
+        return
 
     # Create a rich embed
     if color is None:
@@ -162,22 +202,8 @@ async def send_webhook(logger, content: Optional[str] = None, title: Optional[st
             content = ""
         content += f"\n\n**{title}**\n{load}"
 
-    payload = {
-        "content": content,
-        "embeds": e
-    }
-
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.post(url, json=payload) as response:
-                if response.status == 204:
-                    logger.info(f"Successfully sent logger webhook: {load}")
-                else:
-                    logger.info(f"Failed to send logger webhook. Status: {response.status}")
-                return response.status
-        except Exception as e:
-            logger.info(f"Error sending log webhook: {str(e)}")
-            return None
+    # queued and batched with other log events, so this never waits on discord
+    webhook_aggregator.enqueue(url, content=content, embed=e[0] if e else None)
 
 
 def get_video_details(file_path) -> 'LocalFileInfo':
@@ -264,32 +290,28 @@ class BaseClip(ABC):
         self.duration = duration
         self.tokens_used = tokens_used
         self.clyppy_id = None
+        self.video_status = None  # status of clyppy_id, as returned by compute_clyppy_id()
         self.logger = logging.getLogger(__name__)
         self.title = None
 
     async def compute_clyppy_id(self):
-        # Generate new format (base62, 10-char) ID
+        # New format (base62, 10-char) IDs, with a fallback to the old format (base36, 8-char) for backward compatibility.
+        # Both are checked in a single batched status lookup.
         new_id = self._generate_clyppy_id(self._clyppy_id_input, low_collision=True)
+        old_id = self._generate_clyppy_id(self._clyppy_id_input, low_collision=False)
+        statuses = await fetch_video_statuses([new_id, old_id])
 
-        # Check if new format exists
-        status = await fetch_video_status(new_id)
-        if status['exists']:
+        if statuses[new_id]['exists']:
             self.clyppy_id = new_id
             self.logger.info(f"Found existing video with new ID format: {self.clyppy_id}")
-            return
-
-        # Fallback: check old format (base36, 8-char) for backward compatibility
-        old_id = self._generate_clyppy_id(self._clyppy_id_input, low_collision=False)
-        self.logger.info(f"Checking existance of old id: {old_id}")
-        status = await fetch_video_status(old_id)
-        if status['exists']:
+        elif statuses[old_id]['exists']:
             self.clyppy_id = old_id
             self.logger.info(f"Found existing video with old ID format: {self.clyppy_id}")
-            return
-
-        # No existing video found, use new format for new videos
-        self.clyppy_id = new_id
-        self.logger.info(f"Generated new clyppy ID (base62): {self.clyppy_id} for {self._clyppy_id_input}")
+        else:
+            # No existing video found, use new format for new videos
+            self.clyppy_id = new_id
+            self.logger.info(f"Generated new clyppy ID (base62): {self.clyppy_id} for {self._clyppy_id_input}")
+        self.video_status = statuses[self.clyppy_id]
 
     @property
     @abstractmethod
@@ -467,11 +489,7 @@ class BaseClip(ABC):
             fetch_cookies(ydl_opts, self.logger)
 
         try:
-            return await asyncio.get_event_loop().run_in_executor(
-                None,
-                self._extract_info,
-                ydl_opts
-            )
+            return await executors.extraction.run(self._extract_info, ydl_opts)
         except Exception as e:
             self.logger.error(f"Failed to get direct URL: {str(e)}")
             raise NoDuration
@@ -517,7 +535,7 @@ class BaseClip(ABC):
     async def dl_download(self, filename=None, dlp_format='best/bv*+ba', can_send_files=False, cookies=False, extra_opts=None) -> Optional[LocalFileInfo]:
         if os.path.isfile(filename):
             self.logger.info("file already exists! returning...")
-            return get_video_details(filename)
+            return await executors.media.run(get_video_details, filename)
 
         ydl_opts = {
             'format': dlp_format,
@@ -538,21 +556,29 @@ class BaseClip(ABC):
 
         if cookies: fetch_cookies(ydl_opts, self.logger)
 
+        # yt-dlp's default socket timeout is 20s, don't let one read outlast the embed
+        ydl_opts['socket_timeout'] = max(1.0, deadline.timeout(ydl_opts.get('socket_timeout', YT_DLP_SOCKET_TIMEOUT)))
+
+        written = {filename}
+
+        def download(token: CancelToken, on_bytes: Callable[[int], None]):
+            with YoutubeDL(cancellable_ydl_opts(ydl_opts, token, written, on_bytes)) as ydl:
+                ydl.download([self.url])
+
         try:
-            with YoutubeDL(ydl_opts) as ydl:
-                # Run download in a thread pool to avoid blocking
-                await asyncio.get_event_loop().run_in_executor(
-                    None,
-                    lambda: ydl.download([self.url])
-                )
+            try:
+                # Run download in a thread pool to avoid blocking, stopping it if we stop waiting for it
+                with overload_controller.carrying() as on_bytes:
+                    await executors.downloads.run_cancellable(download, on_bytes)
+            except (asyncio.CancelledError, DownloadCancelled):
+                # timed out, or shutting down: don't leave half a video behind
+                self.logger.info(f"Download of {self.id} cancelled, removing partial files")
+                remove_partial_files(written)
+                raise
 
             if os.path.exists(filename):
-                extracted = await asyncio.get_event_loop().run_in_executor(
-                    None,
-                    self._extract_info,
-                    ydl_opts
-                )
-                d = get_video_details(filename)
+                extracted = await executors.extraction.run(self._extract_info, ydl_opts)
+                d = await executors.media.run(get_video_details, filename)
                 d.video_name = extracted.video_name
                 if is_discord_compatible(d.filesize) and can_send_files:
                     self.logger.info(f"{self.id} can be uploaded to discord...")
@@ -562,6 +588,8 @@ class BaseClip(ABC):
 
             self.logger.info(f"dl_download error: Could not find file")
             raise FileNotFoundError
+        except DownloadCancelled:
+            raise
         except Exception as e:
             self.logger.error(f"yt-dlp download error: {str(e)}")
             handle_yt_dlp_err(str(e), filename)
@@ -586,10 +614,14 @@ class BaseClip(ABC):
                     raise Exception(f"Failed to overwrite clip data: {error_data.get('error', 'Unknown error')}")
 
     async def upload_to_clyppyio(self, local_file_info: LocalFileInfo) -> DownloadResponse:
+        leave_platform_slot()  # the platform is done with, an upload problem isn't it throttling us
+        deadline.check('the CDN upload', deadline.UPLOAD_MIN_BUDGET)
         try:
             success, remote_url = await self.cdn_client.cdn_upload_video(
                 file_path=local_file_info.local_file_path
             )
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             self.logger.error(f"Failed to upload video: {str(e)}")
             raise UploadFailed
@@ -650,7 +682,7 @@ class BaseClip(ABC):
                 raise Exception(f"[thumbnaill] ffmpeg failed: {result.stderr}")
             return output_path
 
-        result = await asyncio.get_event_loop().run_in_executor(None, run_ffmpeg)
+        result = await executors.media.run(run_ffmpeg)
 
         if not os.path.exists(output_path):
             raise Exception(f"[thumbnail] ffmpeg failed to create output file: {output_path}")
@@ -685,22 +717,24 @@ class BaseClip(ABC):
             
             # Use MoviePy to get the first frame, disable audio processing and set target resolution
             self.logger.info(f"Extracting first frame from {video_path}")
-            clip = VideoFileClip(video_path, audio=False, target_resolution=(None, 1080))
 
-            try:
-                # Get the first frame at t=0 (or slightly after to avoid potential issues with t=0)
-                frame = clip.get_frame(0)
-                
-                # Convert the numpy array to a PIL Image
-                img = Image.fromarray(frame)
-                
-                # Save the image as webp
-                img.save(output_path, 'webp', quality=85, method=6)
-                
-                self.logger.info(f"Successfully created webp thumbnail: {output_path}")
-                return output_path
-            finally:
-                clip.close()
+            def extract_frame():
+                clip = VideoFileClip(video_path, audio=False, target_resolution=(None, 1080))
+                try:
+                    # Get the first frame at t=0 (or slightly after to avoid potential issues with t=0)
+                    frame = clip.get_frame(0)
+
+                    # Convert the numpy array to a PIL Image
+                    img = Image.fromarray(frame)
+
+                    # Save the image as webp
+                    img.save(output_path, 'webp', quality=85, method=6)
+                finally:
+                    clip.close()
+
+            await executors.media.run(extract_frame)
+            self.logger.info(f"Successfully created webp thumbnail: {output_path}")
+            return output_path
 
         except Exception as e:
             self.logger.error(f"Error creating webp thumbnail for {video_path}: {str(e)}")
@@ -750,6 +784,7 @@ class BaseMisc(ABC):
         self.platform_name = None
         self.is_nsfw = False
         self.dl_timeout_secs = 600  # 10 min bc why not
+        self.short_clips_only = False  # its videos are short by nature (clips, TikToks...), never long videos
         self.bot = bot
         self.cdn_client = bot.cdn_client
 
@@ -767,12 +802,8 @@ class BaseMisc(ABC):
 
     @staticmethod
     async def check_url_is_nsfw(url):
-        parse = urlparse(url)
-        netloc = parse.netloc.lower()
-
-        # check if the netloc contains any nsfw trigger word
-        nsfw = await check_text_is_nsfw(netloc)
-        return nsfw
+        # domain allow/deny lists first, then the (cached) classifier on the netloc
+        return await nsfw_check_url(url)
 
     def is_clip_link(self, url: str) -> bool:
         """
@@ -780,6 +811,13 @@ class BaseMisc(ABC):
         """
         return bool(self.parse_clip_url(url))
 
+    def is_shortform_link(self, url: str) -> bool:
+        """
+            Whether the link is a short video without looking it up. Quickembeds for the others are the first to
+            go when the bot is overloaded.
+        """
+        return self.short_clips_only
+
     async def get_len(self, url: str, cookies=False, download=False, extra_opts=None) -> Optional[Union[float, LocalFileInfo]]:
         """
             Uses yt-dlp to check video length of the provided url
@@ -801,11 +839,14 @@ class BaseMisc(ABC):
         if download:
             # Add max filesize option when downloading
             ydl_opts['max_filesize'] = YT_DLP_MAX_FILESIZE
+        ydl_opts['socket_timeout'] = max(1.0, deadline.timeout(ydl_opts.get('socket_timeout', YT_DLP_SOCKET_TIMEOUT)))
+
+        written = set()
 
         try:
             # Run yt-dlp in an executor to avoid blocking
-            def get_duration() -> Optional[Union[float, LocalFileInfo]]:
-                with YoutubeDL(ydl_opts) as ydl:
+            def get_duration(token: CancelToken, on_bytes: Callable[[int], None]) -> Optional[Union[float, LocalFileInfo]]:
+                with YoutubeDL(cancellable_ydl_opts(ydl_opts, token, written, on_bytes)) as ydl:
                     info = ydl.extract_info(url, download=download)
                     if download:
                         # Handle different metadata structures
@@ -827,10 +868,17 @@ class BaseMisc(ABC):
                     else:
                         return info.get('duration', 0)
 
-            duration = await asyncio.get_event_loop().run_in_executor(
-                None, get_duration
-            )
+            # a download holds its thread much longer than a metadata lookup, keep them in separate pools
+            executor = executors.downloads if download else executors.extraction
+            try:
+                with overload_controller.carrying() as on_bytes:
+                    duration = await executor.run_cancellable(get_duration, on_bytes)
+            except (asyncio.CancelledError, DownloadCancelled):
+                remove_partial_files(written)
+                raise
             return duration
+        except DownloadCancelled:
+            raise
         except Exception as e:
             self.logger.error(f"Error downloading video for {url}: {str(e)}")
             handle_yt_dlp_err(str(e))
@@ -921,24 +969,7 @@ class BaseAutoEmbed:
         )
 
     async def fetch_tokens(self, user):
-        if is_contrib_instance(self.logger):
-            log_api_bypass(self.logger, "https://clyppy.io/api/tokens/get/", "GET", {"user_id": user.id})
-            return 999
-
-        url = 'https://clyppy.io/api/tokens/get/'
-        headers = {
-            'X-API-Key': os.getenv('clyppy_post_key'),
-            'Content-Type': 'application/json'
-        }
-        j = {'userid': user.id, 'username': user.username}
-        async with get_aiohttp_session() as session:
-            async with session.get(url, json=j, headers=headers) as response:
-                if response.status == 200:
-                    j = await response.json()
-                    return j['tokens']
-                else:
-                    error_data = await response.json()
-                    raise Exception(f"Failed to fetch user's VIP tokens: {error_data.get('error', 'Unknown error')}")
+        return await token_ledger.balance(user)
 
     async def send_help(self, ctx: Union[SlashContext, Message]):
         pre, cmds = "/", ""
@@ -1029,9 +1060,9 @@ class BaseAutoEmbed:
         if isinstance(ctx, SlashContext):
             await ctx.defer()
 
-        from bot.io.io import fetch_vote_ranking
+        from bot.io.io import cached_vote_ranking
         try:
-            data = await fetch_vote_ranking(ctx.user)
+            data = await cached_vote_ranking(ctx.user)
             if not data.get('success'):
                 await ctx.send("Failed to fetch vote ranking. Please try again later.")
                 return
@@ -1157,132 +1188,116 @@ class BaseAutoEmbed:
 
         requester_id = str(ctx.user.id)
 
-        # Fetch user stats from API
+        # Fetch user stats (served from cache when possible, refreshed in the background)
         try:
-            from bot.env import CLYPPYIO_USER_AGENT
-            params = {'requester_id': requester_id}
-            if user_id:
-                params['user_id'] = user_id
-            elif username:
-                params['username'] = username
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                    "https://clyppy.io/api/users/stats/",
-                    params=params,
-                    headers={
-                        "User-Agent": CLYPPYIO_USER_AGENT,
-                        'X-API-Key': os.getenv('clyppy_post_key'),
-                        'Content-Type': 'application/json'
-                    }
-                ) as response:
-                    data = await response.json()
-
-                    if response.status == 404 or not data.get('success'):
-                        # User not found - fall back to showing buttons
-                        if target_user:
-                            msg = f"**Check out this user's clip library!**"
-                            await ctx.send(content=msg, components=[
-                                Button(style=ButtonStyle.LINK, label=f"@{display_name}'s Clips", url=f"https://clyppy.io/clips/{display_name}")
-                            ])
-                        else:
-                            msg = f"**View and share your clip library with the world!**\n\nNo clip data found yet - share some clips to see your stats!"
-                            await ctx.send(content=msg, components=[
-                                Button(style=ButtonStyle.LINK, label=f"@{ctx.user.username}'s Clips", url=f"https://clyppy.io/clips/{ctx.user.username}"),
-                                Button(style=ButtonStyle.LINK, label="Manage my Profile", url=f"https://clyppy.io/profile/clips")
-                            ])
-                        return
+            from bot.io.io import cached_user_stats
+            data = await cached_user_stats(user_id=user_id, username=username, requester_id=requester_id)
+
+            if data.get('status') == 404 or not data.get('success'):
+                # User not found - fall back to showing buttons
+                if target_user:
+                    msg = f"**Check out this user's clip library!**"
+                    await ctx.send(content=msg, components=[
+                        Button(style=ButtonStyle.LINK, label=f"@{display_name}'s Clips", url=f"https://clyppy.io/clips/{display_name}")
+                    ])
+                else:
+                    msg = f"**View and share your clip library with the world!**\n\nNo clip data found yet - share some clips to see your stats!"
+                    await ctx.send(content=msg, components=[
+                        Button(style=ButtonStyle.LINK, label=f"@{ctx.user.username}'s Clips", url=f"https://clyppy.io/clips/{ctx.user.username}"),
+                        Button(style=ButtonStyle.LINK, label="Manage my Profile", url=f"https://clyppy.io/profile/clips")
+                    ])
+                return
 
-                    # Build embed with stats
-                    stats = data['data']
-                    username_display = stats.get('username') or display_name
-                    is_bot = stats.get('is_bot', False)
-                    is_private = stats.get('private_profile', False)
-                    bot_tag = " 🤖" if is_bot else ""
-                    private_tag = " private 🔒" if is_private else ""
-
-                    embed = Embed(
-                        title=f"{username_display}'s Profile{bot_tag}{private_tag}",
-                        color=0x5865F2
-                    )
+            # Build embed with stats
+            stats = data['data']
+            username_display = stats.get('username') or display_name
+            is_bot = stats.get('is_bot', False)
+            is_private = stats.get('private_profile', False)
+            bot_tag = " 🤖" if is_bot else ""
+            private_tag = " private 🔒" if is_private else ""
 
-                    # Statistics field (always shown)
-                    unique_clips = stats.get('unique_clip_count', 0)
-                    total_embeds = stats.get('total_embed_count', 0)
-                    servers_used = stats.get('servers_used', 0)
-                    vip_tokens = stats.get('vip_tokens', 0)
-
-                    stats_text = (
-                        f"🎬 **Unique Clips:** {unique_clips:,}\n"
-                        f"📊 **Total Embeds:** {total_embeds:,}\n"
-                        f"🌐 **Servers Used:** {servers_used:,}\n"
-                        f"💎 **VIP Tokens:** {vip_tokens:,}"
-                    )
-                    embed.add_field(name="Quick Stats", value=stats_text, inline=True)
-
-                    # Only show detailed stats if profile is not private
-                    if not is_private:
-                        # Platform breakdown field
-                        platform_breakdown = stats.get('platform_breakdown', {})
-                        if platform_breakdown:
-                            # Platform emoji mapping
-                            platform_emojis = {
-                                'twitch': '💜',
-                                'youtube': '🔴',
-                                'kick': '💚',
-                                'tiktok': '🎵',
-                                'medal': '🏅',
-                                'instagram': '📸',
-                                'x': '𝕏',
-                                'twitter': '𝕏'
-                            }
-                            platform_lines = []
-                            # Sort by percentage descending, take top 3
-                            sorted_platforms = sorted(
-                                platform_breakdown.items(),
-                                key=lambda x: x[1]['percentage'],
-                                reverse=True
-                            )[:3]
-                            for platform, info in sorted_platforms:
-                                emoji = platform_emojis.get(platform.lower(), '📹')
-                                platform_lines.append(f"{emoji} **{platform.capitalize()}:** {info['percentage']}%")
-
-                            if platform_lines:
-                                embed.add_field(name="Top Platforms", value="\n".join(platform_lines), inline=True)
-
-                        # Activity field
-                        first_embed = stats.get('first_embed_at')
-                        latest_embed = stats.get('latest_embed_at')
-                        if first_embed or latest_embed:
-                            activity_lines = []
-                            if first_embed:
-                                try:
-                                    first_dt = datetime.fromisoformat(first_embed.replace('Z', '+00:00'))
-                                    activity_lines.append(f"📅 **First:** {first_dt.strftime('%b %d, %Y')}")
-                                except Exception:
-                                    pass
-                            if latest_embed:
-                                try:
-                                    latest_dt = datetime.fromisoformat(latest_embed.replace('Z', '+00:00'))
-                                    activity_lines.append(f"🕐 **Latest:** {latest_dt.strftime('%b %d, %Y')}")
-                                except Exception:
-                                    pass
-                            if activity_lines:
-                                embed.add_field(name="📆 Activity", value="\n".join(activity_lines), inline=False)
-
-                        # Favorite platform in footer
-                        favorite = stats.get('favorite_platform')
-                        if favorite:
-                            embed.set_footer(text=f"⭐ Favorite Platform: {favorite.capitalize()}")
-
-                    # Send with buttons
-                    buttons = [
-                        Button(style=ButtonStyle.LINK, label=f"@{username_display}'s Clips", url=f"https://clyppy.io/clips/{username_display}")
-                    ]
-                    if not target_user:
-                        buttons.append(Button(style=ButtonStyle.LINK, label="Manage my Profile", url=f"https://clyppy.io/profile/clips"))
+            embed = Embed(
+                title=f"{username_display}'s Profile{bot_tag}{private_tag}",
+                color=0x5865F2
+            )
 
-                    await ctx.send(embed=embed, components=buttons)
+            # Statistics field (always shown)
+            unique_clips = stats.get('unique_clip_count', 0)
+            total_embeds = stats.get('total_embed_count', 0)
+            servers_used = stats.get('servers_used', 0)
+            vip_tokens = stats.get('vip_tokens', 0)
+
+            stats_text = (
+                f"🎬 **Unique Clips:** {unique_clips:,}\n"
+                f"📊 **Total Embeds:** {total_embeds:,}\n"
+                f"🌐 **Servers Used:** {servers_used:,}\n"
+                f"💎 **VIP Tokens:** {vip_tokens:,}"
+            )
+            embed.add_field(name="Quick Stats", value=stats_text, inline=True)
+
+            # Only show detailed stats if profile is not private
+            if not is_private:
+                # Platform breakdown field
+                platform_breakdown = stats.get('platform_breakdown', {})
+                if platform_breakdown:
+                    # Platform emoji mapping
+                    platform_emojis = {
+                        'twitch': '💜',
+                        'youtube': '🔴',
+                        'kick': '💚',
+                        'tiktok': '🎵',
+                        'medal': '🏅',
+                        'instagram': '📸',
+                        'x': '𝕏',
+                        'twitter': '𝕏'
+                    }
+                    platform_lines = []
+                    # Sort by percentage descending, take top 3
+                    sorted_platforms = sorted(
+                        platform_breakdown.items(),
+                        key=lambda x: x[1]['percentage'],
+                        reverse=True
+                    )[:3]
+                    for platform, info in sorted_platforms:
+                        emoji = platform_emojis.get(platform.lower(), '📹')
+                        platform_lines.append(f"{emoji} **{platform.capitalize()}:** {info['percentage']}%")
+
+                    if platform_lines:
+                        embed.add_field(name="Top Platforms", value="\n".join(platform_lines), inline=True)
+
+                # Activity field
+                first_embed = stats.get('first_embed_at')
+                latest_embed = stats.get('latest_embed_at')
+                if first_embed or latest_embed:
+                    activity_lines = []
+                    if first_embed:
+                        try:
+                            first_dt = datetime.fromisoformat(first_embed.replace('Z', '+00:00'))
+                            activity_lines.append(f"📅 **First:** {first_dt.strftime('%b %d, %Y')}")
+                        except Exception:
+                            pass
+                    if latest_embed:
+                        try:
+                            latest_dt = datetime.fromisoformat(latest_embed.replace('Z', '+00:00'))
+                            activity_lines.append(f"🕐 **Latest:** {latest_dt.strftime('%b %d, %Y')}")
+                        except Exception:
+                            pass
+                    if activity_lines:
+                        embed.add_field(name="📆 Activity", value="\n".join(activity_lines), inline=False)
+
+                # Favorite platform in footer
+                favorite = stats.get('favorite_platform')
+                if favorite:
+                    embed.set_footer(text=f"⭐ Favorite Platform: {favorite.capitalize()}")
+
+            # Send with buttons
+            buttons = [
+                Button(style=ButtonStyle.LINK, label=f"@{username_display}'s Clips", url=f"https://clyppy.io/clips/{username_display}")
+            ]
+            if not target_user:
+                buttons.append(Button(style=ButtonStyle.LINK, label="Manage my Profile", url=f"https://clyppy.io/profile/clips"))
+
+            await ctx.send(embed=embed, components=buttons)
 
         except Exception as e:
             self.logger.error(f"Error fetching user stats: {e}")
@@ -1327,15 +1342,25 @@ class BaseAutoEmbed:
 
         from bot.utils.pagination import UserRankPagination, UserRankPaginationState, ENTRIES_PER_PAGE
 
-        requester_id = str(ctx.author.id)
+        from bot.io.io import stats_cache
 
-        # Find which page the user is on
-        user_page = await UserRankPagination.find_user_page(user_id, time_period, requester_id, include_bots)
+        requester_id = str(ctx.author.id)
 
-        if user_page is None:
-            # Cache may be stale — clear it and retry once before giving up
-            UserRankPagination.CACHE.clear()
-            user_page = await UserRankPagination.find_user_page(user_id, time_period, requester_id, include_bots)
+        async def locate_user():
+            # Find which page the user is on
+            page = await UserRankPagination.find_user_page(user_id, time_period, requester_id, include_bots)
+            if page is None and UserRankPagination.invalidate_rank_index(time_period, include_bots):
+                # Cache may be stale — rebuild it and retry once before giving up
+                page = await UserRankPagination.find_user_page(user_id, time_period, requester_id, include_bots)
+            if page is None:
+                return None, None
+            # Fetch ranking data for the user's page
+            return page, await UserRankPagination.fetch_ranking_data(page=page, time_period=time_period, requester_id=requester_id, include_bots=include_bots)
+
+        user_page, data = await stats_cache.get(
+            ('profile-rank', user_id, time_period, include_bots), locate_user,
+            should_cache=lambda result: result[1] is not None and result[1].get("success")
+        )
 
         if user_page is None:
             await ctx.send(embed=Embed(
@@ -1346,9 +1371,6 @@ class BaseAutoEmbed:
             ))
             return
 
-        # Fetch ranking data for the user's page
-        data = await UserRankPagination.fetch_ranking_data(page=user_page, time_period=time_period, requester_id=requester_id, include_bots=include_bots)
-
         if not data.get("success"):
             await ctx.send(embed=Embed(
                 title="❌ Error",
@@ -1461,11 +1483,12 @@ class BaseAutoEmbed:
                 ))
                 return
 
-            if platform.is_nsfw is None:
-                # verify for base platform, that it's not flagged as nsfw
-                platform.is_nsfw = await platform.check_url_is_nsfw(url)
+            is_nsfw = platform.is_nsfw
+            if is_nsfw is None:
+                # verify for base platform, that it's not flagged as nsfw (per url, the base platform handles any domain)
+                is_nsfw = await platform.check_url_is_nsfw(url)
 
-            if platform.is_nsfw and not nsfw_enabed:
+            if is_nsfw and not nsfw_enabed:
                 asyncio.create_task(ctx.send(
                     f"( ͡~ ͜ʖ ͡°) This platform is not allowed in this channel. You can either:\n"
                     f" - If you're a server admin, go to `Edit Channel > Overview` and toggle `Age-Restricted Channel`\n"
@@ -1549,15 +1572,17 @@ class BaseAutoEmbed:
             url=url,
             amt=platform.dl_timeout_secs
         ))
-        main_task = asyncio.create_task(self._main_embed_task(
-            ctx=ctx,
-            url=url,
-            platform=platform,
-            slug=slug,
-            platform_name=p,
-            guild=guild,
-            extend_with_ai=extend_with_ai
-        ))
+        # every stage under the main task can see how much of the timeout is left
+        with deadline.deadline_after(platform.dl_timeout_secs):
+            main_task = asyncio.create_task(self._main_embed_task(
+                ctx=ctx,
+                url=url,
+                platform=platform,
+                slug=slug,
+                platform_name=p,
+                guild=guild,
+                extend_with_ai=extend_with_ai
+            ))
         done, pending = await asyncio.wait(
             [main_task, timeout_task],
             return_when=asyncio.FIRST_COMPLETED
@@ -1610,7 +1635,8 @@ class BaseAutoEmbed:
                 # for logging response times - it hasn't been set up for slash commands yet
                 self.embedder.clip_id_msg_timestamps[ctx.id] = datetime.now().timestamp()
 
-            clip = await self.embedder.platform_tools.get_clip(url, extended_url_formats=True, basemsg=ctx)
+            clip = await self.bot.tools.dl.get_clip(self.embedder.platform_tools, url, priority=Priority.COMMAND,
+                                                    extended_url_formats=True, basemsg=ctx)
             if extend_with_ai:
                 can_extend, tokens_used, user_tokens = await author_has_enough_tokens_for_ai_extend(ctx, clip.url)
                 if not can_extend:
@@ -1630,7 +1656,8 @@ class BaseAutoEmbed:
                 respond_to=ctx,
                 guild=guild,
                 try_send_files=True,
-                extend_with_ai=extend_with_ai
+                extend_with_ai=extend_with_ai,
+                priority=Priority.COMMAND
             )
             success, response = True, "Success"
         except FileNotFoundError:  # ytdlp failed to download the file, but the output wasn't captured
@@ -1653,6 +1680,11 @@ class BaseAutoEmbed:
             response_msg = f"The url returned 'Timeout Error'. Maybe there's an issue with the site at the moment... {get_random_face()}"
             asyncio.create_task(ctx.send(response_msg, components=create_nexus_comps()))
             success, response, err_handled = False, "RemoteTimeout", True
+        except DeadlineExceeded as e:
+            # stopped before a stage that couldn't have finished before _handle_timeout would fire
+            response_msg = f"The timeout of {platform.dl_timeout_secs // 60}m would have been reached before I could finish `{url}`, please try again later..."
+            asyncio.create_task(ctx.send(response_msg, components=create_nexus_comps()))
+            success, response, err_handled = False, f"DeadlineExceeded ({e.stage})", True
         except UrlUnparsable:
             response_msg = f"I couldn't parse that url. Did you enter it correctly?"
             asyncio.create_task(ctx.send(response_msg, components=create_nexus_comps()))
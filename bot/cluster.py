@@ -0,0 +1,259 @@
+"""Cluster mode: run the bot's shards across several worker processes.
+
+With CLUSTER_WORKERS set (a number, or "auto" for one per CPU core), `python main.py` becomes a supervisor.
+It asks Discord how many shards to run (or uses CLUSTER_TOTAL_SHARDS), splits them into contiguous ranges,
+and runs one `main.py` worker process per range, restarting workers that crash. Each worker has its own event
+loop and GIL, so a CPU-heavy embed only slows down the guilds on its own shards.
+
+Workers share what has to be shared through the host:
+- guild settings: the same sqlite file. The supervisor loads it from the server before starting the workers and
+  saves it after they stop. In between, the primary worker (cluster 0) saves it periodically.
+- rate limits, identify pacing and ShardLocks: the lock broker (bot/broker.py)
+- in-flight downloads: the lease table (bot/leases.py)
+- guild and user counts: every worker reports its own to CLUSTER_DIR, and whoever posts stats sums them up
+
+and keeps the rest to itself:
+- the local spool (bot/io/spool.py): each worker has its own SPOOL_DB_PATH (spool_<cluster id>.db), so no two
+  drainers ship the same records. A restarted worker picks up where its predecessor left off.
+- the task queue: data/task_queue_<cluster id>.pkl
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from bot.shardlock import ShardLock
+from bot.io.spool import SPOOL_DB_PATH
+from bot.utils.eventloop import add_signal_handler
+from pathlib import Path
+from os import getenv
+import asyncio
+import logging
+import aiohttp
+import signal
+import json
+import time
+import sys
+import os
+
+logger = logging.getLogger(__name__)
+
+CLUSTER_DIR = Path(getenv('CLUSTER_DIR', '/tmp/clyppybot_cluster'))
+CLUSTER_STATS_STALE_AFTER = 60 * 15  # workers report at least every status update (5 minutes)
+CLUSTER_TOTALS_CACHE_SECONDS = 30
+WORKER_RESTART_BACKOFF_MAX = 60
+WORKER_SHUTDOWN_TIMEOUT = 60 * 4  # workers wait up to 3 minutes for active embeds themselves
+IDENTIFY_INTERVAL = 5.1  # Discord allows one identify per max_concurrency bucket every 5 seconds
+
+
+def configured_workers() -> int:
+    """Number of worker processes asked for with CLUSTER_WORKERS, 0 when cluster mode is off"""
+    value = getenv('CLUSTER_WORKERS', '').strip().lower()
+    if value == 'auto':
+        return os.cpu_count() or 1
+    try:
+        return max(0, int(value))
+    except ValueError:
+        return 0
+
+
+def shard_ranges(total_shards: int, workers: int) -> List[range]:
+    """Split shards 0..total_shards-1 into `workers` contiguous ranges, as evenly as possible"""
+    workers = max(1, min(workers, total_shards))
+    base, extra = divmod(total_shards, workers)
+    ranges, start = [], 0
+    for i in range(workers):
+        size = base + (1 if i < extra else 0)
+        ranges.append(range(start, start + size))
+        start += size
+    return ranges
+
+
+class ClusterInfo:
+    """What this process is: a standalone bot, a cluster supervisor, or one of its workers"""
+
+    def __init__(self, cluster_id: Optional[int] = None, shard_ids: Optional[List[int]] = None,
+                 total_shards: Optional[int] = None):
+        self.id = cluster_id
+        self.shard_ids = shard_ids or []
+        self.total_shards = total_shards
+        self._totals: Optional[Tuple[int, int]] = None
+        self._totals_at = 0.0
+
+    @classmethod
+    def from_env(cls) -> 'ClusterInfo':
+        if getenv('CLUSTER_ID') is None:
+            return cls()
+        shard_ids = [int(s) for s in getenv('CLUSTER_SHARD_IDS', '').split(',') if s]
+        return cls(int(getenv('CLUSTER_ID')), shard_ids, int(getenv('CLUSTER_TOTAL_SHARDS')))
+
+    @property
+    def is_worker(self) -> bool:
+        return self.id is not None
+
+    @property
+    def is_supervisor(self) -> bool:
+        return not self.is_worker and configured_workers() > 0
+
+    @property
+    def is_primary(self) -> bool:
+        """Whether this process runs the once-per-bot jobs (db saves, monthly winner...)"""
+        return not self.is_worker or self.id == 0
+
+    def client_kwargs(self) -> Dict[str, Any]:
+        """Extra AutoShardedClient arguments, so a worker only runs its own shards"""
+        if not self.is_worker:
+            return {}
+        return {'total_shards': self.total_shards, 'shard_ids': self.shard_ids}
+
+    def task_queue_file(self) -> str:
+        if not self.is_worker:
+            return "data/task_queue.pkl"
+        return f"data/task_queue_{self.id}.pkl"
+
+    def identify_lock(self, client, shard_id: int) -> Optional[ShardLock]:
+        """Paces identifies per max_concurrency bucket across every worker on the host"""
+        if not self.is_worker:
+            return None  # a single process is paced by AutoShardedClient.astart()
+        bucket = shard_id % max(1, getattr(client, 'max_start_concurrency', 1))
+        return ShardLock.get(f'identify_{bucket}', max_concurrent=1, min_interval=IDENTIFY_INTERVAL)
+
+    def report(self, bot):
+        """Write this worker's guild and user counts for the others to aggregate"""
+        if not self.is_worker:
+            return
+        stats = {
+            'guilds': len(bot.guilds),
+            'users': sum(guild.member_count or 0 for guild in bot.guilds),
+            'shards': self.shard_ids,
+            'pid': os.getpid(),
+            'updated_at': time.time(),
+        }
+        try:
+            CLUSTER_DIR.mkdir(parents=True, exist_ok=True)
+            tmp = CLUSTER_DIR / f'worker_{self.id}.json.tmp'
+            tmp.write_text(json.dumps(stats))
+            tmp.replace(CLUSTER_DIR / f'worker_{self.id}.json')
+        except OSError as e:
+            logger.warning(f"[Cluster] Failed to report worker stats: {e}")
+        self._totals = None
+
+    def totals(self, bot) -> Tuple[int, int]:
+        """(guild count, user count) across the whole bot"""
+        if not self.is_worker:
+            return len(bot.guilds), sum(guild.member_count or 0 for guild in bot.guilds)
+        if self._totals is not None and time.monotonic() - self._totals_at < CLUSTER_TOTALS_CACHE_SECONDS:
+            return self._totals
+
+        guilds = users = 0
+        seen_self = False
+        now = time.time()
+        for path in CLUSTER_DIR.glob('worker_*.json'):
+            try:
+                stats = json.loads(path.read_text())
+            except (OSError, ValueError):
+                continue
+            if path.name == f'worker_{self.id}.json':
+                seen_self = True
+                stats['guilds'] = len(bot.guilds)
+                stats['users'] = sum(guild.member_count or 0 for guild in bot.guilds)
+            elif now - stats.get('updated_at', 0) > CLUSTER_STATS_STALE_AFTER:
+                continue  # that worker is gone, its guilds aren't being served
+            guilds += stats.get('guilds', 0)
+            users += stats.get('users', 0)
+        if not seen_self:
+            guilds += len(bot.guilds)
+            users += sum(guild.member_count or 0 for guild in bot.guilds)
+
+        self._totals = (guilds, users)
+        self._totals_at = time.monotonic()
+        return self._totals
+
+
+cluster = ClusterInfo.from_env()
+
+
+async def recommended_shards(token: str) -> Tuple[int, int]:
+    """(shard count, max identify concurrency) recommended by Discord for this bot"""
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot",
+                               headers={'Authorization': f'Bot {token}'}) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+    return data['shards'], data['session_start_limit']['max_concurrency']
+
+
+class Supervisor:
+    def __init__(self, workers: int, script: str, on_start: Callable[[], Awaitable] = None,
+                 on_stop: Callable[[], Awaitable] = None):
+        self.workers = workers
+        self.script = script
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.ranges: List[range] = []
+        self.total_shards = 0
+        self._procs: Dict[int, asyncio.subprocess.Process] = {}
+        self._shutting_down = False
+
+    def _worker_env(self, cluster_id: int) -> Dict[str, str]:
+        env = dict(os.environ)
+        env.pop('CLUSTER_WORKERS', None)  # workers must not become supervisors themselves
+        env['CLUSTER_ID'] = str(cluster_id)
+        env['CLUSTER_SHARD_IDS'] = ','.join(str(s) for s in self.ranges[cluster_id])
+        env['CLUSTER_TOTAL_SHARDS'] = str(self.total_shards)
+        base, ext = os.path.splitext(SPOOL_DB_PATH)
+        env['SPOOL_DB_PATH'] = f"{base}_{cluster_id}{ext}"
+        return env
+
+    async def _run_worker(self, cluster_id: int):
+        backoff = 1.0
+        shards = self.ranges[cluster_id]
+        while not self._shutting_down:
+            started = time.monotonic()
+            proc = await asyncio.create_subprocess_exec(sys.executable, self.script, env=self._worker_env(cluster_id))
+            self._procs[cluster_id] = proc
+            logger.info(f"[Cluster] Worker {cluster_id} (pid {proc.pid}) started for shards {shards.start}-{shards.stop - 1}")
+            code = await proc.wait()
+            if self._shutting_down:
+                break
+            if time.monotonic() - started > 300:
+                backoff = 1.0  # it ran fine for a while, this isn't a crash loop
+            logger.warning(f"[Cluster] Worker {cluster_id} exited with code {code}, restarting in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(WORKER_RESTART_BACKOFF_MAX, backoff * 2)
+
+    async def _stop_workers(self):
+        self._shutting_down = True
+        for proc in self._procs.values():
+            if proc.returncode is None:
+                proc.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(asyncio.gather(*(p.wait() for p in self._procs.values())), WORKER_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("[Cluster] Workers didn't stop in time, killing them")
+            for proc in self._procs.values():
+                if proc.returncode is None:
+                    proc.kill()
+
+    async def run(self, token: str):
+        recommended, max_concurrency = await recommended_shards(token)
+        self.total_shards = int(getenv('CLUSTER_TOTAL_SHARDS', 0)) or recommended
+        self.ranges = shard_ranges(self.total_shards, self.workers)
+        logger.info(f"[Cluster] Running {self.total_shards} shards across {len(self.ranges)} workers "
+                    f"(identify concurrency {max_concurrency})")
+
+        if self.on_start is not None:
+            await self.on_start()
+
+        shutdown_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            add_signal_handler(loop, sig, shutdown_event.set)
+
+        runners = [asyncio.create_task(self._run_worker(i)) for i in range(len(self.ranges))]
+        await shutdown_event.wait()
+        logger.info("[Cluster] Shutting down workers...")
+        await self._stop_workers()
+        for runner in runners:
+            runner.cancel()
+        await asyncio.gather(*runners, return_exceptions=True)
+
+        if self.on_stop is not None:
+            await self.on_stop()
+        logger.info("[Cluster] Shutdown complete")
@@ -29,6 +29,7 @@ def create_nexus_comps():
 
 
 YT_DLP_MAX_FILESIZE = 1610612736 * 4  # 6GB in bytes (1.5 * 1024 * 1024 * 1024 * 4) should handle most 3 hour videos
+YT_DLP_SOCKET_TIMEOUT = 20  # yt-dlp's own default
 
 YT_DLP_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:133.0) Gecko/20100101 Firefox/133.0"
 
@@ -39,6 +40,7 @@ APPUSE_LOG_WEBHOOK = os.getenv('APPUSE_WEBHOOK')
 
 VERSION = "2.1.8"
 CLYPPYIO_USER_AGENT = f"ClyppyBot/{VERSION}"
+CLYPPYIO_API_BASE = os.getenv('CLYPPYIO_API_BASE', "https://clyppy.io")
 
 AI_EXTEND_TOKENS_COST = 10
 
@@ -128,6 +128,38 @@ class IPBlockedError(Exception):
     pass
 
 
+class ApiUnavailable(Exception):
+    """The clyppy.io API couldn't be reached in time (timeouts, connection errors, or the circuit breaker is open)"""
+    def __init__(self, endpoint: str, reason: str = None):
+        self.endpoint = endpoint
+        self.reason = reason
+        super().__init__(f"clyppy.io API unavailable for '{endpoint}': {reason}")
+
+
+class QueueWaitTimeout(Exception):
+    """Work waited too long for a free slot in a WorkScheduler and was dropped before it started"""
+    def __init__(self, scheduler: str, waited: float):
+        self.scheduler = scheduler
+        self.waited = waited
+        super().__init__(f"Waited over {waited}s for a free '{scheduler}' slot")
+
+
+class DeadlineExceeded(Exception):
+    """Not enough time was left before the embed's deadline to start a stage of it"""
+    def __init__(self, stage: str, remaining: float):
+        self.stage = stage
+        self.remaining = remaining
+        super().__init__(f"Only {max(0.0, remaining):.1f}s left before the deadline, not starting {stage}")
+
+
+class GuildQueueFull(Exception):
+    """A guild already has as many quickembeds waiting as it's allowed to"""
+    def __init__(self, guild_id, queued: int):
+        self.guild_id = guild_id
+        self.queued = queued
+        super().__init__(f"Guild {guild_id} already has {queued} quickembeds waiting")
+
+
 class RateLimitExceededError(Exception):
     def __init__(self, resets_when, *args):
         super().__init__(*args)
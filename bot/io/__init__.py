@@ -1,3 +1,3 @@
 from bot.io.io import (get_aiohttp_session, is_404, author_has_enough_tokens, author_has_premium, fetch_video_status,
-                       callback_clip_delete_msg, add_reqqed_by, get_clip_info, subtract_tokens, refresh_clip,
-                       get_token_cost, push_interaction_error)
+                       fetch_video_statuses, callback_clip_delete_msg, add_reqqed_by, get_clip_info, subtract_tokens,
+                       refresh_clip, get_token_cost, push_interaction_error, fetch_tokens, token_ledger)
@@ -1,8 +1,11 @@
 import boto3
 from botocore.client import Config
 from os import getenv, path
+from bot.tools import executors
+from bot.tools.overload import controller as overload_controller
+from bot.utils.membudget import memory_budget
+from bot.errors import DeadlineExceeded
 import logging
-import asyncio
 
 
 class CdnSpacesClient:
@@ -21,19 +24,13 @@ class CdnSpacesClient:
         filename = path.basename(file_path)
         self.logger.info(f"Uploading video {file_path} to CDN...")
         try:
-            # Read file in a non-blocking way
-            with open(file_path, 'rb') as file:
-                video_data = file.read()
-
-            # Call put_video in a thread pool to avoid blocking the event loop
-            result = await asyncio.get_event_loop().run_in_executor(
-                None,
-                self.put_video,
-                video_data,
-                filename,
-                storage_type
-            )
-            return result
+            # Read and upload in the storage pool to avoid blocking the event loop, the whole file is read in memory
+            size = path.getsize(file_path)
+            async with memory_budget.hold(size):
+                with overload_controller.carrying(size):
+                    return await executors.storage.run(self._upload_file, file_path, filename, storage_type)
+        except DeadlineExceeded:
+            raise
         except Exception as e:
             self.logger.error(f"Error uploading video {file_path}: {str(e)}")
             return False, str(e)
@@ -42,9 +39,10 @@ class CdnSpacesClient:
         filename = file_path.split("/")[-1]
         cdn_patj = f"img/{filename}"
         self.logger.info(f"Uploading {filename} to {cdn_patj}")
-        with open(file_path, 'rb') as file:
-            img_data = file.read()
-        try:
+
+        def put_webp():
+            with open(file_path, 'rb') as file:
+                img_data = file.read()
             self.client.put_object(
                 Bucket='clyppy',
                 Key=cdn_patj,
@@ -52,11 +50,19 @@ class CdnSpacesClient:
                 ACL='public-read',
                 ContentType='image/webp'
             )
+
+        try:
+            await executors.storage.run(put_webp)
             return True, f"https://cdn.clyppy.io/{cdn_patj}"
         except Exception as e:
             self.logger.info(f"Error uploading {filename}: {str(e)}")
             return False, str(e)
 
+    def _upload_file(self, file_path, filename, storage_type="temp") -> tuple[bool, str]:
+        with open(file_path, 'rb') as file:
+            video_data = file.read()
+        return self.put_video(video_data, filename, storage_type)
+
     def put_video(self, video_data, filename, storage_type="temp") -> tuple[bool, str]:
         object_key = f"{storage_type}/{filename}"
         cdn_file_url = f"https://cdn.clyppy.io/{object_key}"
@@ -0,0 +1,276 @@
+"""Shared client for the clyppy.io API.
+
+Every call to clyppy.io goes through ClyppyApiClient.request(), which applies:
+ - a per-endpoint deadline (total time across all attempts) and per-attempt timeout, both capped to what's
+   left before the caller's own deadline (bot/utils/deadline.py)
+ - bounded retries with full jitter, only for idempotent endpoints
+ - a circuit breaker that fails fast while the backend keeps failing
+ - per-endpoint latency histograms (see the owner-only /metrics command)
+"""
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+from bot.env import CLYPPYIO_USER_AGENT, CLYPPYIO_API_BASE
+from bot.errors import ApiUnavailable
+from bot.utils.metrics import register_metrics, LatencyHistogram
+from bot.utils import deadline as caller_deadline
+import aiohttp
+import asyncio
+import logging
+import random
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class EndpointPolicy:
+    deadline: float  # total seconds allowed across every attempt
+    attempt_timeout: float  # seconds allowed for a single attempt
+    retries: int = 0  # extra attempts after the first, only used when idempotent
+    idempotent: bool = False
+
+
+DEFAULT_POLICY = EndpointPolicy(deadline=10, attempt_timeout=10)
+
+ENDPOINT_POLICIES: Dict[str, EndpointPolicy] = {
+    # reads - safe to retry
+    'get-status': EndpointPolicy(deadline=6, attempt_timeout=2.5, retries=2, idempotent=True),
+    'get-statuses': EndpointPolicy(deadline=6, attempt_timeout=2.5, retries=2, idempotent=True),
+    'clip-info': EndpointPolicy(deadline=6, attempt_timeout=2.5, retries=2, idempotent=True),
+    'check-nsfw': EndpointPolicy(deadline=4, attempt_timeout=2, retries=1, idempotent=True),
+    'get-tokens': EndpointPolicy(deadline=6, attempt_timeout=2.5, retries=2, idempotent=True),
+    'has-premium': EndpointPolicy(deadline=4, attempt_timeout=2, retries=1, idempotent=True),
+    'user-stats': EndpointPolicy(deadline=8, attempt_timeout=4, retries=1, idempotent=True),
+    'vote-ranking': EndpointPolicy(deadline=8, attempt_timeout=4, retries=1, idempotent=True),
+    'previous-winner': EndpointPolicy(deadline=10, attempt_timeout=5, retries=1, idempotent=True),
+    'pending-votes': EndpointPolicy(deadline=10, attempt_timeout=5, retries=1, idempotent=True),
+    'mark-notified': EndpointPolicy(deadline=10, attempt_timeout=5, retries=1, idempotent=True),  # marking twice is harmless
+    # writes - a retry could apply the change twice, so only one attempt
+    'subtract-tokens': EndpointPolicy(deadline=10, attempt_timeout=10),
+    'refresh-clip': EndpointPolicy(deadline=10, attempt_timeout=10),
+    'publish': EndpointPolicy(deadline=15, attempt_timeout=15),
+    'publish-error': EndpointPolicy(deadline=8, attempt_timeout=8),
+    'add-requested-by': EndpointPolicy(deadline=10, attempt_timeout=10),
+    'msg-get-delete': EndpointPolicy(deadline=10, attempt_timeout=10),
+    'overwrite': EndpointPolicy(deadline=10, attempt_timeout=10),
+}
+
+RETRY_BASE_DELAY = 0.2
+RETRY_MAX_DELAY = 2.0
+
+
+class CircuitBreaker:
+    """
+    Classic closed -> open -> half-open breaker.
+    After `failure_threshold` consecutive failed requests the circuit opens, and every call fails fast
+    for `reset_timeout` seconds. Then a single trial request is let through; its outcome closes or re-opens it.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+
+    def allow(self) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._trial_in_flight = False
+        # half-open: only one trial request at a time
+        if self._trial_in_flight:
+            return False
+        self._trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self._trial_in_flight = False
+        if self.state != self.CLOSED:
+            logger.info("[ApiClient] Circuit closed, clyppy.io is healthy again")
+        self.state = self.CLOSED
+
+    def abandon_trial(self):
+        """The trial request ended without an outcome (it was cancelled...), let the next call be the trial"""
+        if self.state == self.HALF_OPEN:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        self._trial_in_flight = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"[ApiClient] Circuit opened after {self.consecutive_failures} consecutive failures")
+                self.times_opened += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'state': self.state,
+            'consecutive_failures': self.consecutive_failures,
+            'times_opened': self.times_opened,
+        }
+
+
+@dataclass
+class ApiResponse:
+    status: int
+    data: Any  # parsed JSON body, or None if the body wasn't JSON
+    text: str
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+
+def _is_transient(status: int) -> bool:
+    return status >= 500 or status == 429
+
+
+class ClyppyApiClient:
+    """One shared aiohttp session and resilience layer for every clyppy.io endpoint."""
+
+    def __init__(self, base_url: str = None, breaker: CircuitBreaker = None,
+                 policies: Dict[str, EndpointPolicy] = None):
+        self.base_url = (base_url or CLYPPYIO_API_BASE).rstrip('/')
+        self.breaker = breaker or CircuitBreaker()
+        self.policies = dict(ENDPOINT_POLICIES if policies is None else policies)
+        self.histograms: Dict[str, LatencyHistogram] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._session_loop = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._session_loop is not loop:
+            self._session = aiohttp.ClientSession(headers={"User-Agent": CLYPPYIO_USER_AGENT})
+            self._session_loop = loop
+        return self._session
+
+    def policy_for(self, endpoint: str) -> EndpointPolicy:
+        return self.policies.get(endpoint, DEFAULT_POLICY)
+
+    def _histogram(self, endpoint: str) -> LatencyHistogram:
+        if endpoint not in self.histograms:
+            self.histograms[endpoint] = LatencyHistogram()
+        return self.histograms[endpoint]
+
+    def url_for(self, path: str) -> str:
+        if path.startswith('http'):
+            return path
+        return f"{self.base_url}{path}"
+
+    async def request(self, endpoint: str, method: str, path: str, *, json_body: Any = None,
+                      params: Dict[str, Any] = None, headers: Dict[str, str] = None,
+                      deadline: float = None) -> ApiResponse:
+        """
+        Send a request to clyppy.io.
+
+        Args:
+            endpoint: Name of the endpoint, used to look up its EndpointPolicy and histogram
+            method: HTTP method
+            path: Path relative to the API base (or an absolute url)
+            json_body: JSON payload
+            params: Query string parameters
+            headers: Extra request headers
+            deadline: Overrides the policy's total deadline (seconds) when smaller
+
+        Returns:
+            ApiResponse for the last attempt. 5xx/429 responses are returned (not raised) once retries run out.
+
+        Raises:
+            ApiUnavailable: If the circuit is open, or every attempt timed out / failed to connect
+        """
+        policy = self.policy_for(endpoint)
+        total = policy.deadline if deadline is None else min(policy.deadline, deadline)
+        left = caller_deadline.remaining()
+        cut_short = left is not None and left < total  # the caller runs out of time before the endpoint would
+        if cut_short:
+            if left <= 0:
+                # before allow(), so a request that never goes out can't take the half-open trial
+                raise ApiUnavailable(endpoint, "no time left before the caller's deadline")
+            total = left
+        if not self.breaker.allow():
+            self._histogram(endpoint).observe(0, error=True)
+            raise ApiUnavailable(endpoint, "circuit open")
+
+        give_up_at = time.monotonic() + total
+        attempts = 1 + (policy.retries if policy.idempotent else 0)
+        url = self.url_for(path)
+        is_trial = self.breaker.state == CircuitBreaker.HALF_OPEN
+        try:
+            last_error = None
+            last_response = None
+
+            for attempt in range(attempts):
+                remaining = give_up_at - time.monotonic()
+                if remaining <= 0:
+                    break
+                timeout = aiohttp.ClientTimeout(total=min(policy.attempt_timeout, remaining))
+                start = time.monotonic()
+                try:
+                    async with self._get_session().request(method, url, json=json_body, params=params,
+                                                           headers=headers, timeout=timeout) as response:
+                        text = await response.text()
+                        try:
+                            data = json.loads(text) if text else None
+                        except ValueError:
+                            data = None
+                        last_response = ApiResponse(status=response.status, data=data, text=text)
+                    self._histogram(endpoint).observe(time.monotonic() - start, error=_is_transient(last_response.status))
+                    if not _is_transient(last_response.status):
+                        self.breaker.record_success()
+                        return last_response
+                    last_error = f"server returned {last_response.status}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    self._histogram(endpoint).observe(time.monotonic() - start, error=True)
+                    last_error = f"{type(e).__name__}: {e}"
+                    last_response = None
+
+                if attempt + 1 < attempts:
+                    # full jitter backoff, never sleeping past the deadline
+                    backoff = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+                    backoff = min(backoff, max(0.0, give_up_at - time.monotonic()))
+                    logger.info(f"[ApiClient] {endpoint} attempt {attempt + 1}/{attempts} failed ({last_error}), retrying in {backoff:.2f}s")
+                    await asyncio.sleep(backoff)
+
+            if cut_short and last_response is None:
+                # giving up early for the caller's sake says nothing about the backend: don't count a failure,
+                # but let the next request be the trial
+                if is_trial:
+                    self.breaker.abandon_trial()
+            else:
+                self.breaker.record_failure()
+            if last_response is not None:
+                return last_response
+            raise ApiUnavailable(endpoint, last_error or "deadline exceeded")
+        finally:
+            if is_trial:
+                # a trial that was cancelled (or cut short) never recorded an outcome; without this, the circuit
+                # would wait for it forever and stay open
+                self.breaker.abandon_trial()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'breaker': self.breaker.snapshot(),
+            'endpoints': {name: h.snapshot() for name, h in sorted(self.histograms.items())},
+        }
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+api_client = ClyppyApiClient()
+register_metrics('clyppy_api', api_client.stats)
+
@@ -2,13 +2,22 @@ from interactions import SlashContext, Message
 
 from bot.env import (CLYPPYIO_USER_AGENT, MAX_VIDEO_LEN_SEC, EMBED_W_TOKEN_MAX_LEN, EMBED_TOTAL_MAX_LENGTH,
                      EMBED_TOKEN_COST, DL_SERVER_ID, AI_EXTEND_TOKENS_COST, is_contrib_instance, log_api_bypass)
-from typing import Tuple, Union
+from typing import Tuple, Union, List, Dict
 from math import ceil
+from functools import lru_cache
 from os import getenv
 import aiohttp
 import logging
 
-from bot.errors import VideoLongerThanMaxLength
+from bot.errors import VideoLongerThanMaxLength, ApiUnavailable
+from bot.io.client import api_client
+from bot.io.status import VideoStatusBatcher, BatchUnsupported
+from bot.io.spool import spool
+from bot.io.ledger import TokenLedger
+from bot.io.journal import token_journal
+from bot.io.nsfw import NsfwVerdictCache
+from bot.utils.cache import StaleWhileRevalidateCache
+from bot.utils.metrics import register_metrics
 
 logger = logging.getLogger(__name__)
 
@@ -18,36 +27,89 @@ def get_aiohttp_session():
     return aiohttp.ClientSession(headers={"User-Agent": CLYPPYIO_USER_AGENT})
 
 
-async def check_text_is_nsfw(text: str):
-    url = f"https://clyppy.io/api/check-nsfw/?text={text}"
-    if is_contrib_instance(logger):
-        log_api_bypass(logger, url, "GET", {})
-    async with get_aiohttp_session() as session:
-        async with session.get(url) as response:
-            if response.status >= 500:
-                logger.warning(f"[CHECK-TEXT-NSFW] Server error {response.status}. API may be down. Error was: {text}")
-                return True
-            r = await response.json()
-            if nsfw := r.get('is_nsfw'):
-                return nsfw
-
-            logger.warning(f"[CHECK-TEXT-NSFW] Invalid response. Returning true")
-            return True
+def _api_key_headers(**extra):
+    headers = {
+        'X-API-Key': getenv('clyppy_post_key'),
+        'Content-Type': 'application/json'
+    }
+    headers.update(extra)
+    return headers
 
 
-async def fetch_video_status(clip_id: str):
+async def _classify_text_nsfw(text: str):
+    """Ask the clyppy.io classifier. Returns None if it couldn't give a verdict."""
+    url = api_client.url_for("/api/check-nsfw/")
     if is_contrib_instance(logger):
-        log_api_bypass(logger, "https://clyppy.io/api/clips/get-status/", "GET", {"clip_id": clip_id})
-        return {"exists": False, "code": 200}
+        log_api_bypass(logger, url, "GET", {"text": text})
+    try:
+        response = await api_client.request('check-nsfw', 'GET', url, params={'text': text})
+    except ApiUnavailable as e:
+        logger.warning(f"[CHECK-TEXT-NSFW] {e}. Returning true")
+        return None
+    if response.status >= 500:
+        logger.warning(f"[CHECK-TEXT-NSFW] Server error {response.status}. API may be down. Error was: {text}")
+        return None
+    r = response.data or {}
+    if nsfw := r.get('is_nsfw'):
+        return nsfw
+
+    logger.warning(f"[CHECK-TEXT-NSFW] Invalid response. Returning true")
+    return None
+
 
-    url = 'https://clyppy.io/api/clips/get-status/'
+nsfw_cache = NsfwVerdictCache(classify=_classify_text_nsfw)
+register_metrics('nsfw_cache', nsfw_cache.stats)
+
+
+async def check_url_is_nsfw(url: str):
+    return await nsfw_cache.check_url(url)
+
+
+async def _fetch_single_video_status(clip_id: str) -> dict:
     headers = {
         'auth': getenv('clyppy_post_key'),
         'Content-Type': 'application/json'
     }
-    async with get_aiohttp_session() as session:
-        async with session.get(url, json={'clip_id': clip_id}, headers=headers) as response:
-            return await response.json()
+    response = await api_client.request('get-status', 'GET', '/api/clips/get-status/',
+                                        json_body={'clip_id': clip_id}, headers=headers)
+    if response.data is None:
+        raise Exception(f"Failed to fetch video status: (Server returned code: {response.status})")
+    return response.data
+
+
+async def _fetch_batch_video_status(clip_ids: List[str]) -> Dict[str, dict]:
+    headers = {
+        'auth': getenv('clyppy_post_key'),
+        'Content-Type': 'application/json'
+    }
+    response = await api_client.request('get-statuses', 'POST', '/api/clips/get-statuses/',
+                                        json_body={'clip_ids': clip_ids}, headers=headers)
+    if response.status in (404, 405):
+        raise BatchUnsupported()
+    if response.status != 200 or not isinstance(response.data, dict) or 'statuses' not in response.data:
+        raise Exception(f"Failed to fetch video statuses: (Server returned code: {response.status})")
+    return response.data['statuses']
+
+
+status_batcher = VideoStatusBatcher(fetch_many=_fetch_batch_video_status, fetch_one=_fetch_single_video_status)
+register_metrics('video_status_batcher', status_batcher.stats)
+
+
+async def fetch_video_status(clip_id: str):
+    if is_contrib_instance(logger):
+        log_api_bypass(logger, "https://clyppy.io/api/clips/get-status/", "GET", {"clip_id": clip_id})
+        return {"exists": False, "code": 200}
+
+    return await status_batcher.get(clip_id)
+
+
+async def fetch_video_statuses(clip_ids: List[str]) -> Dict[str, dict]:
+    """Look up several clip ids at once. Concurrent lookups from other embeds are merged into the same request."""
+    if is_contrib_instance(logger):
+        log_api_bypass(logger, "https://clyppy.io/api/clips/get-statuses/", "POST", {"clip_ids": clip_ids})
+        return {clip_id: {"exists": False, "code": 200} for clip_id in clip_ids}
+
+    return await status_batcher.get_many(clip_ids)
 
 
 async def push_interaction_error(parent_msg: Union[Message, SlashContext], clip_url, platform_name: str, error_info: dict, handled: bool, clip=None, logger=None):
@@ -61,62 +123,48 @@ async def push_interaction_error(parent_msg: Union[Message, SlashContext], clip_
         })
         return None
 
-    url = 'https://clyppy.io/api/clips/publish/error/'
-    headers = {
-        'X-API-Key': getenv('clyppy_post_key'),
-        'Content-Type': 'application/json'
-    }
-
     video_id = None
     if clip is not None:
         video_id = clip.clyppy_id
 
-    video_platform = platform_name.lower()
-    video_url = clip_url
-    error_name = error_info['name']
-    error_msg = error_info['msg']
-
+    # spooled locally and shipped in the background, the failure path never waits on the network
+    spool.append('interaction_error', {
+        'clyppy_id_ctx': video_id,
+        'error_type': error_info['name'],
+        'error_message': error_info['msg'],
+        'video_url': clip_url,
+        'video_platform': platform_name.lower(),
+        'username': parent_msg.author.username or f"User_{parent_msg.author.id}",
+        'user_id': parent_msg.author.id,
+        'handled': handled,
+    })
+    return None
+
+
+async def _send_interaction_error(body: dict) -> bool:
+    """Spool sender for push_interaction_error(). Returns False if it should be retried later."""
     try:
-        async with get_aiohttp_session() as session:
-            async with session.post(url, json={
-                'clyppy_id_ctx': video_id,
-                'error_type': error_name,
-                'error_message': error_msg,
-                'video_url': video_url,
-                'video_platform': video_platform,
-                'username': parent_msg.author.username or f"User_{parent_msg.author.id}",
-                'user_id': parent_msg.author.id,
-                'handled': handled,
-            }, headers=headers) as response:
-                response_text = await response.text()
-
-                # Check for Cloudflare errors (500, 502, 503, 504)
-                if response.status >= 500:
-                    if 'cloudflare' in response_text.lower():
-                        if logger:
-                            logger.warning(f"Cloudflare error when pushing interaction error (status {response.status}). API may be down. Error was: {error_name}")
-                        return None  # Silently fail - the main error was already logged
-                    else:
-                        if logger:
-                            logger.error(f"Server error {response.status} when pushing interaction error: {response_text[:200]}")
-                        return None
-
-                if response.status != 201:
-                    if logger:
-                        logger.warning(f"Failed to push interaction error (status {response.status}): {response_text[:200]}")
-                    return None
-                else:
-                    return await response.json()
-    except aiohttp.ClientError as e:
-        # Handle connection errors, timeouts, etc.
-        if logger:
-            logger.warning(f"Network error when pushing interaction error: {e}")
-        return None
-    except Exception as e:
-        # Catch any other unexpected errors
-        if logger:
-            logger.error(f"Unexpected error when pushing interaction error: {e}")
-        return None
+        response = await api_client.request('publish-error', 'POST', '/api/clips/publish/error/', json_body=body,
+                                            headers=_api_key_headers())
+    except ApiUnavailable as e:
+        # Handle connection errors, timeouts, open circuit
+        logger.info(f"Network error when pushing interaction error: {e}")
+        return False
+
+    # Check for Cloudflare errors (500, 502, 503, 504)
+    if response.status >= 500:
+        if 'cloudflare' in response.text.lower():
+            logger.warning(f"Cloudflare error when pushing interaction error (status {response.status}). API may be down. Error was: {body['error_type']}")
+        else:
+            logger.error(f"Server error {response.status} when pushing interaction error: {response.text[:200]}")
+        return False
+
+    if response.status != 201:
+        logger.warning(f"Failed to push interaction error (status {response.status}): {response.text[:200]}")
+    return True
+
+
+spool.register_sender('interaction_error', _send_interaction_error)
 
 
 async def is_404(url: str, logger=None) -> Tuple[bool, int]:
@@ -136,16 +184,9 @@ async def add_reqqed_by(data, key):
         log_api_bypass(logger, "https://clyppy.io/api/clips/add-requested-by/", "POST", data)
         return {"success": True, "msg": "[test] success", "code": 201}
 
-    async with get_aiohttp_session() as session:
-        async with session.post(
-                'https://clyppy.io/api/clips/add-requested-by/',
-                json=data,
-                headers={
-                    'X-API-Key': key,
-                    'Content-Type': 'application/json'
-                }
-        ) as response:
-            return await response.json()
+    response = await api_client.request('add-requested-by', 'POST', '/api/clips/add-requested-by/', json_body=data,
+                                        headers={'X-API-Key': key, 'Content-Type': 'application/json'})
+    return response.data
 
 
 async def callback_clip_delete_msg(data, key, ctx_type: str = "StoredVideo") -> dict:
@@ -153,17 +194,10 @@ async def callback_clip_delete_msg(data, key, ctx_type: str = "StoredVideo") ->
         log_api_bypass(logger, "https://clyppy.io/api/clips/msg-get-delete/", "POST", data)
         return {"success": True, "msg": "[test] Successfully deleted", "code": 200}
 
-    async with get_aiohttp_session() as session:
-        async with session.post(
-                'https://clyppy.io/api/clips/msg-get-delete/',
-                json=data,
-                headers={
-                    'X-API-Key': key,
-                    'Request-Type': ctx_type,
-                    'Content-Type': 'application/json'
-                }
-        ) as response:
-            return await response.json()
+    response = await api_client.request('msg-get-delete', 'POST', '/api/clips/msg-get-delete/', json_body=data,
+                                        headers={'X-API-Key': key, 'Request-Type': ctx_type,
+                                                 'Content-Type': 'application/json'})
+    return response.data
 
 
 async def get_clip_info(clip_id: str, ctx_type='StoredVideo'):
@@ -171,21 +205,25 @@ async def get_clip_info(clip_id: str, ctx_type='StoredVideo'):
         log_api_bypass(logger, f"https://clyppy.io/api/clips/get/{clip_id}", "GET", {"ctx_type": ctx_type})
         return {'success': False, 'error': '[test] Clip not found', 'code': 404}
 
-    url = f"https://clyppy.io/api/clips/get/{clip_id}"
-    headers = {
-        'X-API-Key': getenv('clyppy_post_key'),
-        'Request-Type': ctx_type,
-        'Content-Type': 'application/json'
+    response = await api_client.request('clip-info', 'GET', f"/api/clips/get/{clip_id}",
+                                        headers=_api_key_headers(**{'Request-Type': ctx_type}))
+    if response.status == 200:
+        return response.data
+    elif response.status == 404:
+        return {'match': False}
+    else:
+        raise Exception(f"Failed to get clip info: (Server returned code: {response.status})")
+
+
+def _token_change_body(user, amt, clip_url: str = None, reason: str = None, description: str = None) -> dict:
+    return {
+        'userid': user.id,
+        'username': user.username or f"User_{user.id}",
+        'amount': amt,
+        'reason': 'Clyppy Embed' if reason is None else reason,
+        'original_url': clip_url,
+        'description': description,
     }
-    async with get_aiohttp_session() as session:
-        async with session.get(url, headers=headers) as response:
-            if response.status == 200:
-                j = await response.json()
-                return j
-            elif response.status == 404:
-                return {'match': False}
-            else:
-                raise Exception(f"Failed to get clip info: (Server returned code: {response.status})")
 
 
 async def subtract_tokens(user, amt, clip_url: str=None, reason: str=None, description: str=None):
@@ -197,29 +235,20 @@ async def subtract_tokens(user, amt, clip_url: str=None, reason: str=None, descr
         })
         return {"success": True, "user_success": True, "tokens": 999}
 
-    if reason is None:
-        reason = 'Clyppy Embed'
+    j = _token_change_body(user, amt, clip_url, reason, description)
+    response = await api_client.request('subtract-tokens', 'POST', '/api/tokens/subtract/', json_body=j,
+                                        headers=_api_key_headers())
+    if response.status == 200:
+        return response.data
+    else:
+        error_data = response.data or {}
+        raise Exception(f"Failed to subtract user's VIP tokens: {error_data.get('error', 'Unknown error')}")
 
-    url = 'https://clyppy.io/api/tokens/subtract/'
-    headers = {
-        'X-API-Key': getenv('clyppy_post_key'),
-        'Content-Type': 'application/json'
-    }
-    j = {
-        'userid': user.id,
-        'username': user.username or f"User_{user.id}",
-        'amount': amt,
-        'reason': reason,
-        'original_url': clip_url,
-        'description': description,
-    }
-    async with get_aiohttp_session() as session:
-        async with session.post(url, json=j, headers=headers) as response:
-            if response.status == 200:
-                return await response.json()
-            else:
-                error_data = await response.json()
-                raise Exception(f"Failed to subtract user's VIP tokens: {error_data.get('error', 'Unknown error')}")
+
+def _record_token_change(user, amt, clip_url: str = None, reason: str = None, description: str = None,
+                         error: str = None):
+    """Keep a token debit/refund the ledger couldn't confirm, for reconciliation (see bot/io/journal.py)"""
+    token_journal.record(int(user.id), amt, _token_change_body(user, amt, clip_url, reason, description), error)
 
 
 async def refresh_clip(clip_id: str, user_id: int):
@@ -227,15 +256,13 @@ async def refresh_clip(clip_id: str, user_id: int):
         log_api_bypass(logger, f"https://clyppy.io/api/clips/refresh/{clip_id}", "POST", {"user_id": user_id})
         return {"success": True, "msg": "[test] would initate refresh", "code": 200}
 
-    url = f"https://clyppy.io/api/clips/refresh/{clip_id}"
     head = {
         'X-Discord-User-Id': str(user_id),
         'Not-Encoded': 'true',
         'Ignore-User-Check': 'true'
     }
-    async with get_aiohttp_session() as session:
-        async with session.post(url, headers=head) as response:
-            return await response.json()
+    response = await api_client.request('refresh-clip', 'POST', f"/api/clips/refresh/{clip_id}", headers=head)
+    return response.data
 
 
 async def author_has_premium(user):
@@ -244,17 +271,43 @@ async def author_has_premium(user):
         log_api_bypass(logger, "https://clyppy.io/api/users/has-premium", "POST", {"user_id": str(user.id)})
         return True
 
-    url = f"https://clyppy.io/api/users/has-premium"
     head = {
         'X-Discord-User-Id': str(user.id)
     }
-    async with get_aiohttp_session() as session:
-        async with session.post(url, headers=head) as response:
-            resp = await response.json()
-            if resp['success']:
-                return resp['premium']
+    try:
+        response = await api_client.request('has-premium', 'POST', "/api/users/has-premium", headers=head)
+    except ApiUnavailable as e:
+        logger.warning(f"author_has_premium: {e}")
+        return False
+    resp = response.data or {}
+    if resp.get('success'):
+        return resp['premium']
 
-            return False
+    return False
+
+
+async def fetch_tokens(user) -> int:
+    """Fetch the user's token balance from clyppy.io (use token_ledger.balance() for the cached value)"""
+    if is_contrib_instance(logger):
+        log_api_bypass(logger, "https://clyppy.io/api/tokens/get/", "GET", {"user_id": user.id})
+        return 999
+
+    j = {'userid': user.id, 'username': user.username}
+    response = await api_client.request('get-tokens', 'GET', '/api/tokens/get/', json_body=j, headers=_api_key_headers())
+    if response.status == 200:
+        return response.data['tokens']
+    else:
+        error_data = response.data or {}
+        raise Exception(f"Failed to fetch user's VIP tokens: {error_data.get('error', 'Unknown error')}")
+
+
+token_ledger = TokenLedger(fetch_balance=fetch_tokens, debit=subtract_tokens, journal=_record_token_change)
+register_metrics('token_ledger', token_ledger.stats)
+
+
+@lru_cache(maxsize=None)
+def _token_cost_for_bucket(bucket: int) -> int:
+    return EMBED_TOKEN_COST * bucket  # 1 token per 30 minutes of additional time
 
 
 def get_token_cost(video_dur):
@@ -266,15 +319,15 @@ def get_token_cost(video_dur):
     if video_dur <= MAX_VIDEO_LEN_SEC:
         return 0
 
-    # Calculate tokens only for the portion exceeding the free limit
+    # Calculate tokens only for the portion exceeding the free limit, in EMBED_W_TOKEN_MAX_LEN buckets
     extra_duration = video_dur - MAX_VIDEO_LEN_SEC
-    return EMBED_TOKEN_COST * ceil(extra_duration / EMBED_W_TOKEN_MAX_LEN)  # 1 token per 30 minutes of additional time
+    return _token_cost_for_bucket(ceil(extra_duration / EMBED_W_TOKEN_MAX_LEN))
 
 
 async def author_has_enough_tokens_for_ai_extend(msg, url: str):
     # -> bool-> can extend video, int-> number of tokens used, int->current tokens after embed
     user = msg.author
-    sub = await subtract_tokens(
+    sub = await token_ledger.debit(
         user=user,
         amt=AI_EXTEND_TOKENS_COST,
         clip_url=url,
@@ -285,7 +338,7 @@ async def author_has_enough_tokens_for_ai_extend(msg, url: str):
         if sub['user_success']:  # the user had enough tokens to subtract successfully
             return True, AI_EXTEND_TOKENS_COST, sub['tokens']
 
-    return False, 0, None
+    return False, 0, sub.get('tokens')
 
 
 async def fetch_vote_ranking(user):
@@ -300,29 +353,73 @@ async def fetch_vote_ranking(user):
             "vote_month": "2026-01"
         }
 
-    url = 'https://clyppy.io/api/votes/ranking/'
-    headers = {
-        'X-API-Key': getenv('clyppy_post_key'),
-        'Content-Type': 'application/json'
-    }
     j = {'userid': user.id}
-    async with get_aiohttp_session() as session:
-        async with session.get(url, json=j, headers=headers) as response:
-            return await response.json()
+    response = await api_client.request('vote-ranking', 'GET', '/api/votes/ranking/', json_body=j,
+                                        headers=_api_key_headers())
+    return response.data
+
+
+async def fetch_user_stats(user_id: str = None, username: str = None, requester_id: str = None) -> dict:
+    """
+    Fetch a user's clip stats by discord id or clyppy username.
+    Returns the API response, with 'status' added. Raises ApiUnavailable when clyppy.io can't answer.
+    """
+    params = {'requester_id': requester_id}
+    if user_id:
+        params['user_id'] = user_id
+    elif username:
+        params['username'] = username
+
+    if is_contrib_instance(logger):
+        log_api_bypass(logger, "https://clyppy.io/api/users/stats/", "GET", params)
+        return {'success': False, 'status': 404}
+
+    response = await api_client.request('user-stats', 'GET', '/api/users/stats/', params=params,
+                                        headers=_api_key_headers())
+    if response.status >= 500 or response.status == 429:
+        raise ApiUnavailable('user-stats', f"status {response.status}")
+    data = dict(response.data or {})
+    data['status'] = response.status
+    return data
+
+
+# /profile and /rank style lookups: anything under a minute old is shown as is, anything under an hour old is
+# shown right away and refreshed in the background
+stats_cache = StaleWhileRevalidateCache(soft_ttl=60, hard_ttl=3600)
+register_metrics('stats_cache', stats_cache.stats)
+
+
+def _is_cacheable_stats(data) -> bool:
+    return isinstance(data, dict) and (data.get('success') or data.get('status') == 404)
+
+
+async def cached_user_stats(user_id: str = None, username: str = None, requester_id: str = None) -> dict:
+    # private profiles look different to their owner, so the requester is part of the key unless we know it's someone else
+    viewer = requester_id if user_id is None or requester_id == user_id else None
+    key = ('profile', user_id or (username or '').lower(), viewer)
+    return await stats_cache.get(key, lambda: fetch_user_stats(user_id, username, requester_id),
+                                 should_cache=_is_cacheable_stats)
+
+
+async def cached_vote_ranking(user) -> dict:
+    return await stats_cache.get(('vote-rank', user.id), lambda: fetch_vote_ranking(user),
+                                 should_cache=lambda d: isinstance(d, dict) and bool(d.get('success')))
 
 
 async def get_pending_vote_notifications(limit: int = 50) -> list:
     if is_contrib_instance(logger):
         log_api_bypass(logger, "https://clyppy.io/api/internal/votes/pending-notifications", "GET")
         return []
-    url = 'https://clyppy.io/api/internal/votes/pending-notifications'
-    headers = {'X-API-Key': getenv('clyppy_post_key'), 'Content-Type': 'application/json'}
-    async with get_aiohttp_session() as session:
-        async with session.get(url, params={'limit': limit}, headers=headers) as response:
-            if response.status == 200:
-                return await response.json()
-            logger.warning(f"get_pending_vote_notifications returned {response.status}")
-            return []
+    try:
+        response = await api_client.request('pending-votes', 'GET', '/api/internal/votes/pending-notifications',
+                                            params={'limit': limit}, headers=_api_key_headers())
+    except ApiUnavailable as e:
+        logger.warning(f"get_pending_vote_notifications: {e}")
+        return []
+    if response.status == 200:
+        return response.data
+    logger.warning(f"get_pending_vote_notifications returned {response.status}")
+    return []
 
 
 async def mark_votes_notified(ids: list) -> None:
@@ -331,12 +428,10 @@ async def mark_votes_notified(ids: list) -> None:
     if is_contrib_instance(logger):
         log_api_bypass(logger, "https://clyppy.io/api/internal/votes/mark-notified", "POST", {'ids': ids})
         return
-    url = 'https://clyppy.io/api/internal/votes/mark-notified'
-    headers = {'X-API-Key': getenv('clyppy_post_key'), 'Content-Type': 'application/json'}
-    async with get_aiohttp_session() as session:
-        async with session.post(url, json={'ids': ids}, headers=headers) as response:
-            if response.status != 200:
-                logger.warning(f"mark_votes_notified returned {response.status}")
+    response = await api_client.request('mark-notified', 'POST', '/api/internal/votes/mark-notified',
+                                        json_body={'ids': ids}, headers=_api_key_headers())
+    if response.status != 200:
+        logger.warning(f"mark_votes_notified returned {response.status}")
 
 
 async def fetch_previous_vote_winner():
@@ -345,14 +440,9 @@ async def fetch_previous_vote_winner():
         log_api_bypass(logger, "https://clyppy.io/api/votes/previous-winner/", "GET")
         return {"success": True, "winners": [], "vote_month": "2026-01"}
 
-    url = 'https://clyppy.io/api/votes/previous-winner/'
-    headers = {
-        'X-API-Key': getenv('clyppy_post_key'),
-        'Content-Type': 'application/json'
-    }
-    async with get_aiohttp_session() as session:
-        async with session.get(url, headers=headers) as response:
-            return await response.json()
+    response = await api_client.request('previous-winner', 'GET', '/api/votes/previous-winner/',
+                                        headers=_api_key_headers())
+    return response.data
 
 
 async def author_has_enough_tokens(msg, video_dur, url: str) -> tuple[bool, int, int]:
@@ -373,7 +463,7 @@ async def author_has_enough_tokens(msg, video_dur, url: str) -> tuple[bool, int,
             return video_dur <= EMBED_W_TOKEN_MAX_LEN, 0, video_dur
 
         cost = get_token_cost(video_dur)
-        sub = await subtract_tokens(
+        sub = await token_ledger.debit(
             user=user,
             amt=cost,
             clip_url=url
@@ -0,0 +1,98 @@
+"""Local record of token changes clyppy.io may not have applied, kept for manual reconciliation.
+
+When a background debit or refund fails, the bot can't tell whether the server applied it (a timeout after
+the server committed looks the same as one before), and /api/tokens/subtract/ has no de-duplication, so
+sending it again could charge or refund a user twice. These changes are written here instead of the spool:
+nothing trims, expires or retries them, and each one is logged at error level.
+
+    python -m bot.io.journal               list the unresolved changes
+    python -m bot.io.journal --resolve ID  mark one as reconciled
+"""
+from typing import Any, Dict, List, Optional
+from bot.utils.metrics import register_metrics
+from os import getenv
+import logging
+import sqlite3
+import json
+import time
+import sys
+
+logger = logging.getLogger(__name__)
+
+TOKEN_JOURNAL_PATH = getenv('TOKEN_JOURNAL_PATH', 'token_journal.db')
+
+
+class TokenJournal:
+    def __init__(self, path: str = TOKEN_JOURNAL_PATH):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        # metrics
+        self.recorded = 0
+        self.failed = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            # shared by every process on the host, so wait on a busy database instead of failing
+            self._conn = sqlite3.connect(self.path, isolation_level=None, timeout=10)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS token_changes (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    amount INTEGER NOT NULL,
+                    body TEXT NOT NULL,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    resolved_at REAL
+                )
+            """)
+        return self._conn
+
+    def record(self, user_id: int, amount: int, body: dict, error: str):
+        """Keep a change whose outcome is unknown. Synchronous and local, safe to call from any failure path."""
+        logger.error(f"[TokenJournal] Change of {amount} tokens for {user_id} may not have been applied, "
+                     f"recorded for reconciliation ({error}): {body}")
+        try:
+            self._db().execute("INSERT INTO token_changes (user_id, amount, body, error, created_at) "
+                               "VALUES (?, ?, ?, ?, ?)",
+                               (user_id, amount, json.dumps(body, default=str), error, time.time()))
+        except Exception as e:
+            # the log line above is now the only record of it
+            self.failed += 1
+            logger.critical(f"[TokenJournal] Failed to record a change of {amount} tokens for {user_id}: {e}")
+            return
+        self.recorded += 1
+
+    def unresolved(self) -> List[tuple]:
+        return self._db().execute("SELECT id, user_id, amount, body, error, created_at FROM token_changes "
+                                  "WHERE resolved_at IS NULL ORDER BY id").fetchall()
+
+    def resolve(self, change_id: int) -> bool:
+        cur = self._db().execute("UPDATE token_changes SET resolved_at = ? WHERE id = ? AND resolved_at IS NULL",
+                                 (time.time(), change_id))
+        return cur.rowcount > 0
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            unresolved = self._db().execute("SELECT COUNT(*) FROM token_changes "
+                                            "WHERE resolved_at IS NULL").fetchone()[0]
+        except Exception:
+            unresolved = -1
+        return {
+            'unresolved': unresolved,
+            'recorded': self.recorded,
+            'failed': self.failed,
+        }
+
+
+token_journal = TokenJournal()
+register_metrics('token_journal', token_journal.stats)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == '--resolve':
+        print("resolved" if token_journal.resolve(int(sys.argv[2])) else "no unresolved change with that id")
+    else:
+        for change_id, user_id, amount, body, error, created_at in token_journal.unresolved():
+            print(f"{change_id}\t{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created_at))}\t"
+                  f"user={user_id}\tamount={amount}\terror={error}\t{body}")
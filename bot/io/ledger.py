@@ -0,0 +1,203 @@
+"""Local cache of users' VIP token balances.
+
+Balances are cached for a short TTL. While a balance is fresh, debits are checked and reserved locally
+and reconciled with clyppy.io in the background, so the common case needs no network call.
+Refunds are merged per user and sent in batches. A background debit or refund that fails may still have been
+applied by the server, and the endpoint doesn't de-duplicate, so it's never re-sent: it's recorded for
+reconciliation (bot/io/journal.py) and the cached balance is dropped, so the next check reads the server's.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from os import getenv
+from bot.utils.deadline import create_task_without_deadline
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+TOKEN_BALANCE_TTL = float(getenv('TOKEN_BALANCE_TTL', 30))
+REFUND_FLUSH_INTERVAL = 2.0
+
+
+class _Balance:
+    def __init__(self, tokens: int):
+        self.tokens = tokens
+        self.fetched_at = time.monotonic()
+        self.reserved = 0  # debits that were approved locally but not confirmed by the server yet
+
+    def fresh(self, ttl: float) -> bool:
+        return time.monotonic() - self.fetched_at < ttl
+
+    @property
+    def available(self) -> int:
+        return self.tokens - self.reserved
+
+
+class _PendingRefund:
+    def __init__(self, user):
+        self.user = user
+        self.amount = 0
+        self.clip_urls: List[str] = []
+        self.descriptions: List[str] = []
+
+
+class TokenLedger:
+    def __init__(self, fetch_balance: Callable[[Any], Awaitable[int]],
+                 debit: Callable[..., Awaitable[dict]], journal: Callable[..., None],
+                 ttl: float = TOKEN_BALANCE_TTL):
+        """
+        Args:
+            fetch_balance: Fetches a user's balance from the server
+            debit: Subtracts tokens on the server (a negative amount refunds them)
+            journal: Takes the same arguments as `debit` plus `error`, and records a change that may not have
+                been applied
+        """
+        self.fetch_balance = fetch_balance
+        self.debit_fn = debit
+        self.journal_fn = journal
+        self.ttl = ttl
+        self._balances: Dict[int, _Balance] = {}
+        self._fetching: Dict[int, asyncio.Future] = {}
+        self._refunds: Dict[int, _PendingRefund] = {}
+        self._refund_task: Optional[asyncio.Task] = None
+        # metrics
+        self.hits = 0
+        self.misses = 0
+        self.local_debits = 0
+        self.remote_debits = 0
+        self.conflicts = 0
+        self.refunds_queued = 0
+        self.refund_requests = 0
+        self.unconfirmed = 0
+
+    def invalidate(self, user_id: int):
+        """Forget a cached balance, e.g. after tokens were granted outside the bot"""
+        self._balances.pop(int(user_id), None)
+
+    def _set(self, user_id: int, tokens: int):
+        entry = self._balances.get(user_id)
+        reserved = entry.reserved if entry is not None else 0
+        entry = _Balance(tokens)
+        entry.reserved = reserved
+        self._balances[user_id] = entry
+
+    async def balance(self, user) -> int:
+        """The user's available tokens (cached balance minus in-flight debits)"""
+        user_id = int(user.id)
+        entry = self._balances.get(user_id)
+        if entry is not None and entry.fresh(self.ttl):
+            self.hits += 1
+            return entry.available
+
+        self.misses += 1
+        fut = self._fetching.get(user_id)
+        if fut is None:
+            # concurrent lookups for the same user share one request
+            fut = create_task_without_deadline(self.fetch_balance(user))
+            self._fetching[user_id] = fut
+            fut.add_done_callback(lambda _: self._fetching.pop(user_id, None))
+        tokens = await asyncio.shield(fut)
+        self._set(user_id, tokens)
+        return self._balances[user_id].available
+
+    async def debit(self, user, amt: int, clip_url: str = None, reason: str = None, description: str = None) -> dict:
+        """
+        Subtract tokens, with the same return format as subtract_tokens().
+        With a fresh cached balance, the check and reservation are local and the server is updated in the background.
+        """
+        user_id = int(user.id)
+        entry = self._balances.get(user_id)
+        if entry is None or not entry.fresh(self.ttl):
+            self.remote_debits += 1
+            sub = await self.debit_fn(user=user, amt=amt, clip_url=clip_url, reason=reason, description=description)
+            if sub.get('success') and sub.get('tokens') is not None:
+                self._set(user_id, sub['tokens'])
+            return sub
+
+        self.hits += 1
+        if entry.available < amt:
+            return {'success': True, 'user_success': False, 'tokens': entry.available}
+
+        self.local_debits += 1
+        entry.reserved += amt
+        create_task_without_deadline(self._reconcile_debit(user, amt, clip_url, reason, description))
+        return {'success': True, 'user_success': True, 'tokens': entry.available}
+
+    async def _reconcile_debit(self, user, amt: int, clip_url: str, reason: str, description: str):
+        user_id = int(user.id)
+        try:
+            sub = await self.debit_fn(user=user, amt=amt, clip_url=clip_url, reason=reason, description=description)
+        except Exception as e:
+            self.unconfirmed += 1
+            self.journal_fn(user=user, amt=amt, clip_url=clip_url, reason=reason, description=description,
+                            error=str(e))
+            self.invalidate(user_id)
+            return
+        entry = self._balances.get(user_id)
+        if entry is not None:
+            entry.reserved = max(0, entry.reserved - amt)
+        if sub.get('success') and sub.get('user_success'):
+            self._set(user_id, sub['tokens'])
+        else:
+            # the cached balance was wrong (e.g. spent from another shard) - next check goes to the server
+            self.conflicts += 1
+            logger.warning(f"[Ledger] Server didn't confirm a locally approved debit of {amt} tokens for {user_id}: {sub}")
+            self.invalidate(user_id)
+
+    def refund(self, user, amt: int, clip_url: str = None, description: str = None):
+        """Give tokens back. Applied to the cached balance right away, sent to the server in a batch."""
+        if amt <= 0:
+            return
+        user_id = int(user.id)
+        entry = self._balances.get(user_id)
+        if entry is not None:
+            entry.tokens += amt
+        pending = self._refunds.get(user_id)
+        if pending is None:
+            pending = self._refunds[user_id] = _PendingRefund(user)
+        pending.amount += amt
+        if clip_url:
+            pending.clip_urls.append(clip_url)
+        if description:
+            pending.descriptions.append(description)
+        self.refunds_queued += 1
+        if self._refund_task is None or self._refund_task.done():
+            self._refund_task = create_task_without_deadline(self._flush_refunds_later())
+
+    async def _flush_refunds_later(self):
+        await asyncio.sleep(REFUND_FLUSH_INTERVAL)
+        await self.flush_refunds()
+
+    async def flush_refunds(self):
+        refunds, self._refunds = self._refunds, {}
+        for user_id, pending in refunds.items():
+            self.refund_requests += 1
+            change = dict(
+                user=pending.user,
+                amt=-pending.amount,
+                clip_url=pending.clip_urls[0] if len(pending.clip_urls) == 1 else None,
+                reason="Token Refund",
+                description="; ".join(pending.descriptions)[:500] or None
+            )
+            try:
+                sub = await self.debit_fn(**change)
+                if sub.get('success') and sub.get('tokens') is not None:
+                    self._set(user_id, sub['tokens'])
+            except Exception as e:
+                self.unconfirmed += 1
+                self.journal_fn(**change, error=str(e))
+                self.invalidate(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'cached_users': len(self._balances),
+            'hits': self.hits,
+            'misses': self.misses,
+            'local_debits': self.local_debits,
+            'remote_debits': self.remote_debits,
+            'conflicts': self.conflicts,
+            'refunds_queued': self.refunds_queued,
+            'refund_requests': self.refund_requests,
+            'refunds_pending': len(self._refunds),
+            'unconfirmed': self.unconfirmed,
+        }
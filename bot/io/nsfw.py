@@ -0,0 +1,105 @@
+"""Per-domain cache in front of the clyppy.io NSFW text classifier.
+
+Domains are looked up in a static allow/deny list (extendable with NSFW_DOMAIN_ALLOWLIST / NSFW_DOMAIN_DENYLIST),
+then in the verdicts learned from the classifier, kept in a bounded LRU with a TTL. Either resolves without any
+lookup. Concurrent checks of the same unknown domain share one request.
+
+The only text the bot classifies is a url's domain (titles aren't checked), so there's no separate cache by
+text: it would hold the same verdicts as the learned domains.
+"""
+from typing import Any, Awaitable, Callable, Dict, Optional
+from urllib.parse import urlparse
+from bot.utils.cache import TTLCache
+from os import getenv
+import logging
+
+logger = logging.getLogger(__name__)
+
+SFW_DOMAINS = {
+    'youtube.com', 'youtu.be', 'twitch.tv', 'kick.com', 'medal.tv', 'instagram.com', 'tiktok.com', 'x.com',
+    'twitter.com', 'bsky.app', 'vimeo.com', 'dailymotion.com', 'bilibili.com', 'b23.tv', 'drive.google.com',
+    'facebook.com', 'fb.watch', 'reddit.com', 'redd.it', 'streamable.com', 'discord.com', 'discordapp.com',
+    'discordapp.net', 'canva.com', 'clyppy.io',
+}
+NSFW_DOMAINS = {
+    'pornhub.com', 'xvideos.com', 'youporn.com', 'rule34video.com', 'xhamster.com', 'redtube.com', 'xnxx.com',
+    'spankbang.com', 'onlyfans.com', 'fansly.com',
+}
+
+
+def _env_domains(name: str) -> set:
+    return {d.strip().lower() for d in getenv(name, '').split(',') if d.strip()}
+
+
+class NsfwVerdictCache:
+    def __init__(self, classify: Callable[[str], Awaitable[Optional[bool]]],
+                 max_learned: int = 5000, learned_ttl: float = 7 * 24 * 60 * 60):
+        """
+        Args:
+            classify: Calls the remote classifier. Returns None when it couldn't give a verdict (not cached).
+        """
+        self.classify = classify
+        self.allow = SFW_DOMAINS | _env_domains('NSFW_DOMAIN_ALLOWLIST')
+        self.deny = NSFW_DOMAINS | _env_domains('NSFW_DOMAIN_DENYLIST')
+        self.learned = TTLCache(maxsize=max_learned, ttl=learned_ttl)
+        self.static_hits = 0
+        self.learned_hits = 0
+        self.remote_calls = 0
+
+    @staticmethod
+    def _domain_suffixes(netloc: str):
+        """'clips.twitch.tv' -> 'clips.twitch.tv', 'twitch.tv'"""
+        host = netloc.split('@')[-1].split(':')[0].lower().rstrip('.')
+        if host.startswith('www.'):
+            host = host[4:]
+        parts = host.split('.')
+        for i in range(len(parts) - 1):
+            yield '.'.join(parts[i:])
+
+    def domain_verdict(self, netloc: str) -> Optional[bool]:
+        """Verdict from the domain lists alone, or None if the domain isn't known"""
+        for domain in self._domain_suffixes(netloc):
+            if domain in self.deny:
+                self.static_hits += 1
+                return True
+            if domain in self.allow:
+                self.static_hits += 1
+                return False
+            learned = self.learned.get(domain)
+            if learned is not None:
+                self.learned_hits += 1
+                return learned
+        return None
+
+    async def _classify(self, text: str) -> Optional[bool]:
+        self.remote_calls += 1
+        return await self.classify(text)
+
+    async def check_url(self, url: str) -> bool:
+        netloc = urlparse(url).netloc.lower()
+        verdict = self.domain_verdict(netloc)
+        if verdict is not None:
+            return verdict
+
+        # the classifier only sees the domain, so its verdict applies to the whole domain
+        domains = list(self._domain_suffixes(netloc))
+        if domains:
+            verdict = await self.learned.get_or_load(domains[0], lambda: self._classify(netloc),
+                                                     should_cache=lambda v: v is not None)
+        else:
+            verdict = await self._classify(netloc)
+        if verdict is None:
+            return True  # no verdict - treat as nsfw, same as the API being down
+        return verdict
+
+    def stats(self) -> Dict[str, Any]:
+        # a learned verdict can also show up between domain_verdict() and get_or_load(), count those too
+        avoided = self.static_hits + self.learned_hits + self.learned.hits + self.learned.coalesced
+        return {
+            'remote_calls': self.remote_calls,
+            'avoided_calls': avoided,
+            'static_domain_hits': self.static_hits,
+            'learned_domain_hits': self.learned_hits + self.learned.hits,
+            'coalesced': self.learned.coalesced,
+            'learned_domains': len(self.learned),
+        }
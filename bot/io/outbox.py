@@ -0,0 +1,295 @@
+"""Local outbox for BotInteraction analytics writes to clyppy.io.
+
+Embeds hand their interaction record to the outbox and carry on; the record is published in the background.
+An embed that creates a new video page awaits the create with publish() instead, since the page has to exist
+before its link is posted, and only its patch goes through the queue.
+The response-time/message-id patch is merged into the same record when it arrives before the record was
+flushed, so most embeds publish with a single request. Transient backend errors are retried with backoff,
+and records the outbox gives up on are handed to the local spool (bot/io/spool.py).
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+from bot.env import is_contrib_instance, log_api_bypass
+from bot.errors import ApiUnavailable
+from bot.io.client import api_client
+from bot.io.spool import spool
+from bot.utils.metrics import register_metrics
+from bot.utils.deadline import create_task_without_deadline
+from os import getenv
+import asyncio
+import logging
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_MAX_SIZE = int(getenv('INTERACTION_OUTBOX_MAX_SIZE', 1000))
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_MAX_IN_FLIGHT = 4
+OUTBOX_DEFAULT_LINGER = 10.0  # how long a record waits for its response-time patch before it's flushed without one
+
+
+class PendingInteraction:
+    def __init__(self, payload: dict, on_published: Optional[Callable[[dict], Awaitable[Any]]], linger: float):
+        self.payload = payload
+        self.on_published = on_published
+        self.due = time.monotonic() + linger
+        self.patch: Optional[dict] = None
+        self.patch_sent = False
+        self.remote_id = None
+        self.result: Optional[dict] = None  # the server's response to the create
+        self.attempts = 0
+        self.in_flight = False
+        self.abandoned = False
+
+    @property
+    def finished(self) -> bool:
+        return self.remote_id is not None and (self.patch is None or self.patch_sent)
+
+
+class InteractionOutbox:
+    def __init__(self, maxsize: int = OUTBOX_MAX_SIZE, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 max_in_flight: int = OUTBOX_MAX_IN_FLIGHT):
+        self.maxsize = maxsize
+        self.max_attempts = max_attempts
+        self.max_in_flight = max_in_flight
+        self._records: List[PendingInteraction] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._in_flight = 0
+        self._tasks: Set[asyncio.Task] = set()
+        # metrics
+        self.published = 0
+        self.coalesced = 0
+        self.patches = 0
+        self.retries = 0
+        self.spooled = 0
+
+    def submit(self, payload: dict, on_published: Callable[[dict], Awaitable[Any]] = None,
+               linger: float = OUTBOX_DEFAULT_LINGER) -> PendingInteraction:
+        """
+        Queue a new interaction to be published. Never blocks.
+
+        Args:
+            payload: The BotInteraction create body
+            on_published: Coroutine function called with the server's response once the record was created
+            linger: Seconds to hold the record back waiting for set_response_time(), 0 to send right away
+        """
+        if len(self._records) >= self.maxsize:
+            for old in self._records:
+                if not old.in_flight:
+                    self._discard(old, abandoned=True)
+                    spool.append('interaction', self._pending_body(old))
+                    self.spooled += 1
+                    logger.warning(f"[Outbox] Full ({self.maxsize}), spooled oldest interaction {old.payload.get('generated_id')}")
+                    break
+        record = PendingInteraction(payload, on_published, linger)
+        self._records.append(record)
+        self._ensure_worker()
+        self._wakeup.set()
+        return record
+
+    async def publish(self, payload: dict) -> Optional[PendingInteraction]:
+        """
+        Create a new interaction right away and wait for the server's response (in record.result).
+        Returns None if the server rejected it, raises ApiUnavailable if it couldn't be reached.
+        """
+        try:
+            result = await self._post(payload)
+        except _PermanentPublishError as e:
+            logger.info(f"[Outbox] Server rejected interaction {payload.get('generated_id')}: {e}")
+            return None
+        if result is None:
+            raise ApiUnavailable('publish', "backend unavailable, interaction wasn't created")
+        record = PendingInteraction(payload, None, 0)
+        record.remote_id = result.get('id')
+        record.result = result
+        self.published += 1
+        return record
+
+    def set_response_time(self, record: PendingInteraction, response_time: float, msg_id):
+        """Attach the response-time patch. Merged into the create if it hasn't been sent yet."""
+        if record.abandoned:
+            return
+        record.patch = {'response_time': response_time, 'msg_id': msg_id}
+        record.due = min(record.due, time.monotonic())
+        if record not in self._records:  # already published without the patch
+            self._records.append(record)
+        self._ensure_worker()
+        self._wakeup.set()
+
+    def _ensure_worker(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._worker is None or self._worker.done():
+            self._worker = create_task_without_deadline(self._run())
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            next_due = None
+            for record in list(self._records):
+                if record.in_flight:
+                    continue
+                if record.due <= now and self._in_flight < self.max_in_flight:
+                    record.in_flight = True
+                    self._in_flight += 1
+                    self._spawn(self._flush(record))
+                elif record.due > now:
+                    next_due = record.due if next_due is None else min(next_due, record.due)
+            timeout = None if next_due is None else max(0.0, next_due - now)
+            if self._in_flight >= self.max_in_flight:
+                timeout = None  # a finishing flush wakes us up
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _flush(self, record: PendingInteraction):
+        try:
+            if record.remote_id is None:
+                body = self._pending_body(record)
+                merged = record.patch is not None
+                result = await self._post(body)
+                if result is None:
+                    return self._retry_later(record, body)
+                record.remote_id = result.get('id')
+                record.result = result
+                record.patch_sent = merged
+                self.published += 1
+                self.coalesced += merged
+                if record.on_published is not None:
+                    self._spawn(self._run_callback(record, result))
+            elif record.patch is not None and not record.patch_sent:
+                body = self._pending_body(record)
+                if await self._post(body) is None:
+                    return self._retry_later(record, body)
+                record.patch_sent = True
+                self.patches += 1
+
+            if record.finished or record.patch is None:
+                # without a patch yet the record leaves the outbox; set_response_time() puts it back
+                self._discard(record)
+        except _PermanentPublishError as e:
+            logger.info(f"[Outbox] Server rejected interaction {record.payload.get('generated_id')}: {e}")
+            self._discard(record, abandoned=True)
+        except Exception as e:
+            logger.warning(f"[Outbox] Unexpected error publishing interaction: {e}")
+            self._discard(record, abandoned=True)
+        finally:
+            record.in_flight = False
+            self._in_flight -= 1
+            if self._wakeup is not None:
+                self._wakeup.set()
+
+    def _spawn(self, coro):
+        # the loop only keeps weak references to tasks
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _retry_later(self, record: PendingInteraction, body: dict):
+        if record.abandoned:
+            return  # drain() already spooled it while this attempt was in flight
+        record.attempts += 1
+        if record.attempts >= self.max_attempts:
+            logger.warning(f"[Outbox] Giving up on interaction {record.payload.get('generated_id')} after {record.attempts} attempts, spooling it")
+            self._discard(record, abandoned=True)
+            spool.append('interaction', body)
+            self.spooled += 1
+            return
+        self.retries += 1
+        record.due = time.monotonic() + random.uniform(0.5, min(60.0, 2 ** record.attempts))
+
+    @staticmethod
+    def _pending_body(record: PendingInteraction) -> dict:
+        """The request that's still owed for this record: the create (with the patch merged in if we have it), or the edit"""
+        if record.remote_id is None:
+            body = dict(record.payload)
+            if record.patch is not None:
+                body['response_time_seconds'] = record.patch['response_time']
+                body['msg_id'] = record.patch['msg_id']
+            return body
+        return {'edit': True, 'id': record.remote_id,
+                'response_time_seconds': record.patch['response_time'], 'msg_id': record.patch['msg_id']}
+
+    def _discard(self, record: PendingInteraction, abandoned: bool = False):
+        record.abandoned = record.abandoned or abandoned
+        if record in self._records:
+            self._records.remove(record)
+
+    @staticmethod
+    async def _run_callback(record: PendingInteraction, result: dict):
+        try:
+            await record.on_published(result)
+        except Exception as e:
+            logger.warning(f"[Outbox] on_published callback failed: {e}")
+
+    @staticmethod
+    async def _post(body: dict) -> Optional[dict]:
+        """Returns the server's response, or None on a transient failure that's worth retrying"""
+        if is_contrib_instance(logger):
+            log_api_bypass(logger, "https://clyppy.io/api/publish/", "POST", {"edit": body.get('edit', False)})
+            return {"success": True, "id": "test_video_id", "video_page_id": None}
+
+        headers = {'X-API-Key': getenv('clyppy_post_key'), 'Content-Type': 'application/json'}
+        try:
+            response = await api_client.request('publish', 'POST', '/api/publish/', json_body=body, headers=headers)
+        except ApiUnavailable as e:
+            logger.info(f"[Outbox] {e}")
+            return None
+        if response.status == 201:
+            if response.data and response.data.get('success'):
+                return response.data
+            raise _PermanentPublishError(response.data)
+        if response.status >= 500 or response.status == 429:
+            return None
+        raise _PermanentPublishError((response.data or {}).get('error', response.text[:200]))
+
+    async def drain(self, timeout: float = 10):
+        """Flush everything that's queued, waiting at most `timeout` seconds (used on shutdown)"""
+        for record in self._records:
+            record.due = min(record.due, time.monotonic())
+        if self._records:
+            self._ensure_worker()
+            self._wakeup.set()
+        give_up_at = time.monotonic() + timeout
+        while self._records and time.monotonic() < give_up_at:
+            await asyncio.sleep(0.1)
+        if self._worker is not None:
+            self._worker.cancel()
+        if self._records:
+            logger.warning(f"[Outbox] {len(self._records)} interactions were not published before shutdown, spooling them")
+            for record in list(self._records):
+                # in-flight ones too: their request may never finish, and publishing one twice beats losing it
+                spool.append('interaction', self._pending_body(record))
+                self.spooled += 1
+                self._discard(record, abandoned=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': len(self._records),
+            'in_flight': self._in_flight,
+            'published': self.published,
+            'coalesced': self.coalesced,
+            'patches': self.patches,
+            'retries': self.retries,
+            'spooled': self.spooled,
+        }
+
+
+class _PermanentPublishError(Exception):
+    pass
+
+
+async def _send_spooled_interaction(body: dict) -> bool:
+    try:
+        return await InteractionOutbox._post(body) is not None
+    except _PermanentPublishError as e:
+        logger.info(f"[Outbox] Server rejected spooled interaction {body.get('generated_id', body.get('id'))}: {e}")
+        return True
+
+
+interaction_outbox = InteractionOutbox()
+register_metrics('interaction_outbox', interaction_outbox.stats)
+spool.register_sender('interaction', _send_spooled_interaction)
@@ -0,0 +1,174 @@
+"""Durable local spool for writes to clyppy.io that nobody should wait on.
+
+Records are appended to a small sqlite database (a local insert, no network) and shipped by a background
+drainer in batches, backing off while the API is unhealthy. Records survive restarts, and the spool is capped
+so a long outage can't fill the disk - the oldest records are dropped first.
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from bot.utils.metrics import register_metrics
+from bot.utils.deadline import create_task_without_deadline
+from os import getenv
+import asyncio
+import logging
+import sqlite3
+import random
+import json
+import time
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DB_PATH = getenv('SPOOL_DB_PATH', 'spool.db')
+SPOOL_MAX_ROWS = int(getenv('SPOOL_MAX_ROWS', 10000))
+SPOOL_BATCH_SIZE = 50
+SPOOL_MAX_CONCURRENT_SENDS = 5
+SPOOL_MAX_BACKOFF = 300
+SPOOL_MAX_ATTEMPTS = 50
+
+# a sender ships one record and returns True when it's done with (delivered, or permanently rejected),
+# or False when it should be retried later
+Sender = Callable[[dict], Awaitable[bool]]
+
+
+class Spool:
+    def __init__(self, path: str = SPOOL_DB_PATH, max_rows: int = SPOOL_MAX_ROWS):
+        self.path = path
+        self.max_rows = max_rows
+        self._conn: Optional[sqlite3.Connection] = None
+        self._senders: Dict[str, Sender] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._appends_since_trim = 0
+        self.backoff = 0.0
+        # metrics
+        self.appended = 0
+        self.delivered = 0
+        self.failed_attempts = 0
+        self.dropped = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, isolation_level=None)  # autocommit
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS spool (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    kind TEXT NOT NULL,
+                    body TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL
+                )
+            """)
+        return self._conn
+
+    def register_sender(self, kind: str, sender: Sender):
+        self._senders[kind] = sender
+
+    def append(self, kind: str, body: dict):
+        """Add a record to the spool. Synchronous and local, safe to call from any failure path."""
+        try:
+            self._db().execute("INSERT INTO spool (kind, body, created_at) VALUES (?, ?, ?)",
+                               (kind, json.dumps(body, default=str), time.time()))
+        except Exception as e:
+            logger.warning(f"[Spool] Failed to append {kind} record: {e}")
+            return
+        self.appended += 1
+        self._appends_since_trim += 1
+        if self._appends_since_trim >= 100:
+            self._trim()
+        self.start()
+
+    def _trim(self):
+        self._appends_since_trim = 0
+        db = self._db()
+        count = db.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        if count > self.max_rows:
+            db.execute("DELETE FROM spool WHERE id IN (SELECT id FROM spool ORDER BY id LIMIT ?)", (count - self.max_rows,))
+            self.dropped += count - self.max_rows
+            logger.warning(f"[Spool] Over {self.max_rows} records, dropped the {count - self.max_rows} oldest")
+
+    def start(self):
+        """Start the background drainer (if it isn't running). Needs a running event loop."""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._worker is None or self._worker.done():
+            self._worker = create_task_without_deadline(self._run())
+        self._wakeup.set()
+
+    def _next_batch(self) -> List[tuple]:
+        return self._db().execute("SELECT id, kind, body, attempts FROM spool ORDER BY id LIMIT ?",
+                                  (SPOOL_BATCH_SIZE,)).fetchall()
+
+    async def _send(self, sem: asyncio.Semaphore, kind: str, body: dict) -> bool:
+        sender = self._senders.get(kind)
+        if sender is None:
+            logger.warning(f"[Spool] No sender registered for {kind} records")
+            return False
+        async with sem:
+            try:
+                return await sender(body)
+            except Exception as e:
+                logger.info(f"[Spool] Sending {kind} record failed: {e}")
+                return False
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            rows = self._next_batch()
+            if not rows:
+                await self._wakeup.wait()
+                continue
+
+            sem = asyncio.Semaphore(SPOOL_MAX_CONCURRENT_SENDS)
+            results = await asyncio.gather(*(self._send(sem, kind, json.loads(body)) for _, kind, body, _ in rows))
+            done = [row[0] for row, ok in zip(rows, results) if ok]
+            retry = [row for row, ok in zip(rows, results) if not ok]
+            db = self._db()
+            db.executemany("DELETE FROM spool WHERE id = ?", [(i,) for i in done])
+            self.delivered += len(done)
+
+            if retry:
+                self.failed_attempts += len(retry)
+                give_up = [(row[0],) for row in retry if row[3] + 1 >= SPOOL_MAX_ATTEMPTS]
+                db.executemany("DELETE FROM spool WHERE id = ?", give_up)
+                db.executemany("UPDATE spool SET attempts = attempts + 1 WHERE id = ?", [(row[0],) for row in retry])
+                self.dropped += len(give_up)
+                self.backoff = min(SPOOL_MAX_BACKOFF, max(1.0, self.backoff * 2))
+                delay = random.uniform(self.backoff / 2, self.backoff)
+                logger.info(f"[Spool] {len(retry)}/{len(rows)} records failed, retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            else:
+                self.backoff = 0.0
+
+    async def drain(self, timeout: float = 5):
+        """Try to ship what's spooled before shutdown. Whatever's left is sent after the next start."""
+        give_up_at = time.monotonic() + timeout
+        while self.pending() and self.backoff == 0 and time.monotonic() < give_up_at:
+            self.start()
+            await asyncio.sleep(0.1)
+        if self._worker is not None:
+            self._worker.cancel()
+
+    def pending(self) -> int:
+        try:
+            return self._db().execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        except Exception:
+            return -1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'pending': self.pending(),
+            'appended': self.appended,
+            'delivered': self.delivered,
+            'failed_attempts': self.failed_attempts,
+            'dropped': self.dropped,
+            'backoff_seconds': self.backoff,
+        }
+
+
+spool = Spool()
+register_metrics('spool', spool.stats)
@@ -0,0 +1,131 @@
+"""Batches concurrent clyppy.io video status lookups into as few requests as possible."""
+from typing import Awaitable, Callable, Dict, Iterable, List
+from bot.utils.deadline import create_task_without_deadline, remaining
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+BATCH_RETRY_INTERVAL = 600  # seconds before trying the batch endpoint again after it wasn't there
+
+
+class BatchUnsupported(Exception):
+    """The server doesn't have the batched status endpoint (older deployment)"""
+    pass
+
+
+class VideoStatusBatcher:
+    """
+    Every lookup made within `window` seconds of the first pending one is sent in a single batched request.
+    Lookups for an id that's already pending share the same result.
+
+    If the batch endpoint isn't available, lookups fall back to one request per id (in parallel), and the batch
+    endpoint is tried again after `batch_retry_interval` seconds (it may have been a deploy in progress).
+    """
+
+    def __init__(self,
+                 fetch_many: Callable[[List[str]], Awaitable[Dict[str, dict]]],
+                 fetch_one: Callable[[str], Awaitable[dict]],
+                 window: float = 0.015, max_batch: int = 50, batch_retry_interval: float = BATCH_RETRY_INTERVAL):
+        self.fetch_many = fetch_many
+        self.fetch_one = fetch_one
+        self.window = window
+        self.max_batch = max_batch
+        self.batch_retry_interval = batch_retry_interval
+        self._batch_unsupported_at = None
+        self._pending: Dict[str, asyncio.Future] = {}
+        self._flush_handle = None
+        # metrics
+        self.lookups = 0
+        self.coalesced = 0
+        self.requests = 0
+        self.batches = 0
+        self.fallbacks = 0
+
+    @property
+    def batch_supported(self) -> bool:
+        """False while the batch endpoint is believed to be missing"""
+        return (self._batch_unsupported_at is None
+                or time.monotonic() - self._batch_unsupported_at >= self.batch_retry_interval)
+
+    async def get(self, clip_id: str) -> dict:
+        return (await self.get_many([clip_id]))[clip_id]
+
+    async def get_many(self, clip_ids: Iterable[str]) -> Dict[str, dict]:
+        loop = asyncio.get_running_loop()
+        futures = {}
+        for clip_id in dict.fromkeys(clip_ids):  # dedupe, keep order
+            self.lookups += 1
+            fut = self._pending.get(clip_id)
+            if fut is None:
+                fut = loop.create_future()
+                self._pending[clip_id] = fut
+            else:
+                self.coalesced += 1
+            futures[clip_id] = fut
+
+        if len(self._pending) >= self.max_batch:
+            self._flush_now()
+        elif self._flush_handle is None and self._pending:
+            self._flush_handle = loop.call_later(self.window, self._flush_now)
+
+        # shield so one cancelled caller doesn't fail every other embed waiting on the same id
+        waiting = asyncio.gather(*(asyncio.shield(f) for f in futures.values()))
+        left = remaining()
+        results = await (waiting if left is None else asyncio.wait_for(waiting, max(0.0, left)))
+        return dict(zip(futures.keys(), results))
+
+    def _flush_now(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, {}
+        if batch:
+            # the batch is shared, it mustn't be cut short by whichever caller happened to start it
+            create_task_without_deadline(self._resolve(batch))
+
+    async def _resolve(self, batch: Dict[str, asyncio.Future]):
+        ids = list(batch.keys())
+        try:
+            results = await self._fetch(ids)
+        except Exception as e:
+            for fut in batch.values():
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        for clip_id, fut in batch.items():
+            if fut.done():
+                continue
+            if clip_id in results:
+                fut.set_result(results[clip_id])
+            else:
+                fut.set_exception(KeyError(f"No status returned for {clip_id}"))
+
+    async def _fetch(self, ids: List[str]) -> Dict[str, dict]:
+        if self.batch_supported and len(ids) > 1:
+            try:
+                self.requests += 1
+                self.batches += 1
+                results = await self.fetch_many(ids)
+                self._batch_unsupported_at = None
+                return results
+            except BatchUnsupported:
+                logger.info(f"[StatusBatcher] Batch status endpoint unavailable, falling back to single lookups "
+                            f"for the next {self.batch_retry_interval:.0f}s")
+                self._batch_unsupported_at = time.monotonic()
+
+        self.fallbacks += len(ids) > 1
+        self.requests += len(ids)
+        statuses = await asyncio.gather(*(self.fetch_one(i) for i in ids))
+        return dict(zip(ids, statuses))
+
+    def stats(self) -> dict:
+        return {
+            'lookups': self.lookups,
+            'coalesced': self.coalesced,
+            'requests': self.requests,
+            'batches': self.batches,
+            'fallbacks': self.fallbacks,
+            'batch_supported': self.batch_supported,
+        }
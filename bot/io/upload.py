@@ -3,6 +3,8 @@ from typing import Dict
 from math import ceil
 from bot.io import get_aiohttp_session
 from bot.env import is_contrib_instance, log_api_bypass
+from bot.utils.membudget import memory_budget, base64_upload_size
+from bot.tools import executors
 import base64
 import os
 import uuid
@@ -11,6 +13,49 @@ import uuid
 MAX_CLYPPYIO_UPLOAD_SIZE = 70_000_000
 
 
+def _read_base64(file_path, start=0, size=-1) -> str:
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        return base64.b64encode(f.read(size)).decode('utf-8')
+
+
+async def _upload_chunk(session, file_path, logger, file_id, chunk_number, total_chunks, start, end, file_data,
+                        autodelete):
+    """Upload one chunk, its buffers are only held (in the memory budget) while it's being sent"""
+    async with memory_budget.hold(base64_upload_size(end - start)):
+        if file_data is not None:
+            chunk_b64 = base64.b64encode(file_data[start:end]).decode('utf-8')
+        else:
+            chunk_b64 = await executors.storage.run(_read_base64, file_path, start, end - start)
+
+        headers = {
+            'X-API-Key': os.getenv('clyppy_post_key'),
+            'X-Chunk-Number': str(chunk_number),
+            'X-Total-Chunks': str(total_chunks),
+            'X-File-ID': file_id
+        }
+
+        data = {
+            'chunked': True,
+            'file': chunk_b64,
+            'filename': os.path.basename(file_path),
+            'autodelete': autodelete
+        }
+
+        logger.info(f"Uploading chunk {chunk_number + 1}/{total_chunks} ({(end - start) / 1024 / 1024:.1f}MB)")
+
+        async with session.post(
+                'https://clyppy.io/api/addclip/',
+                json=data,
+                headers=headers
+        ) as response:
+            if response.status != 200:
+                logger.info(f"Failed to upload chunk {chunk_number + 1}: {response.status}")
+                logger.info(await response.text())
+                return None
+            return await response.json()
+
+
 async def upload_video_in_chunks(file_path, logger, chunk_size, total_size=None, file_data=None, autodelete=False):
     if is_contrib_instance(logger):
         log_api_bypass(logger, "https://clyppy.io/api/addclip/", "POST", {
@@ -29,64 +74,68 @@ async def upload_video_in_chunks(file_path, logger, chunk_size, total_size=None,
 
     file_id = str(uuid.uuid4())
     if total_size is None:
-        # Read the file and get total size
-        with open(file_path, 'rb') as f:
-            file_data = f.read()
-        total_size = len(file_data)
+        total_size = len(file_data) if file_data is not None else os.path.getsize(file_path)
         logger.info(f"Uploading {os.path.basename(file_path)} ({total_size / 1024 / 1024:.1f}MB)")
 
     total_chunks = ceil(total_size / chunk_size)
     logger.info(f"Will upload in {total_chunks} chunks")
 
+    # without file_data, each chunk is read from the file as it's sent, rather than the whole file at once
+
     async with get_aiohttp_session() as session:
         for chunk_number in range(total_chunks):
             start = chunk_number * chunk_size
             end = min(start + chunk_size, total_size)
-            chunk = file_data[start:end]
+            r = await _upload_chunk(session, file_path, logger, file_id, chunk_number, total_chunks, start, end,
+                                    file_data, autodelete)
+            if r is None:
+                return None
 
-            chunk_b64 = base64.b64encode(chunk).decode('utf-8')
+            if chunk_number == total_chunks - 1:
+                if r['success']:
+                    return r
+                else:
+                    logger.info(f"Server reported error on chunk {chunk_number + 1}: {r.get('error')}")
+                    raise UploadFailed
+            elif not r['success']:
+                logger.info(f"Server reported error on chunk {chunk_number + 1}: {r.get('error')}")
+                raise UploadFailed
 
-            headers = {
-                'X-API-Key': os.getenv('clyppy_post_key'),
-                'X-Chunk-Number': str(chunk_number),
-                'X-Total-Chunks': str(total_chunks),
-                'X-File-ID': file_id
-            }
+            logger.info(f"Chunk {chunk_number + 1} uploaded successfully")
 
-            data = {
-                'chunked': True,
-                'file': chunk_b64,
-                'filename': os.path.basename(file_path),
-                'autodelete': autodelete
-            }
+    logger.info("An unknown error occurred while uploading the video.")
+    raise UploadFailed
 
-            logger.info(f"Uploading chunk {chunk_number + 1}/{total_chunks} ({len(chunk) / 1024 / 1024:.1f}MB)")
 
+async def _upload_whole(video_file_path, logger, autodelete) -> Dict:
+    file_data = await executors.storage.run(_read_base64, video_file_path)
+
+    data = {
+        'chunked': False,
+        'file': file_data,
+        'filename': os.path.basename(video_file_path),
+        'autodelete': autodelete
+    }
+
+    async with get_aiohttp_session() as session:
+        try:
+            headers = {
+                'X-API-Key': os.getenv('clyppy_post_key'),
+                'Content-Type': 'application/json'
+            }
             async with session.post(
-                    'https://clyppy.io/api/addclip/',
+                    url='https://clyppy.io/api/addclip/',
                     json=data,
                     headers=headers
             ) as response:
-                if response.status != 200:
-                    logger.info(f"Failed to upload chunk {chunk_number + 1}: {response.status}")
-                    logger.info(await response.text())
-                    return None
-
+                logger.info(await response.text())
                 r = await response.json()
-                if chunk_number == total_chunks - 1:
-                    if r['success']:
-                        return r
-                    else:
-                        logger.info(f"Server reported error on chunk {chunk_number + 1}: {r.get('error')}")
-                        raise UploadFailed
-                elif not r['success']:
-                    logger.info(f"Server reported error on chunk {chunk_number + 1}: {r.get('error')}")
+                if r['success']:
+                    return r
+                else:
                     raise UploadFailed
-
-                logger.info(f"Chunk {chunk_number + 1} uploaded successfully")
-
-    logger.info("An unknown error occurred while uploading the video.")
-    raise UploadFailed
+        except Exception as e:
+            raise e
 
 
 async def upload_video(video_file_path, logger, autodelete=False) -> Dict:
@@ -105,48 +154,17 @@ async def upload_video(video_file_path, logger, autodelete=False) -> Dict:
             "file_path": f"https://cdn.clyppy.io/TEST/{os.path.basename(video_file_path)}"
         }
 
-    with open(video_file_path, 'rb') as f:
-        file_data = f.read()
-    total_size = len(file_data)
+    total_size = os.path.getsize(video_file_path)
 
     logger.info(f"Uploading {os.path.basename(video_file_path)} ({total_size / 1024 / 1024:.1f}MB)")
-    if os.path.getsize(video_file_path) > MAX_CLYPPYIO_UPLOAD_SIZE:
+    if total_size > MAX_CLYPPYIO_UPLOAD_SIZE:
         return await upload_video_in_chunks(
             file_path=video_file_path,
             logger=logger,
             chunk_size=MAX_CLYPPYIO_UPLOAD_SIZE,
             total_size=total_size,
-            file_data=file_data,
             autodelete=autodelete
         )
 
-    with open(video_file_path, 'rb') as f:
-        file_data = base64.b64encode(f.read()).decode()
-
-    data = {
-        'chunked': False,
-        'file': file_data,
-        'filename': os.path.basename(video_file_path),
-        'autodelete': autodelete
-    }
-
-    async with get_aiohttp_session() as session:
-        try:
-            headers = {
-                'X-API-Key': os.getenv('clyppy_post_key'),
-                'Content-Type': 'application/json'
-            }
-            async with session.post(
-                    url='https://clyppy.io/api/addclip/',
-                    json=data,
-                    headers=headers
-            ) as response:
-                logger.info(await response.text())
-                r = await response.json()
-                if r['success']:
-                    return r
-                else:
-                    raise UploadFailed
-        except Exception as e:
-            raise e
-
+    async with memory_budget.hold(base64_upload_size(total_size)):
+        return await _upload_whole(video_file_path, logger, autodelete)
@@ -0,0 +1,212 @@
+"""Batches log events into as few Discord webhook messages as possible.
+
+Events are queued per webhook url and flushed every couple of seconds (or as soon as 10 are waiting),
+up to 10 embeds per message. Identical events within a batch are merged with a count, and Discord's
+X-RateLimit headers / 429 responses pause that webhook instead of dropping its events.
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+from bot.utils.metrics import register_metrics
+from bot.utils.deadline import create_task_without_deadline
+import aiohttp
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_EMBED_CHARS_PER_MESSAGE = 6000
+MAX_CONTENT_CHARS = 2000
+MAX_TITLE_CHARS = 256
+MAX_DESCRIPTION_CHARS = 4096
+
+
+class _WebhookQueue:
+    def __init__(self):
+        self.events: "OrderedDict[tuple, dict]" = OrderedDict()
+        self.first_queued_at = 0.0
+        self.blocked_until = 0.0
+
+
+class WebhookAggregator:
+    def __init__(self, flush_interval: float = 2.0, max_queued: int = 500):
+        self.flush_interval = flush_interval
+        self.max_queued = max_queued
+        self._queues: Dict[str, _WebhookQueue] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        # metrics
+        self.events = 0
+        self.deduped = 0
+        self.messages_sent = 0
+        self.rate_limited = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def enqueue(self, url: str, content: str = None, embed: dict = None):
+        """Queue an event for `url`. Never blocks."""
+        queue = self._queues.setdefault(url, _WebhookQueue())
+        content = content or ""
+        key = (content, tuple(sorted((embed or {}).items())))
+        self.events += 1
+        if key in queue.events:
+            queue.events[key]['count'] += 1
+            self.deduped += 1
+            return
+        if len(queue.events) >= self.max_queued:
+            queue.events.popitem(last=False)
+            self.dropped += 1
+        if not queue.events:
+            queue.first_queued_at = time.monotonic()
+        queue.events[key] = {'content': content, 'embed': embed, 'count': 1}
+
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._worker is None or self._worker.done():
+            self._worker = create_task_without_deadline(self._run())
+        if len(queue.events) >= MAX_EMBEDS_PER_MESSAGE:
+            self._wakeup.set()
+
+    def _is_due(self, queue: _WebhookQueue, now: float, force: bool = False) -> bool:
+        if not queue.events or now < queue.blocked_until:
+            return False
+        return force or len(queue.events) >= MAX_EMBEDS_PER_MESSAGE or now - queue.first_queued_at >= self.flush_interval
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            for url, queue in list(self._queues.items()):
+                if self._is_due(queue, now):
+                    await self._flush(url, queue)
+
+            wake_at = []
+            for queue in self._queues.values():
+                if queue.events:
+                    wake_at.append(max(queue.blocked_until, queue.first_queued_at + self.flush_interval))
+            timeout = max(0.05, min(wake_at) - time.monotonic()) if wake_at else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    @staticmethod
+    def _render(event: dict) -> tuple:
+        content, embed, count = event['content'], event['embed'], event['count']
+        if embed is not None:
+            embed = dict(embed)
+            if count > 1:
+                embed['title'] = f"{embed.get('title') or ''} (x{count})"
+            if embed.get('title'):
+                embed['title'] = embed['title'][:MAX_TITLE_CHARS]
+            if embed.get('description'):
+                embed['description'] = embed['description'][:MAX_DESCRIPTION_CHARS]
+        elif count > 1:
+            content = f"{content} (x{count})"
+        return content[:MAX_CONTENT_CHARS], embed
+
+    def _take_batch(self, queue: _WebhookQueue) -> tuple:
+        """Pop as many events as fit in one webhook message"""
+        contents, embeds, taken = [], [], []
+        content_len = embed_len = 0
+        for key, event in queue.events.items():
+            content, embed = self._render(event)
+            this_embed_len = len(embed.get('title') or '') + len(embed.get('description') or '') if embed else 0
+            if taken and (
+                    (embed is not None and (len(embeds) >= MAX_EMBEDS_PER_MESSAGE or embed_len + this_embed_len > MAX_EMBED_CHARS_PER_MESSAGE))
+                    or (content and content_len + len(content) + 1 > MAX_CONTENT_CHARS)):
+                break
+            if content:
+                contents.append(content)
+                content_len += len(content) + 1
+            if embed is not None:
+                embeds.append(embed)
+                embed_len += this_embed_len
+            taken.append(key)
+        batch = [(key, queue.events.pop(key)) for key in taken]
+        if queue.events:
+            queue.first_queued_at = time.monotonic() - self.flush_interval  # rest is sent as soon as allowed
+        return {"content": "\n".join(contents), "embeds": embeds}, batch
+
+    def _requeue(self, queue: _WebhookQueue, batch: list):
+        """Put a batch that couldn't be sent back at the front of the queue"""
+        for key, event in reversed(batch):
+            if key in queue.events:
+                event['count'] += queue.events.pop(key)['count']
+            queue.events[key] = event
+            queue.events.move_to_end(key, last=False)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        return self._session
+
+    async def _flush(self, url: str, queue: _WebhookQueue):
+        payload, batch = self._take_batch(queue)
+        try:
+            async with self._get_session().post(url, json=payload) as response:
+                remaining = response.headers.get('X-RateLimit-Remaining')
+                reset_after = response.headers.get('X-RateLimit-Reset-After')
+                if remaining is not None and reset_after is not None and int(remaining) == 0:
+                    queue.blocked_until = time.monotonic() + float(reset_after)
+
+                if response.status == 429:
+                    self.rate_limited += 1
+                    try:
+                        retry_after = float((await response.json()).get('retry_after', 1))
+                    except Exception:
+                        retry_after = float(response.headers.get('Retry-After', 1))
+                    queue.blocked_until = time.monotonic() + retry_after
+                    logger.info(f"[Webhooks] Rate limited, pausing this webhook for {retry_after}s")
+                    self._requeue(queue, batch)
+                elif response.status in (200, 204):
+                    self.messages_sent += 1
+                    logger.info(f"Successfully sent logger webhook with {len(batch)} events")
+                elif response.status >= 500:
+                    logger.info(f"Failed to send logger webhook. Status: {response.status}, retrying")
+                    queue.blocked_until = time.monotonic() + 5
+                    self._requeue(queue, batch)
+                else:
+                    self.failed += len(batch)
+                    logger.info(f"Failed to send logger webhook. Status: {response.status}")
+        except asyncio.CancelledError:
+            self._requeue(queue, batch)  # e.g. drain() stopping the worker mid-send, it's sent from there
+            raise
+        except Exception as e:
+            logger.info(f"Error sending log webhook: {str(e)}")
+            queue.blocked_until = time.monotonic() + 5
+            self._requeue(queue, batch)
+
+    async def drain(self, timeout: float = 5):
+        """Send everything that's queued, waiting at most `timeout` seconds (used on shutdown)"""
+        if self._worker is not None:
+            self._worker.cancel()
+            await asyncio.gather(self._worker, return_exceptions=True)  # so a batch it was sending is back in the queue
+        give_up_at = time.monotonic() + timeout
+        while time.monotonic() < give_up_at:
+            pending = [(url, q) for url, q in self._queues.items() if q.events]
+            if not pending:
+                break
+            for url, queue in pending:
+                if self._is_due(queue, time.monotonic(), force=True):
+                    await self._flush(url, queue)
+            await asyncio.sleep(0.1)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queued': sum(len(q.events) for q in self._queues.values()),
+            'events': self.events,
+            'deduped': self.deduped,
+            'messages_sent': self.messages_sent,
+            'rate_limited': self.rate_limited,
+            'failed': self.failed,
+            'dropped': self.dropped,
+        }
+
+
+webhook_aggregator = WebhookAggregator()
+register_metrics('webhooks', webhook_aggregator.stats)
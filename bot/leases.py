@@ -0,0 +1,257 @@
+"""Cross-process in-flight leases, so the same clip isn't downloaded by every bot process on the host.
+
+Leases live in a small sqlite database in WAL mode that every process (and container) on the host shares.
+A process that wants to download a clip claims the lease for its clyppy_id:
+
+- nobody holds it: the process owns the lease, downloads, and publishes the result (or gives up the lease)
+- another process holds it: wait for that process to publish, then reuse its result
+- its owner crashed (pid gone, or heartbeat expired): take the lease over and download
+
+Owners heartbeat while they work, so a lease only expires when its owner is stuck or gone. Published results
+are kept for a few minutes, for anyone who was waiting or arrives just after.
+
+The database calls block (up to the busy timeout while another process holds the write lock), so they run on
+the storage pool, never on the event loop.
+"""
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+from bot.utils.metrics import register_metrics
+from bot.tools import executors
+from bot.utils import deadline
+from os import getenv
+import threading
+import asyncio
+import logging
+import sqlite3
+import socket
+import json
+import time
+import uuid
+import os
+
+logger = logging.getLogger(__name__)
+
+LEASES_DB_PATH = getenv('LEASES_DB_PATH', '/tmp/clyppybot_leases.db')
+LEASE_TTL = 60  # seconds without a heartbeat before a lease is considered abandoned
+LEASE_RESULT_TTL = 300  # how long a published result stays around for reuse
+LEASE_MAX_WAIT = 600  # stop waiting on another process after this long and do the work ourselves
+
+
+class Lease:
+    def __init__(self, table: 'LeaseTable', key: str, token: Optional[str], result: Optional[dict] = None):
+        self.table = table
+        self.key = key
+        self.token = token
+        self.result = result  # set when another process already did the work
+        self._published = False
+
+    @property
+    def owned(self) -> bool:
+        return self.token is not None
+
+    async def publish(self, result: dict):
+        """Store the result of the work for processes waiting on this lease"""
+        if self.owned and not self._published:
+            await executors.storage.run(self.table._publish, self, result)
+            self._published = True
+
+
+class LeaseTable:
+    def __init__(self, path: str = LEASES_DB_PATH, ttl: float = LEASE_TTL, result_ttl: float = LEASE_RESULT_TTL,
+                 max_wait: float = LEASE_MAX_WAIT):
+        self.path = path
+        self.ttl = ttl
+        self.result_ttl = result_ttl
+        self.max_wait = max_wait
+        self.host = socket.gethostname()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid = None
+        self._lock = threading.Lock()  # one connection, used from the storage pool's threads one at a time
+        # metrics
+        self.active = 0  # leases being worked on, as of the last acquire/release
+        self.acquired = 0
+        self.waited = 0
+        self.reused = 0
+        self.takeovers = 0
+        self.wait_timeouts = 0
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None or self._conn_pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, timeout=5, isolation_level=None,  # autocommit
+                                         check_same_thread=False)
+            self._conn_pid = os.getpid()
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS leases (
+                    key TEXT PRIMARY KEY,
+                    token TEXT NOT NULL,
+                    host TEXT NOT NULL,
+                    pid INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    result TEXT,
+                    heartbeat_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+        return self._conn
+
+    def _owner_alive(self, host: str, pid: int) -> bool:
+        if host != self.host:
+            return True  # another container - we can't see its processes, so only the heartbeat counts
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def _count_active(self, db: sqlite3.Connection):
+        self.active = db.execute("SELECT COUNT(*) FROM leases WHERE state = 'working'").fetchone()[0]
+
+    def _try_acquire(self, key: str):
+        """Returns a Lease we own, a Lease carrying another process's result, or None if someone is working on it"""
+        with self._lock:
+            return self._try_acquire_locked(key)
+
+    def _try_acquire_locked(self, key: str):
+        db = self._db()
+        now = time.time()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute("SELECT host, pid, state, result, expires_at FROM leases WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                host, pid, state, result, expires_at = row
+                if expires_at > now:
+                    if state == 'done':
+                        db.execute("COMMIT")
+                        return Lease(self, key, None, json.loads(result))
+                    if self._owner_alive(host, pid):
+                        db.execute("COMMIT")
+                        return None
+                if state != 'done':
+                    self.takeovers += 1
+                    logger.info(f"[Leases] Taking over {key} from pid {pid} on {host} (crashed or stuck)")
+
+            token = uuid.uuid4().hex
+            db.execute("INSERT OR REPLACE INTO leases (key, token, host, pid, state, result, heartbeat_at, expires_at) "
+                       "VALUES (?, ?, ?, ?, 'working', NULL, ?, ?)",
+                       (key, token, self.host, os.getpid(), now, now + self.ttl))
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+        self.acquired += 1
+        self._count_active(db)
+        return Lease(self, key, token)
+
+    def _heartbeat(self, lease: Lease) -> bool:
+        now = time.time()
+        with self._lock:
+            cur = self._db().execute("UPDATE leases SET heartbeat_at = ?, expires_at = ? WHERE key = ? AND token = ?",
+                                     (now, now + self.ttl, lease.key, lease.token))
+        return cur.rowcount > 0
+
+    def _publish(self, lease: Lease, result: dict):
+        now = time.time()
+        with self._lock:
+            self._db().execute("UPDATE leases SET state = 'done', result = ?, heartbeat_at = ?, expires_at = ? "
+                               "WHERE key = ? AND token = ?",
+                               (json.dumps(result, default=str), now, now + self.result_ttl, lease.key, lease.token))
+
+    def _release(self, lease: Lease):
+        with self._lock:
+            db = self._db()
+            if not lease._published:
+                # nothing to share - let the next waiter take it from here
+                db.execute("DELETE FROM leases WHERE key = ? AND token = ?", (lease.key, lease.token))
+            db.execute("DELETE FROM leases WHERE expires_at < ?", (time.time() - self.result_ttl,))
+            self._count_active(db)
+
+    def _release_abandoned(self, acquiring: asyncio.Future):
+        """A claim was cancelled while its acquire was running: give back the lease it may have got"""
+        if acquiring.cancelled() or acquiring.exception() is not None:
+            return
+        lease = acquiring.result()
+        if lease is not None and lease.owned:
+            release = asyncio.ensure_future(executors.storage.run(self._release, lease))
+            release.add_done_callback(lambda f: f.cancelled() or f.exception())  # it expires if this fails
+
+    async def _keep_alive(self, lease: Lease):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                if not await executors.storage.run(self._heartbeat, lease):
+                    logger.warning(f"[Leases] Lost the lease on {lease.key} (taken over by another process)")
+                    return
+            except sqlite3.Error as e:
+                logger.info(f"[Leases] Heartbeat for {lease.key} failed: {e}")
+
+    @asynccontextmanager
+    async def claim(self, key: str) -> AsyncIterator[Lease]:
+        """Own the lease on `key` for the duration of the block, or get the result of whoever did the work.
+
+        If `lease.result` is set, another process already did the work. Otherwise we own it: do the work and
+        `lease.publish()` a result others can reuse. If the lease table itself is unusable, we just do the work.
+        Waiting on another process raises DeadlineExceeded once the caller's deadline has passed.
+        """
+        started = time.monotonic()
+        delay = 0.05
+        waited = False
+        while True:
+            # shielded, so a lease acquired just as the caller gives up is released instead of held until it expires
+            acquiring = asyncio.ensure_future(executors.storage.run(self._try_acquire, key))
+            try:
+                lease = await asyncio.shield(acquiring)
+            except asyncio.CancelledError:
+                acquiring.add_done_callback(self._release_abandoned)
+                raise
+            except sqlite3.Error as e:
+                logger.warning(f"[Leases] Lease table unavailable, not deduplicating {key}: {e}")
+                yield Lease(self, key, None)
+                return
+            if lease is not None:
+                break
+            if not waited:
+                waited = True
+                self.waited += 1
+                logger.info(f"[Leases] {key} is being processed by another process, waiting for its result")
+            if time.monotonic() - started > self.max_wait:
+                self.wait_timeouts += 1
+                logger.warning(f"[Leases] Gave up waiting on {key} after {self.max_wait}s")
+                yield Lease(self, key, None)
+                return
+            # like every other wait in an embed, bounded by its deadline (DeadlineExceeded)
+            deadline.check(f"waiting for another process to download {key}")
+            await asyncio.sleep(deadline.timeout(delay))
+            delay = min(1.0, delay * 2)
+
+        if not lease.owned:
+            self.reused += 1
+            yield lease
+            return
+
+        keep_alive = asyncio.create_task(self._keep_alive(lease))
+        try:
+            yield lease
+        finally:
+            keep_alive.cancel()
+            try:
+                await executors.storage.run(self._release, lease)
+            except sqlite3.Error as e:
+                logger.info(f"[Leases] Releasing {key} failed, it will expire instead: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'acquired': self.acquired,
+            'waited': self.waited,
+            'reused': self.reused,
+            'takeovers': self.takeovers,
+            'wait_timeouts': self.wait_timeouts,
+            'active': self.active,
+        }
+
+
+clip_leases = LeaseTable()
+register_metrics('clip_leases', clip_leases.stats)
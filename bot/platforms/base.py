@@ -1,10 +1,10 @@
 from bot.env import YT_DLP_USER_AGENT
 from bot.classes import BaseMisc, BaseClip
+from bot.tools import executors
 from bot.types import DownloadResponse
 from bot.errors import VideoTooLong
 from yt_dlp import YoutubeDL
 from urllib.parse import urlparse
-import asyncio
 
 
 COOKIES_PLATFORMS = ['facebook']
@@ -75,7 +75,7 @@ class BASIC_CLIP(BaseClip):
             with YoutubeDL(ydl_opts) as ydl:
                 return ydl.extract_info(self.url, download=False)
 
-        info = await asyncio.get_event_loop().run_in_executor(None, extract)
+        info = await executors.extraction.run(extract)
 
         cdn_url = info.get('url')
         if not cdn_url:
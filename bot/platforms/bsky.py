@@ -8,6 +8,7 @@ class BlueSkyMisc(BaseMisc):
     def __init__(self, bot):
         super().__init__(bot)
         self.platform_name = "BlueSky"
+        self.short_clips_only = True
 
     def parse_clip_url(self, url: str, extended_url_formats=False) -> Optional[str]:
         """
@@ -12,6 +12,7 @@ class InstagramMisc(BaseMisc):
     def __init__(self, bot):
         super().__init__(bot)
         self.platform_name = "Instagram"
+        self.short_clips_only = True
         self.last_request_time = 0  # Track last Instagram request time
         self.min_delay = 5  # Minimum 5 seconds between requests
 
@@ -1,10 +1,10 @@
 from bot.classes import BaseClip, DownloadResponse
+from bot.tools import executors
 from bot.io.cdn import CdnSpacesClient
 from bot.classes import BaseMisc
 from bot.env import YT_DLP_USER_AGENT
 from yt_dlp import YoutubeDL
 from typing import Optional
-import asyncio
 import re
 
 
@@ -12,6 +12,7 @@ class KickMisc(BaseMisc):
     def __init__(self, bot):
         super().__init__(bot)
         self.platform_name = "Kick"
+        self.short_clips_only = True
 
     def parse_clip_url(self, url: str, extended_url_formats=False) -> Optional[str]:
         """
@@ -101,7 +102,7 @@ class KickClip(BaseClip):
                 return info
 
         try:
-            info = await asyncio.get_event_loop().run_in_executor(None, extract)
+            info = await executors.extraction.run(extract)
             self._cached_info = info
             self._broadcaster_username = info.get('channel')
             self._video_uploader_username = info.get('uploader')
@@ -1,9 +1,9 @@
 from bot.classes import BaseClip, DownloadResponse
+from bot.tools import executors
 from bot.classes import BaseMisc
 from yt_dlp import YoutubeDL
 from bot.env import YT_DLP_USER_AGENT
 from typing import Optional
-import asyncio
 import re
 
 
@@ -11,6 +11,7 @@ class MedalMisc(BaseMisc):
     def __init__(self, bot):
         super().__init__(bot)
         self.platform_name = "Medal"
+        self.short_clips_only = True
 
     def parse_clip_url(self, url: str, extended_url_formats=False) -> Optional[str]:
         """
@@ -110,7 +111,7 @@ class MedalClip(BaseClip):
             with YoutubeDL(ydl_opts) as ydl:
                 return ydl.extract_info(self.url, download=False)
 
-        info = await asyncio.get_event_loop().run_in_executor(None, extract)
+        info = await executors.extraction.run(extract)
 
         self._thumbnail_url = info.get('thumbnail')
 
@@ -1,11 +1,11 @@
 import re
 from bot.classes import BaseClip, BaseMisc
+from bot.tools import executors
 from bot.types import DownloadResponse
 from bot.errors import InvalidClipType, VideoTooLong
 from yt_dlp import YoutubeDL
 from bot.env import YT_DLP_USER_AGENT
 from typing import Optional
-import asyncio
 
 
 class R34Misc(BaseMisc):
@@ -107,7 +107,7 @@ class R34clip(BaseClip):
             with YoutubeDL(ydl_opts) as ydl:
                 return ydl.extract_info(self.url, download=False)
 
-        info = await asyncio.get_event_loop().run_in_executor(None, extract)
+        info = await executors.extraction.run(extract)
 
         self._thumbnail_url = info.get('thumbnail')
 
@@ -13,6 +13,7 @@ class TikTokMisc(BaseMisc):
     def __init__(self, bot):
         super().__init__(bot)
         self.platform_name = "TikTok"
+        self.short_clips_only = True
 
     def parse_clip_url(self, url: str, extended_url_formats=False) -> Optional[str]:
         """
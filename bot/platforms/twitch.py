@@ -1,12 +1,13 @@
 from bot.classes import BaseMisc
+from bot.tools import executors
 from bot.types import DownloadResponse
 from bot.classes import BaseClip
 from bot.errors import InvalidClipType
 from bot.shardlock import ShardLock
+from bot.utils.adaptive import platform_limits
 from yt_dlp import YoutubeDL
 from bot.env import YT_DLP_USER_AGENT
 from typing import Optional
-import asyncio
 import re
 
 
@@ -14,6 +15,7 @@ class TwitchMisc(BaseMisc):
     def __init__(self, bot):
         super().__init__(bot)
         self.platform_name = "Twitch"
+        self.short_clips_only = True
 
     def parse_clip_url(self, url: str, extended_url_formats=False) -> Optional[str]:
         """
@@ -60,7 +62,8 @@ class TwitchClip(BaseClip):
         return self._thumbnail_url
 
     async def download(self, filename=None, dlp_format='best', can_send_files=False, cookies=False, extra_opts=None) -> DownloadResponse:
-        async with ShardLock.get("twitch", max_concurrent=2):
+        # host-wide, as many at once as the adaptive limit currently allows (see bot/utils/adaptive.py)
+        async with ShardLock.get("twitch", max_concurrent=platform_limits.get(self.service).concurrency):
             # Extract channel/uploader info first
             await self._extract_clip_info()
             dl = await super().dl_check_size(
@@ -82,11 +85,7 @@ class TwitchClip(BaseClip):
                     'no_warnings': True,
                     'user_agent': YT_DLP_USER_AGENT
                 }
-                extracted = await asyncio.get_event_loop().run_in_executor(
-                    None,
-                    self._extract_info,
-                    ydl_opts
-                )
+                extracted = await executors.extraction.run(self._extract_info, ydl_opts)
                 extracted.remote_url = media_assets_url
                 extracted.broadcaster_username = self._broadcaster_username
                 extracted.video_uploader_username = self._video_uploader_username
@@ -121,7 +120,7 @@ class TwitchClip(BaseClip):
                 return info
 
         try:
-            info = await asyncio.get_event_loop().run_in_executor(None, extract)
+            info = await executors.extraction.run(extract)
             self._cached_info = info
             self._broadcaster_username = info.get('channel')
             self._video_uploader_username = info.get('uploader')
@@ -1,6 +1,6 @@
 import re
-import asyncio
 from bot.classes import BaseClip, BaseMisc
+from bot.tools import executors
 from bot.types import DownloadResponse
 from bot.errors import InvalidClipType, VideoTooLong
 from bot.env import YT_DLP_USER_AGENT
@@ -118,7 +118,7 @@ class Xclip(BaseClip):
                 return info
 
         try:
-            info = await asyncio.get_event_loop().run_in_executor(None, extract)
+            info = await executors.extraction.run(extract)
             self._cached_info = info
             self._video_uploader_username = info.get('uploader_id')
         except Exception as e:
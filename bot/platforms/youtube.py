@@ -1,11 +1,11 @@
 from bot.errors import InvalidClipType, VideoTooLong
 from bot.classes import BaseClip, BaseMisc
+from bot.tools import executors
 from bot.types import DownloadResponse
 from bot.env import YT_DLP_USER_AGENT
-from bot.utils.rate_limiter import youtube_rate_limiter
+from bot.utils.rate_limiter import youtube_rate_limiter, METADATA_COST, DOWNLOAD_COST
 from yt_dlp import YoutubeDL
 from typing import Optional
-import asyncio
 import re
 
 
@@ -31,6 +31,9 @@ class YtMisc(BaseMisc):
                 return match.group(1)
         return None
 
+    def is_shortform_link(self, url: str) -> bool:
+        return bool(re.search(r'youtube\.com/(?:shorts|clip)/', url))
+
     async def get_clip(self, url: str, extended_url_formats=False, basemsg=None, cookies=True) -> 'YtClip':
         slug = self.parse_clip_url(url)
         if slug is None:
@@ -39,7 +42,7 @@ class YtMisc(BaseMisc):
             url = url.split("&list=")[0]
         
         # Rate limit the is_shortform check
-        await youtube_rate_limiter.acquire()
+        await youtube_rate_limiter.acquire(METADATA_COST)
         valid, tokens_used, duration = await self.is_shortform(
             url=url,
             basemsg=basemsg,
@@ -79,7 +82,7 @@ class YtClip(BaseClip):
         await self._extract_clip_info()
 
         # Rate limit before the main download
-        await youtube_rate_limiter.acquire()
+        await youtube_rate_limiter.acquire(DOWNLOAD_COST)
         response = await super().dl_check_size(
             filename=filename,
             dlp_format=dlp_format,
@@ -98,7 +101,7 @@ class YtClip(BaseClip):
             return
 
         # Rate limit before extracting info
-        await youtube_rate_limiter.acquire()
+        await youtube_rate_limiter.acquire(METADATA_COST)
 
         ydl_opts = {
             'quiet': True,
@@ -113,7 +116,7 @@ class YtClip(BaseClip):
                 return info
 
         try:
-            info = await asyncio.get_event_loop().run_in_executor(None, extract)
+            info = await executors.extraction.run(extract)
             self._cached_info = info
             self._broadcaster_username = info.get('channel')
         except Exception as e:
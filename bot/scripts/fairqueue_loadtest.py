@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Local load test for the quickembed fair queue (bot/tools/fairqueue.py).
+
+Simulates a burst where one spammy guild posts many links at once while lots of other guilds post one or two,
+with random fake embed durations. Runs the same workload through a plain FIFO semaphore and through FairQueue,
+then prints tail latency for the quiet and spammy guilds, and Jain's fairness index across the quiet guilds.
+
+Usage:
+    python -m bot.scripts.fairqueue_loadtest [--workers 20] [--spam-links 200] [--guilds 300] [--seed 1]
+"""
+from bot.tools.fairqueue import FairQueue
+from bot.errors import GuildQueueFull
+from collections import defaultdict
+import argparse
+import asyncio
+import random
+import time
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def jain_index(values):
+    """1.0 when every guild waited the same, towards 1/n when one guild got everything"""
+    if not values or not any(values):
+        return 1.0
+    return sum(values) ** 2 / (len(values) * sum(v * v for v in values))
+
+
+def make_workload(args):
+    rng = random.Random(args.seed)
+    jobs = []  # (arrival_offset, guild_id, duration)
+    for _ in range(args.spam_links):
+        jobs.append((rng.uniform(0, 0.2), 'spam', rng.uniform(0.05, 0.3)))
+    for g in range(args.guilds):
+        for _ in range(rng.choice((1, 1, 2))):
+            jobs.append((rng.uniform(0, 1.0), f'guild{g}', rng.uniform(0.05, 0.3)))
+    return sorted(jobs)
+
+
+async def run(jobs, acquire):
+    waits = defaultdict(list)
+    rejected = 0
+
+    async def one(offset, guild_id, duration):
+        nonlocal rejected
+        await asyncio.sleep(offset)
+        queued_at = time.monotonic()
+        try:
+            async with acquire(guild_id):
+                waits[guild_id].append(time.monotonic() - queued_at)
+                await asyncio.sleep(duration)
+        except GuildQueueFull:
+            rejected += 1
+
+    started = time.monotonic()
+    await asyncio.gather(*(one(*job) for job in jobs))
+    return waits, rejected, time.monotonic() - started
+
+
+def report(name, waits, rejected, elapsed):
+    quiet = [w for g, ws in waits.items() if g != 'spam' for w in ws]
+    spam = waits.get('spam', [])
+    quiet_means = [sum(ws) / len(ws) for g, ws in waits.items() if g != 'spam' and ws]
+    print(f"\n== {name} ({elapsed:.1f}s wall)")
+    print(f"  quiet guilds: n={len(quiet)} p50={percentile(quiet, 50):.3f}s p99={percentile(quiet, 99):.3f}s "
+          f"max={max(quiet):.3f}s")
+    if spam:
+        print(f"  spam guild:   n={len(spam)} p50={percentile(spam, 50):.3f}s p99={percentile(spam, 99):.3f}s")
+    print(f"  rejected: {rejected}")
+    print(f"  jain fairness across quiet guilds (mean wait): {jain_index(quiet_means):.3f}")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=20)
+    parser.add_argument('--per-guild', type=int, default=2)
+    parser.add_argument('--queue-limit', type=int, default=10)
+    parser.add_argument('--spam-links', type=int, default=200)
+    parser.add_argument('--guilds', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    jobs = make_workload(args)
+    print(f"{len(jobs)} quickembeds from {args.guilds + 1} guilds, {args.spam_links} from the spammy one")
+
+    sem = asyncio.Semaphore(args.workers)
+    report("FIFO semaphore", *await run(jobs, lambda _: sem))
+
+    fq = FairQueue(args.workers, per_guild_concurrency=args.per_guild, per_guild_queue_limit=args.queue_limit)
+    report("FairQueue (DRR)", *await run(jobs, fq.slot))
+    print(f"\n{fq.stats()}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the default asyncio loop against uvloop (EVENT_LOOP=uvloop) on the bot's two hot paths.
+
+dispatch: message-dispatch throughput. Fake MessageCreate events go through a dispatcher that fans each one
+          out to several listener tasks, which match the content against the platforms' URL patterns, the
+          way on_message_create does. Reports events/s.
+embed:    HTTP-heavy embed latency. Each embed makes the same sequence of requests as a new-video embed
+          (status lookup, clip info, interaction publish, webhook log) against a local aiohttp stand-in for
+          the APIs, with many embeds in flight at once. Reports per-embed latency percentiles and embeds/s.
+
+Each loop runs in its own subprocess, on the same seeded workload.
+
+Usage:
+    python -m bot.scripts.loop_bench [--events 50000] [--listeners 4] [--embeds 2000] [--concurrency 100] [--seed 1]
+"""
+from bot.utils.eventloop import new_event_loop, loop_name
+from aiohttp import web
+import subprocess
+import argparse
+import asyncio
+import aiohttp
+import random
+import json
+import time
+import sys
+import re
+
+URL_PATTERNS = [re.compile(p) for p in (
+    r'https?://(?:www\.)?twitch\.tv/\w+/clip/[\w-]+',
+    r'https?://clips\.twitch\.tv/[\w-]+',
+    r'https?://(?:www\.)?(?:youtube\.com/shorts/|youtu\.be/)[\w-]{11}',
+    r'https?://(?:www\.)?tiktok\.com/@[\w.]+/video/\d+',
+    r'https?://(?:www\.)?instagram\.com/(?:reel|p)/[\w-]+',
+    r'https?://(?:www\.)?kick\.com/\w+/clips/[\w-]+',
+    r'https?://medal\.tv/games/[\w-]+/clips/[\w-]+',
+)]
+
+
+def make_messages(n: int, seed: int):
+    rng = random.Random(seed)
+    words = "lol gg nice clip check this out wait what bro no way actually insane".split()
+    links = ["https://clips.twitch.tv/AbCdEf-123", "https://youtube.com/shorts/dQw4w9WgXcQ",
+             "https://www.tiktok.com/@someone/video/7234567890123456789", "https://kick.com/user/clips/clip_01"]
+    messages = []
+    for i in range(n):
+        text = ' '.join(rng.choice(words) for _ in range(rng.randint(3, 20)))
+        if rng.random() < 0.1:
+            text += ' ' + rng.choice(links)
+        messages.append({'id': i, 'guild_id': rng.randint(1, 5000), 'content': text})
+    return messages
+
+
+async def bench_dispatch(args) -> dict:
+    messages = make_messages(args.events, args.seed)
+    matched = 0
+    done = asyncio.Event()
+    remaining = len(messages) * args.listeners
+
+    async def listener(event):
+        nonlocal matched, remaining
+        await asyncio.sleep(0)  # listeners are coroutines that yield at least once
+        if any(p.search(event['content']) for p in URL_PATTERNS):
+            matched += 1
+        remaining -= 1
+        if remaining == 0:
+            done.set()
+
+    queue = asyncio.Queue()
+
+    async def dispatcher():
+        while True:
+            event = await queue.get()
+            for _ in range(args.listeners):
+                asyncio.create_task(listener(event))
+
+    task = asyncio.create_task(dispatcher())
+    started = time.perf_counter()
+    for i, msg in enumerate(messages):
+        queue.put_nowait(msg)
+        if i % 100 == 0:
+            await asyncio.sleep(0)  # gateway frames arrive in bursts, not all at once
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    task.cancel()
+    return {'events_per_s': round(len(messages) / elapsed), 'matched': matched // args.listeners}
+
+
+async def start_api():
+    async def status(request):
+        await asyncio.sleep(0.002)
+        return web.json_response({'exists': False})
+
+    async def clip_info(request):
+        await asyncio.sleep(0.003)
+        return web.json_response({'url': 'https://cdn.example/v.mp4', 'duration': 30, 'width': 1280, 'height': 720,
+                                  'file_size': 123456, 'title': 'clip', 'is_redirect': False})
+
+    async def publish(request):
+        body = await request.json()
+        await asyncio.sleep(0.004)
+        return web.json_response({'success': True, 'id': body.get('generated_id')})
+
+    async def webhook(request):
+        await request.read()
+        return web.Response(status=204)
+
+    app = web.Application()
+    app.router.add_post('/api/clips/get-status/', status)
+    app.router.add_post('/api/clips/get/', clip_info)
+    app.router.add_post('/api/interactions/', publish)
+    app.router.add_post('/webhook', webhook)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}"
+
+
+async def bench_embed(args) -> dict:
+    runner, base = await start_api()
+    latencies = []
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def embed(session, i):
+        async with sem:
+            started = time.perf_counter()
+            clip_id = f"clip{i}"
+            async with session.post(f"{base}/api/clips/get-status/", json={'clip_id': clip_id}) as r:
+                await r.json()
+            async with session.post(f"{base}/api/clips/get/", json={'clip_id': clip_id}) as r:
+                info = await r.json()
+            async with session.post(f"{base}/api/interactions/", json={'generated_id': clip_id, **info}) as r:
+                await r.json()
+            async with session.post(f"{base}/webhook", data=json.dumps({'content': f"embedded {clip_id}"})) as r:
+                await r.read()
+            latencies.append(time.perf_counter() - started)
+
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=args.concurrency)) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(embed(session, i) for i in range(args.embeds)))
+        elapsed = time.perf_counter() - started
+    await runner.cleanup()
+
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000, 1)
+
+    return {'embeds_per_s': round(len(latencies) / elapsed), 'p50_ms': pct(50), 'p90_ms': pct(90), 'p99_ms': pct(99)}
+
+
+async def run_all(args) -> dict:
+    return {
+        'loop': loop_name(asyncio.get_running_loop()),
+        'dispatch': await bench_dispatch(args),
+        'embed': await bench_embed(args),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--events', type=int, default=50000)
+    parser.add_argument('--listeners', type=int, default=4)
+    parser.add_argument('--embeds', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--loop', choices=('asyncio', 'uvloop'), help="run one loop in this process (used internally)")
+    args = parser.parse_args()
+
+    if args.loop:
+        with asyncio.Runner(loop_factory=lambda: new_event_loop(args.loop)) as runner:
+            print(json.dumps(runner.run(run_all(args))))
+        return
+
+    print(f"dispatch: {args.events} events x {args.listeners} listeners | "
+          f"embed: {args.embeds} embeds, {args.concurrency} in flight, 4 requests each")
+    for kind in ('asyncio', 'uvloop'):
+        out = subprocess.run([sys.executable, '-m', 'bot.scripts.loop_bench', '--loop', kind,
+                              *(f"--{k}={v}" for k, v in vars(args).items() if k != 'loop')],
+                             capture_output=True, text=True)
+        if out.returncode != 0:
+            print(f"{kind:>8}: failed\n{out.stderr}")
+            continue
+        result = json.loads(out.stdout.strip().splitlines()[-1])
+        if result['loop'] != kind:
+            print(f"{kind:>8}: not available, skipped (is it installed?)")
+            continue
+        d, e = result['dispatch'], result['embed']
+        print(f"{kind:>8}: dispatch {d['events_per_s']} events/s | embed {e['embeds_per_s']} embeds/s "
+              f"p50={e['p50_ms']}ms p90={e['p90_ms']}ms p99={e['p99_ms']}ms")
+
+
+if __name__ == '__main__':
+    main()
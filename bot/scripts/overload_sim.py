@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Synthetic load generator for the quickembed overload controller (bot/tools/overload.py).
+
+Quickembeds (a mix of short clips and possibly-long videos) and slash commands arrive at random through a
+download scheduler with a fixed number of workers, at a steady rate with a burst in the middle third that the
+workers can't keep up with. Each embed gives up once it's been waiting and running for --timeout seconds, and
+the work it already did is wasted. The same workload runs without shedding, then through an OverloadController
+with the bot's thresholds (OVERLOAD_QUEUE_DEPTH and OVERLOAD_EXECUTOR_SATURATION, from the environment like the
+bot, so they can be tuned here first, and OVERLOAD_DEFERRED_LIMIT). Deferred quickembeds are resumed the way the
+bot does, a few at a time once the level is back to NORMAL. In-flight bytes and loop lag aren't simulated.
+
+Times are simulated seconds, run --speed times faster than real time.
+
+Usage:
+    python -m bot.scripts.overload_sim [--workers 5] [--rate 0.15] [--burst 4] [--commands 0.02] [--duration 900]
+                                       [--long-share 0.3] [--timeout 300] [--speed 100] [--seed 1]
+"""
+from bot.tools.overload import (OverloadController, Signal, Level, QUEUE_DEPTH_THRESHOLDS,
+                                EXECUTOR_SATURATION_THRESHOLDS, OVERLOAD_HOLD, RESUME_BATCH)
+from bot.tools.scheduler import WorkScheduler, Priority
+from collections import Counter
+import argparse
+import asyncio
+import logging
+import random
+import time
+
+RESUME_INTERVAL = 5  # simulated seconds, like the bot's resume task
+
+
+class ShortLink:
+    def is_shortform_link(self, url):
+        return url.startswith('short')
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p / 100))], 1)
+
+
+def make_workload(args):
+    rng = random.Random(args.seed)
+    jobs = []  # (arrival, kind, work seconds)
+    t = 0.0
+    while t < args.duration:
+        burst = args.duration / 3 <= t < args.duration * 2 / 3
+        t += rng.expovariate(args.rate * (args.burst if burst else 1))
+        if rng.random() < args.long_share:
+            jobs.append((t, 'long', rng.uniform(20, 90)))
+        else:
+            jobs.append((t, 'short', rng.uniform(3, 15)))
+    t = 0.0
+    while t < args.duration:
+        t += rng.expovariate(args.commands)
+        jobs.append((t, 'command', rng.uniform(5, 40)))
+    return sorted(j for j in jobs if j[0] < args.duration)
+
+
+async def simulate(args, jobs, shedding: bool) -> dict:
+    speed = args.speed
+    scheduler = WorkScheduler('sim', workers=args.workers, max_queue_wait=None)
+    controller = OverloadController({
+        'queue_depth': Signal(lambda: scheduler.queue_depth, QUEUE_DEPTH_THRESHOLDS),
+        'executor_saturation': Signal(lambda: (scheduler.running + scheduler.queue_depth) / args.workers,
+                                      EXECUTOR_SATURATION_THRESHOLDS),
+    }, hold=OVERLOAD_HOLD, clock=lambda: time.monotonic() * speed)
+    platform = ShortLink()
+    outcomes = Counter()
+    latency = {'quickembed': [], 'deferred': [], 'command': []}
+    levels = Counter()
+    wasted = 0.0
+    deferred = []
+    tasks = []
+    started = time.monotonic()
+
+    def now():
+        return (time.monotonic() - started) * speed
+
+    async def embed(kind, work, arrived, priority, label):
+        nonlocal wasted
+        ran_at = None
+        try:
+            async with asyncio.timeout(args.timeout / speed):
+                async with scheduler.slot(priority, timeout=None):
+                    ran_at = now()
+                    await asyncio.sleep(work / speed)
+            outcomes[f'{label}_embedded'] += 1
+            latency[label].append(now() - arrived)
+        except TimeoutError:
+            outcomes[f'{label}_timed_out'] += 1
+            if ran_at is not None:
+                wasted += now() - ran_at
+
+    async def arrive(at, kind, work):
+        await asyncio.sleep(at / speed)
+        if kind == 'command':
+            await embed(kind, work, now(), Priority.COMMAND, 'command')
+            return
+        level = controller.level() if shedding else Level.NORMAL
+        levels[level.name] += 1
+        action = Level.DROP if level == Level.DROP else controller.action(level, platform, kind, len(deferred))
+        if action == Level.DROP:
+            outcomes['dropped'] += 1
+        elif action == Level.SHED_LONG:
+            outcomes['shed'] += 1
+        elif action == Level.DEFER:
+            outcomes['deferred'] += 1
+            deferred.append((kind, work))
+        else:
+            await embed(kind, work, now(), Priority.QUICKEMBED, 'quickembed')
+
+    async def resume():
+        while True:
+            await asyncio.sleep(RESUME_INTERVAL / speed)
+            for _ in range(RESUME_BATCH):
+                if not deferred or controller.level() != Level.NORMAL:
+                    break
+                kind, work = deferred.pop(0)
+                tasks.append(asyncio.create_task(embed(kind, work, now(), Priority.QUICKEMBED, 'deferred')))
+
+    resumer = asyncio.create_task(resume())
+    tasks.extend(asyncio.create_task(arrive(*job)) for job in jobs)
+    while any(not t.done() for t in tasks) or deferred:
+        await asyncio.sleep(0.05)
+        if now() > args.duration * 4:
+            break  # some deferred quickembeds never got resumed
+    resumer.cancel()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, resumer, return_exceptions=True)
+
+    return {
+        'outcomes': outcomes,
+        'latency': latency,
+        'wasted': wasted,
+        'levels': levels,
+        'transitions': controller.transitions,
+        'left_deferred': len(deferred),
+        'finished_at': now(),
+    }
+
+
+def report(name, result):
+    o, lat = result['outcomes'], result['latency']
+    print(f"{name}:")
+    print(f"  quickembeds: {o['quickembed_embedded']} embedded (p50={percentile(lat['quickembed'], 50)}s "
+          f"p90={percentile(lat['quickembed'], 90)}s), {o['quickembed_timed_out']} timed out, "
+          f"{o['shed']} shed, {o['deferred']} deferred, {o['dropped']} dropped")
+    if o['deferred']:
+        print(f"  deferred:    {o['deferred_embedded']} embedded later, {o['deferred_timed_out']} timed out, "
+              f"{result['left_deferred']} never resumed")
+    print(f"  commands:    {o['command_embedded']} embedded (p50={percentile(lat['command'], 50)}s "
+          f"p99={percentile(lat['command'], 99)}s), {o['command_timed_out']} timed out")
+    print(f"  wasted work: {result['wasted']:.0f} worker-seconds on embeds that timed out")
+    if result['levels']:
+        print(f"  quickembeds seen at each level: {dict(result['levels'])}, {result['transitions']} level changes")
+    print(f"  finished at t={result['finished_at']:.0f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workers', type=int, default=5)
+    parser.add_argument('--rate', type=float, default=0.15, help="quickembeds per second outside the burst")
+    parser.add_argument('--burst', type=float, default=4, help="rate multiplier during the middle third")
+    parser.add_argument('--commands', type=float, default=0.02, help="slash commands per second")
+    parser.add_argument('--duration', type=float, default=900)
+    parser.add_argument('--long-share', type=float, default=0.3)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('--speed', type=float, default=100)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    logging.getLogger('bot.tools.overload').setLevel(logging.ERROR)  # level changes are counted in the report
+
+    jobs = make_workload(args)
+    kinds = Counter(kind for _, kind, _ in jobs)
+    print(f"{len(jobs)} jobs over {args.duration:.0f}s ({dict(kinds)}), {args.workers} workers, "
+          f"timeout {args.timeout:.0f}s, thresholds queue_depth={QUEUE_DEPTH_THRESHOLDS} "
+          f"executor_saturation={EXECUTOR_SATURATION_THRESHOLDS}")
+    report("no shedding", asyncio.run(simulate(args, jobs, shedding=False)))
+    report("overload controller", asyncio.run(simulate(args, jobs, shedding=True)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark of ShardLock acquisition latency under cross-process contention.
+
+Spawns several processes that each take the same lock many times, holding it briefly. Compares the old
+flock polling implementation (LOCK_NB sweeps every 0.1s, min_interval slept while holding the slot)
+with the broker-backed ShardLock, and reports acquisition latency percentiles, throughput and the CPU
+time the processes burned.
+
+Usage:
+    python -m bot.scripts.shardlock_bench [--procs 6] [--iterations 30] [--slots 2] [--hold 0.01] [--interval 0.05]
+"""
+from pathlib import Path
+import multiprocessing as mp
+import argparse
+import asyncio
+import tempfile
+import fcntl
+import time
+import os
+
+
+class PollingShardLock:
+    """The flock polling implementation ShardLock used to have, kept here for comparison"""
+
+    def __init__(self, locks_dir: Path, platform: str, max_concurrent: int, min_interval: float):
+        self.locks_dir = locks_dir
+        self.platform = platform
+        self.max_concurrent = max_concurrent
+        self.min_interval = min_interval
+        self._file = None
+
+    async def __aenter__(self):
+        while True:
+            for slot in range(self.max_concurrent):
+                f = open(self.locks_dir / f"{self.platform}_{slot}.lock", 'w')
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    self._file = f
+                    return self
+                except BlockingIOError:
+                    f.close()
+            await asyncio.sleep(0.1)
+
+    async def __aexit__(self, *args):
+        await asyncio.sleep(self.min_interval)
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+
+
+def worker(impl: str, locks_dir: str, args, start_at: float, results: mp.Queue):
+    os.environ['BROKER_DIR'] = locks_dir
+    from bot.shardlock import ShardLock
+
+    async def main():
+        while time.time() < start_at:
+            await asyncio.sleep(0.005)
+        latencies = []
+        for _ in range(args.iterations):
+            if impl == 'polling':
+                lock = PollingShardLock(Path(locks_dir), 'bench', args.slots, args.interval)
+            else:
+                lock = ShardLock.get('bench', max_concurrent=args.slots, min_interval=args.interval)
+            t = time.perf_counter()
+            async with lock:
+                latencies.append(time.perf_counter() - t)
+                await asyncio.sleep(args.hold)
+        return latencies
+
+    cpu = time.process_time()
+    latencies = asyncio.run(main())
+    results.put((latencies, time.process_time() - cpu))
+
+
+def run(impl: str, args):
+    locks_dir = tempfile.mkdtemp(prefix=f'shardlock_bench_{impl}_')
+    results = mp.Queue()
+    start_at = time.time() + 1.0  # let every process start before contending
+    procs = [mp.Process(target=worker, args=(impl, locks_dir, args, start_at, results)) for _ in range(args.procs)]
+    for p in procs:
+        p.start()
+    collected = [results.get() for _ in procs]
+    for p in procs:
+        p.join()
+    wall = time.time() - start_at
+
+    latencies = sorted(l for lats, _ in collected for l in lats)
+    cpu = sum(c for _, c in collected)
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p / 100))] * 1000
+
+    print(f"{impl:>8}: n={len(latencies)} p50={pct(50):.1f}ms p90={pct(90):.1f}ms p99={pct(99):.1f}ms "
+          f"max={latencies[-1] * 1000:.1f}ms | {len(latencies) / wall:.1f} acquisitions/s | cpu {cpu:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--procs', type=int, default=6)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--slots', type=int, default=2)
+    parser.add_argument('--hold', type=float, default=0.01)
+    parser.add_argument('--interval', type=float, default=0.05)
+    args = parser.parse_args()
+    print(f"{args.procs} processes x {args.iterations} acquisitions, {args.slots} slots, "
+          f"hold {args.hold}s, min_interval {args.interval}s")
+    run('polling', args)
+    run('broker', args)
+
+
+if __name__ == '__main__':
+    main()
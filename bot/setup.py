@@ -70,7 +70,8 @@ def init_misc(bot: Client) -> Client:
     from pathlib import Path
     # Create data directory if it doesn't exist
     Path("data").mkdir(exist_ok=True)
-    bot.task_queue = TaskQueue(queue_file="data/task_queue.pkl")
+    from bot.cluster import cluster
+    bot.task_queue = TaskQueue(queue_file=cluster.task_queue_file())
 
     bot.platform_list = [
         bot.twitch,
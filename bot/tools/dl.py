@@ -1,6 +1,15 @@
 from bot.types import DownloadResponse, LocalFileInfo
 from bot.errors import UnknownError, VideoTooLongForExtend, VideoTooShortForExtend, VideoExtensionFailed, VideoContainsNSFWContent
 from bot.classes import BaseClip, is_discord_compatible, tryremove
+from bot.tools.scheduler import WorkScheduler, Priority
+from bot.utils.metrics import register_metrics
+from bot.utils.adaptive import platform_limits
+from bot.tools.media_worker import media_worker, MediaWorkerUnavailable
+from bot.utils.eventloop import create_subprocess_exec
+from bot.tools import executors
+from bot.tools import overload
+from bot.utils import deadline
+from bot.utils.membudget import memory_budget, MB
 from pathlib import Path
 from typing import Union
 from moviepy import VideoFileClip
@@ -12,34 +21,62 @@ import json
 import fcntl
 from contextlib import asynccontextmanager
 
+AI_EXTEND_LOCK_POLL = 1.0  # seconds between attempts to take the AI extend lock
+# the extend subprocess decodes the video's frames and holds the generated clip, on top of the files themselves
+AI_EXTEND_MEMORY = int(os.getenv('AI_EXTEND_MEMORY_MB', 768)) * MB
+
 
 class DownloadManager:
     def __init__(self, p):
         self._parent = p
         max_concurrent = os.getenv('MAX_RUNNING_AUTOEMBED_DOWNLOADS', 5)
-        self._semaphore = asyncio.Semaphore(int(max_concurrent))
+        # gates both get_clip() (metadata extraction) and the downloads themselves
+        self.scheduler = WorkScheduler('downloads', workers=int(max_concurrent))
+        register_metrics('download_scheduler', self.scheduler.stats)
+        overload.watch_queue('download_scheduler', lambda: self.scheduler.queue_depth)
+
+    async def get_clip(self, platform, url: str, priority: Priority = Priority.QUICKEMBED, **kwargs) -> BaseClip:
+        """platform.get_clip(url, **kwargs), within the platform's adaptive limit and a scheduler slot"""
+        deadline.check('get_clip', deadline.GET_CLIP_MIN_BUDGET)
+        async with platform_limits.get(platform.platform_name).slot():
+            return await self.scheduler.run(self._get_clip, platform, url, priority=priority, **kwargs)
+
+    async def _get_clip(self, platform, url: str, **kwargs) -> BaseClip:
+        if media_worker.enabled:
+            # the clip then lives in the media worker, and its downloads/thumbnails/uploads run there too
+            try:
+                return await media_worker.get_clip(platform, url, **kwargs)
+            except MediaWorkerUnavailable as e:
+                if e.started:
+                    raise
+                self._parent.logger.warning(f"{e}, extracting {url} in this process instead")
+        return await platform.get_clip(url, **kwargs)
 
     async def download_clip(
             self,
             clip: BaseClip,
             can_send_files=False,
             skip_upload=False,
-            extend_with_ai=False
+            extend_with_ai=False,
+            priority: Priority = Priority.QUICKEMBED
     ) -> Union[DownloadResponse, LocalFileInfo]:
+        if not isinstance(clip, BaseClip):
+            raise TypeError(f"Invalid clip object passed to download_clip of type {type(clip)}")
         desired_filename = f'{clip.service}_{clip.clyppy_id}' if clip.service != 'base' else f'{clip.clyppy_id}'
         if len(desired_filename) > 200:
             desired_filename = desired_filename[:200]
         desired_filename += ".mp4"
-        async with self._semaphore:
-            if not isinstance(clip, BaseClip):
-                raise TypeError(f"Invalid clip object passed to download_clip of type {type(clip)}")
-            self._parent.logger.info("Run clip.download()")
 
-        if skip_upload or extend_with_ai:
-            # force manual override of auto-upload (download() may upload, but dl_download() doesn't)
-            r: LocalFileInfo = await clip.dl_download(filename=desired_filename, can_send_files=can_send_files)
-        else:
-            r: DownloadResponse = await clip.download(filename=desired_filename, can_send_files=can_send_files)
+        # the platform limit is taken first, so work queued for a throttled platform doesn't hold scheduler slots
+        async with platform_limits.get(clip.service).slot(), self.scheduler.slot(priority, size=clip.duration):
+            # waiting for the slots may have used up the time the download needed
+            deadline.check('the download', deadline.DOWNLOAD_MIN_BUDGET)
+            self._parent.logger.info("Run clip.download()")
+            if skip_upload or extend_with_ai:
+                # force manual override of auto-upload (download() may upload, but dl_download() doesn't)
+                r: LocalFileInfo = await clip.dl_download(filename=desired_filename, can_send_files=can_send_files)
+            else:
+                r: DownloadResponse = await clip.download(filename=desired_filename, can_send_files=can_send_files)
 
         if extend_with_ai:
             # Create unique filename with _extended suffix (don't overwrite original)
@@ -51,7 +88,8 @@ class DownloadManager:
             self._parent.logger.info(f"Extended video clyppy_id: {clip.clyppy_id}")
 
             async with self._get_ai_extend_lock():
-                new_duration = await self._extend_video_with_ai(original_file, extended_file)
+                async with memory_budget.hold(AI_EXTEND_MEMORY + os.path.getsize(original_file)):
+                    new_duration = await self._extend_video_with_ai(original_file, extended_file)
 
             r.local_file_path = extended_file
             r.duration = new_duration
@@ -85,14 +123,14 @@ class DownloadManager:
 
             self._parent.logger.info("Waiting to acquire AI extend lock...")
 
-            # Use run_in_executor to avoid blocking the async event loop
-            # fcntl.flock is blocking, so we run it in a thread pool
-            await asyncio.get_event_loop().run_in_executor(
-                None,
-                fcntl.flock,
-                lock_file.fileno(),
-                fcntl.LOCK_EX  # Exclusive lock
-            )
+            # Poll with a non-blocking flock rather than parking a pool thread on it for the
+            # length of someone else's extend (and a cancelled waiter can't take the lock later)
+            while True:
+                try:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)  # Exclusive lock
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(AI_EXTEND_LOCK_POLL)
 
             self._parent.logger.info("AI extend lock acquired")
 
@@ -109,6 +147,24 @@ class DownloadManager:
                 except Exception as e:
                     self._parent.logger.warning(f"Error releasing AI extend lock: {e}")
 
+    @staticmethod
+    def _validate_playable(path: str) -> float:
+        """Duration of the video at path, raises ValueError if it has none or its frames can't be decoded"""
+        video = VideoFileClip(path)
+        try:
+            if video.duration is None or video.duration <= 0:
+                raise ValueError(f"Invalid video duration: {video.duration}")
+            # If extracting a frame fails, the video is corrupt even if it has valid metadata
+            try:
+                test_frame = video.get_frame(0)
+            except Exception as frame_error:
+                raise ValueError(f"Corrupt video: {frame_error}")
+            if test_frame is None or test_frame.size == 0:
+                raise ValueError("Corrupt video: cannot extract frames")
+            return video.duration
+        finally:
+            video.close()
+
     async def _extend_video_with_ai(self, input_file: str, output_file: str) -> float:
         """
         Extend a video using AI models with Sora->Veo fallback
@@ -152,7 +208,7 @@ class DownloadManager:
                     cmd.extend(['--manual-prompt', saved_prompt])
 
                 # Run the extend_video.py script as a subprocess
-                process = await asyncio.create_subprocess_exec(
+                process = await create_subprocess_exec(
                     *cmd,
                     stdout=asyncio.subprocess.PIPE,
                     stderr=asyncio.subprocess.PIPE
@@ -287,41 +343,19 @@ class DownloadManager:
 
                 # Validate the video is actually playable by trying to load it and extract a frame
                 try:
-                    video = VideoFileClip(output_file)
-
-                    # Check basic properties
-                    if video.duration is None or video.duration <= 0:
-                        video.close()
-                        self._parent.logger.error(f"Video has invalid duration: {video.duration}")
-                        last_error = f"Invalid video duration: {video.duration}"
-                        continue
-
-                    # Try to extract a frame to verify the video is actually playable
-                    # If this fails, the video is corrupt even if it has valid metadata
-                    try:
-                        test_frame = video.get_frame(0)
-                        if test_frame is None or test_frame.size == 0:
-                            video.close()
-                            self._parent.logger.error("Video frame extraction returned empty frame")
-                            last_error = "Corrupt video: cannot extract frames"
-                            continue
-                    except Exception as frame_error:
-                        video.close()
-                        self._parent.logger.error(f"Cannot extract frame from video: {frame_error}")
-                        last_error = f"Corrupt video: {frame_error}"
-                        continue
-
-                    new_duration = video.duration
-                    video.close()
-
-                    self._parent.logger.info(f"Video validated: {file_size} bytes, {new_duration:.2f}s duration, playable")
-                    return new_duration
-
+                    new_duration = await executors.media.run(self._validate_playable, output_file)
+                except ValueError as invalid:
+                    self._parent.logger.error(f"Video validation failed: {invalid}")
+                    last_error = str(invalid)
+                    continue
                 except Exception as validation_error:
                     self._parent.logger.error(f"Video validation failed: {validation_error}")
                     last_error = f"Video validation failed: {validation_error}"
                     continue
 
+                self._parent.logger.info(f"Video validated: {file_size} bytes, {new_duration:.2f}s duration, playable")
+                return new_duration
+
             except (VideoTooLongForExtend, VideoTooShortForExtend, VideoContainsNSFWContent):
                 # Re-raise these immediately, don't try other models
                 # These are validation/content errors that won't be fixed by trying a different model
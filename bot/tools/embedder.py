@@ -1,13 +1,21 @@
 from interactions import Permissions, Embed, Message, Button, ButtonStyle, SlashContext, TYPE_THREAD_CHANNEL, ActionRow, errors
-from bot.errors import VideoTooLong, NoDuration, UnknownError, DefinitelyNoDuration, NSFWEmbed
-from bot.io import get_aiohttp_session, is_404, fetch_video_status, get_clip_info, subtract_tokens, push_interaction_error
+from bot.errors import VideoTooLong, NoDuration, UnknownError, DefinitelyNoDuration, NSFWEmbed, GuildQueueFull
+from bot.io import is_404, fetch_video_status, get_clip_info, push_interaction_error, token_ledger
 from datetime import datetime, timezone, timedelta
 from interactions.api.events import MessageCreate
-from bot.env import DL_SERVER_ID, DOWNLOAD_THIS_WEBHOOK_ID, POSSIBLE_EMBED_BUTTONS, is_contrib_instance, log_api_bypass, LOGGER_WEBHOOK_ID
+from bot.env import DL_SERVER_ID, DOWNLOAD_THIS_WEBHOOK_ID, POSSIBLE_EMBED_BUTTONS, LOGGER_WEBHOOK_ID
 from bot.types import DownloadResponse, LocalFileInfo, GuildType, DiscordAttachmentId
 from bot.task_queue import QuickembedTask
 from typing import List, Union, Tuple
 from bot.io.upload import upload_video
+from bot.io.outbox import interaction_outbox
+from bot.tools.scheduler import Priority
+from bot.tools.fairqueue import quickembed_queue
+from bot.tools.overload import controller as overload_controller, Level, DROP_REACTION
+from bot.leases import clip_leases
+from bot.cluster import cluster
+from bot.utils import deadline
+from dataclasses import asdict
 from pathlib import Path
 import traceback
 import asyncio
@@ -20,41 +28,6 @@ INVALID_VIEW_ON_PLATFORMS = ['discord']
 INVALID_DL_PLATFORMS = ['discord', 'rule34', 'base']
 
 
-async def publish_interaction(interaction_data, apikey, logger, edit_id=None, edit_type=None):
-    if is_contrib_instance(logger):
-        log_api_bypass(logger, "https://clyppy.io/api/publish/", "POST", {
-            "edit": edit_type is not None,
-            "edit_type": edit_type
-        })
-        return {"success": True, "id": "test_video_id"}
-
-    try:
-        url = 'https://clyppy.io/api/publish/'
-        headers = {
-            'X-API-Key': apikey,
-            'Content-Type': 'application/json'
-        }
-        if edit_type is None:
-            # publish new interaction
-            j = interaction_data
-        elif edit_type == "response_time":
-            if edit_id is None:
-                raise Exception("both edit_id and edit_type must be defined, or both None")
-            j = {'edit': True, 'id': edit_id, 'response_time_seconds': interaction_data['response_time'], 'msg_id': interaction_data['msg_id']}
-        else:
-            raise Exception("Invalid call to publish_interaction()")
-        async with get_aiohttp_session() as session:
-            async with session.post(url, json=j, headers=headers) as response:
-                if response.status == 201:  # Successfully created
-                    return await response.json()
-                else:
-                    error_data = await response.json()
-                    logger.info(error_data)
-                    raise Exception(f"Failed to publish interaction: {error_data.get('error', 'Unknown error')}")
-    except:
-        logger.info(traceback.format_exc())
-
-
 class AutoEmbedder:
     def __init__(self, bot, platform_tools, logger):
         self.api_key = os.getenv('clyppy_post_key')
@@ -85,6 +58,46 @@ class AutoEmbedder:
                 n += 1
         return n
 
+    def _queue_quickembed(self, clip_link: str, event: MessageCreate, guild: GuildType):
+        """Put a quickembed in the task queue, to be embedded later (after a restart, or once the bot isn't overloaded)"""
+        self.bot.task_queue.add_quickembed(QuickembedTask(
+            message_id=event.message.id,
+            channel_id=event.message.channel.id,
+            guild_id=guild.id,
+            guild_name=guild.name,
+            is_dm=guild.is_dm,
+            clip_url=clip_link,
+            author_id=event.message.author.id,
+            author_username=event.message.author.username
+        ))
+
+    async def _drop(self, event: MessageCreate, num_links: int):
+        """Don't embed, but let the author know the bot is too busy"""
+        self.logger.info(f"Overloaded, dropping {num_links} quickembed(s) from message {event.message.id}")
+        overload_controller.record('dropped', num_links)
+        try:
+            await event.message.add_reaction(DROP_REACTION)
+        except errors.HTTPException:
+            pass  # no permission to react
+
+    async def _admit(self, level: Level, clip_link: str, event: MessageCreate, guild: GuildType) -> bool:
+        """Whether to embed the link now, at the bot's current overload level (see overload.py)"""
+        deferred = len(self.bot.task_queue.quickembed_tasks)
+        action = overload_controller.action(level, self.platform_tools, clip_link, deferred)
+        if action == Level.SHED_LONG:
+            self.logger.info(f"Overloaded, skipping quickembed for {clip_link} in {guild.name}")
+            overload_controller.record('shed')
+            return False
+        elif action == Level.DEFER:
+            self.logger.info(f"Overloaded, deferring quickembed for {clip_link} in {guild.name}")
+            overload_controller.record('deferred')
+            self._queue_quickembed(clip_link, event, guild)
+            return False
+        elif action == Level.DROP:
+            await self._drop(event, 1)
+            return False
+        return True
+
     async def on_message_create(self, event: MessageCreate):
         try:
             if event.message.guild is None:
@@ -124,29 +137,29 @@ class AutoEmbedder:
                 if num_links >= 1:
                     for word in words:
                         if self.platform_tools.is_clip_link(word):
-                            task = QuickembedTask(
-                                message_id=event.message.id,
-                                channel_id=event.message.channel.id,
-                                guild_id=guild.id,
-                                guild_name=guild.name,
-                                is_dm=guild.is_dm,
-                                clip_url=word,
-                                author_id=event.message.author.id,
-                                author_username=event.message.author.username
-                            )
-                            self.bot.task_queue.add_quickembed(task)
+                            self._queue_quickembed(word, event, guild)
+                return 1
+
+            # shed quickembeds when the bot can't keep up (slash commands never come through here)
+            level = overload_controller.level() if num_links >= 1 else Level.NORMAL
+            if level == Level.DROP:
+                await self._drop(event, num_links)
                 return 1
 
             if num_links == 1:
                 contains_clip_link, index = self.get_next_clip_link_loc(words, 0)
                 if not contains_clip_link:
                     return 1
-                await self._process_clip_one_at_a_time(
-                    clip_link=words[index],
-                    respond_to=event.message,
-                    guild=guild,
-                    channel=event.message.channel
-                )
+                if not await self._admit(level, words[index], event, guild):
+                    return 1
+                # takes turns with other guilds' quickembeds when the bot is busy
+                async with quickembed_queue.slot(guild.id):
+                    await self._process_clip_one_at_a_time(
+                        clip_link=words[index],
+                        respond_to=event.message,
+                        guild=guild,
+                        channel=event.message.channel
+                    )
             elif num_links > 1:
                 next_link_exists = True
                 index = -1  # we will +1 in the next step (setting it to 0 for the start)
@@ -154,29 +167,36 @@ class AutoEmbedder:
                     next_link_exists, index = self.get_next_clip_link_loc(words, index + 1)
                     if not next_link_exists:
                         return 1
-                    await self._process_clip_one_at_a_time(
-                        clip_link=words[index],
-                        respond_to=event.message,
-                        guild=guild,
-                        channel=event.message.channel
-                    )
+                    if not await self._admit(level, words[index], event, guild):
+                        continue
+                    async with quickembed_queue.slot(guild.id):
+                        await self._process_clip_one_at_a_time(
+                            clip_link=words[index],
+                            respond_to=event.message,
+                            guild=guild,
+                            channel=event.message.channel
+                        )
         except NSFWEmbed:
             pass
+        except GuildQueueFull as e:
+            self.logger.info(f"Dropping quickembed in {guild.name}: {e}")
         except Exception as e:
             self.logger.info(f"Error in AutoEmbed on_message_create: {event.message.content}\n{traceback.format_exc()}")
 
     async def _process_clip_one_at_a_time(self, clip_link: str, respond_to: Message, guild: GuildType, channel):
         parsed_id = self.platform_tools.parse_clip_url(clip_link)
-        if self.platform_tools.is_nsfw is None:
-            self.platform_tools.is_nsfw = await self.platform_tools.check_url_is_nsfw(clip_link)
+        is_nsfw = self.platform_tools.is_nsfw
+        if is_nsfw is None:
+            # checked per url, the base platform handles any domain
+            is_nsfw = await self.platform_tools.check_url_is_nsfw(clip_link)
 
         if not guild.is_dm:
             if isinstance(channel, TYPE_THREAD_CHANNEL):
-                if self.platform_tools.is_nsfw:
+                if is_nsfw:
                     # GuildPublicThread has no attribute nsfw
                     if not channel.parent_channel.nsfw:
                         raise NSFWEmbed
-            elif not channel.nsfw and self.platform_tools.is_nsfw:
+            elif not channel.nsfw and is_nsfw:
                 # only allow nsfw in nsfw channels
                 raise NSFWEmbed
 
@@ -203,14 +223,16 @@ class AutoEmbedder:
         err_msg = "Unknown error in quickembed"
         exc_name = "None"
         try:
-            clip = await self.platform_tools.get_clip(clip_link, extended_url_formats=True, basemsg=respond_to)
-            await self.process_clip_link(
-                clip=clip,
-                clip_link=clip_link,
-                respond_to=respond_to,
-                guild=guild,
-                try_send_files=True
-            )
+            # the same time budget as /embed, so no stage starts work it can't finish
+            with deadline.deadline_after(self.platform_tools.dl_timeout_secs):
+                clip = await self.bot.tools.dl.get_clip(self.platform_tools, clip_link, extended_url_formats=True, basemsg=respond_to)
+                await self.process_clip_link(
+                    clip=clip,
+                    clip_link=clip_link,
+                    respond_to=respond_to,
+                    guild=guild,
+                    try_send_files=True
+                )
         except VideoTooLong:
             self.logger.info(f"VideoTooLong was reported for {clip_link}")
             err_msg = "Video was too long"
@@ -345,7 +367,7 @@ class AutoEmbedder:
             self, clip: 'BaseClip',
             clip_link: str, respond_to: Union[Message, SlashContext],
             guild: GuildType, try_send_files = True,
-            extend_with_ai = False
+            extend_with_ai = False, priority: Priority = Priority.QUICKEMBED
     ) -> None:
         # get_clip will have used the VIP tokens if they were needed for this clip
         try:
@@ -355,7 +377,8 @@ class AutoEmbedder:
                 respond_to=respond_to,
                 guild=guild,
                 try_send_files=try_send_files,
-                extend_with_ai=extend_with_ai
+                extend_with_ai=extend_with_ai,
+                priority=priority
             )
         except Exception as e:
             # this is where we refund the tokens
@@ -363,30 +386,28 @@ class AutoEmbedder:
             if extend_with_ai:
                 # video extension -> always 10 tokens cost
                 self.logger.info(f"The AI extend failed, so we should refund 10 VIP tokens to {username} <{respond_to.author.id}>")
-                asyncio.create_task(subtract_tokens(
+                token_ledger.refund(
                     user=respond_to.author,
-                    amt=-10,
+                    amt=10,
                     clip_url=clip.url,
-                    reason="Token Refund",
                     description=f"The AI extend failed for {clip.url}"
-                ))
+                )
             else:
                 # normal embed
                 self.logger.info(f"The clip failed to embed, so we should refund {clip.tokens_used} VIP tokens to {username} <{respond_to.author.id}>")
-                asyncio.create_task(subtract_tokens(
+                token_ledger.refund(
                     user=respond_to.author,
-                    amt=-1 * clip.tokens_used,
+                    amt=clip.tokens_used,
                     clip_url=clip.url,
-                    reason="Token Refund",
                     description=f"The embed failed for {clip.url}"
-                ))
+                )
             raise e
 
     async def _process_clip(
             self,
             clip: 'BaseClip', clip_link: str,
             respond_to: Union[Message, SlashContext], guild: GuildType,
-            try_send_files=True, extend_with_ai=False):
+            try_send_files=True, extend_with_ai=False, priority: Priority = Priority.QUICKEMBED):
         if guild.is_dm:  # dm gives error (nonetype has no attribute 'permissions_for')
             has_file_perms = True
         elif getattr(respond_to, '_restored_task', False):
@@ -415,7 +436,8 @@ class AutoEmbedder:
                 response: LocalFileInfo = await self.bot.tools.dl.download_clip(
                     clip=clip,
                     can_send_files=False,
-                    skip_upload=True
+                    skip_upload=True,
+                    priority=priority
                 )
                 await upload_video(
                     video_file_path=response.local_file_path,
@@ -435,15 +457,32 @@ class AutoEmbedder:
                 # these should always be re-generated - even for duplicate video ids
                 video_doesnt_exist = True
             else:
-                status = await fetch_video_status(clip.clyppy_id)
+                # compute_clyppy_id() already looked this up, unless clyppy_id was set some other way
+                status = clip.video_status if clip.video_status is not None else await fetch_video_status(clip.clyppy_id)
                 video_doesnt_exist = not status['exists']
 
-            if video_doesnt_exist:
+            if video_doesnt_exist and extend_with_ai:
                 response: DownloadResponse = await self.bot.tools.dl.download_clip(
                     clip=clip,
                     can_send_files=will_send_files,
-                    extend_with_ai=extend_with_ai
+                    extend_with_ai=extend_with_ai,
+                    priority=priority
                 )
+            elif video_doesnt_exist:
+                # other bot processes on this host may be fetching the same clip right now - only one of us downloads
+                async with clip_leases.claim(clip.clyppy_id) as lease:
+                    if lease.result is not None:
+                        self.logger.info(f" {clip.clyppy_url} - Reusing the download from another process")
+                        response = DownloadResponse(**lease.result)
+                    else:
+                        response: DownloadResponse = await self.bot.tools.dl.download_clip(
+                            clip=clip,
+                            can_send_files=will_send_files,
+                            priority=priority
+                        )
+                        if response.remote_url is not None:
+                            # the local file (if any) is ours to send and delete, others only get the remote copy
+                            await lease.publish({**asdict(response), 'local_file_path': None, 'can_be_discord_uploaded': False})
             else:
                 self.logger.info(f" {clip.clyppy_url} - Video already exists!")
                 info = await get_clip_info(clip.clyppy_id)
@@ -518,9 +557,16 @@ class AutoEmbedder:
             uploading_to_discord = response.can_be_discord_uploaded and has_file_perms
             clip_webp = None
             local_video_path = None
+            # a thumbnail is nice to have, the embed itself isn't worth missing the deadline for
+            want_thumbnail = deadline.has_time_for(deadline.OPTIONAL_WORK_MIN_BUDGET)
             if response.remote_url is None and not uploading_to_discord and video_doesnt_exist:
                 self.logger.info("The remote url was None for a new video create but we're not uploading to Discord!")
                 raise UnknownError
+            elif not uploading_to_discord and not want_thumbnail:
+                self.logger.info(f"[{clip.clyppy_id}] Skipping the thumbnail, only {deadline.remaining():.0f}s left")
+                if response.local_file_path is None:
+                    potential_local_file = f'{clip.service}_{clip.clyppy_id}.mp4' if clip.service != 'base' else f'{clip.clyppy_id}.mp4'
+                    local_video_path = potential_local_file if Path(potential_local_file).exists() else None
             elif not uploading_to_discord and response.local_file_path is not None:
                 # if we actually downloaded this file locally, create its thumbnail
                 try:
@@ -597,7 +643,7 @@ class AutoEmbedder:
                 'remote_video_width': response.width,
                 'url_platform': self.platform_tools.platform_name,
                 'response_time_seconds': 0,
-                'total_servers_now': len(self.bot.guilds),
+                'total_servers_now': cluster.totals(self.bot)[0],
                 'generated_id': clip.clyppy_id,
                 'original_id': clip.id,
                 'video_file_size': response.filesize,
@@ -612,31 +658,15 @@ class AutoEmbedder:
 
             try:
                 clip.is_discord_attachment = uploading_to_discord
-                try:
-                    result = await publish_interaction(interaction_data, apikey=self.api_key, logger=self.logger)
-                except Exception as e:
-                    self.logger.info(f"Failed to post interaction to API: {e}\ninteraction_data: {interaction_data}")
-                    raise
-
-                self.logger.info(f"got back from server {result}")
-                if result['success']:
-                    # sometimes the server will generate a new and improved clyppy id
-                    # to bypass invalid discord caches of old clyppy urls
-                    if result['video_page_id']:
-                        new_id = result["video_page_id"]
-                        if new_id != clip.clyppy_id:
-                            self.logger.info(f"Overwriting clyppy url {clip.clyppy_url} with https://clyppy.io/{new_id}")
-                            clip.clyppy_id = new_id  # clyppy_url is a property() that pulls from clyppy_id
-
-                    # Send welcome DM if this is user's first embed (fire-and-forget, never blocks)
-                    asyncio.create_task(self.send_welcome_dm_if_first_time(respond_to.author))
-                else:
-                    self.logger.info(f"Failed to publish interaction, got back from server {result}")
-                    return None
 
                 btns_is_none = self.bot.guild_settings.get_embed_buttons(guild.id)
                 btns_is_none = POSSIBLE_EMBED_BUTTONS[btns_is_none] == "none"
-                if not btns_is_none:
+
+                link_buttons = comp
+
+                def build_components(clyppy_id):
+                    if btns_is_none:
+                        return link_buttons
                     dctx = ""
                     if uploading_to_discord:
                         dctx = "d-"
@@ -644,43 +674,92 @@ class AutoEmbedder:
                     info_button = Button(
                         style=ButtonStyle.SECONDARY,
                         label="ⓘ Info",
-                        custom_id=f"ibtn-{dctx}{clip.clyppy_id}"
+                        custom_id=f"ibtn-{dctx}{clyppy_id}"
                     )
-                    comp = [info_button] + comp
-                    comp = ActionRow(*comp)
+                    return ActionRow(*([info_button] + link_buttons))
+
+                sent_id = clip.clyppy_id
+                message_sent = asyncio.get_running_loop().create_future()
+
+                def apply_published(result):
+                    self.logger.info(f"got back from server {result}")
+                    # sometimes the server will generate a new and improved clyppy id
+                    # to bypass invalid discord caches of old clyppy urls
+                    new_id = result.get('video_page_id')
+                    if new_id and new_id != clip.clyppy_id:
+                        self.logger.info(f"Overwriting clyppy url {clip.clyppy_url} with https://clyppy.io/{new_id}")
+                        clip.clyppy_id = new_id  # clyppy_url is a property() that pulls from clyppy_id
+
+                    # Send welcome DM if this is user's first embed (fire-and-forget, never blocks)
+                    asyncio.create_task(self.send_welcome_dm_if_first_time(respond_to.author))
+
+                async def on_published(result):
+                    # published after the message was sent, so a new clyppy id has to be edited in
+                    old_url = clip.clyppy_url
+                    apply_published(result)
+                    if uploading_to_discord or clip.clyppy_id == sent_id:
+                        return
+                    bot_msg = await asyncio.wait_for(asyncio.shield(message_sent), timeout=60)
+                    if bot_msg is not None and hasattr(bot_msg, 'edit') and bot_msg.content:
+                        await bot_msg.edit(content=bot_msg.content.replace(old_url, clip.clyppy_url),
+                                           components=build_components(clip.clyppy_id))
+
+                if video_doesnt_exist and not uploading_to_discord:
+                    # the video page has to exist before discord unfurls the link, so the create is awaited here.
+                    # only the response time below goes through the outbox
+                    try:
+                        record = await interaction_outbox.publish(interaction_data)
+                    except Exception as e:
+                        self.logger.info(f"Failed to post interaction to API: {e}\ninteraction_data: {interaction_data}")
+                        raise
+                    if record is None:
+                        self.logger.info(f"Failed to publish BotInteraction to server for {clip.id} ({guild.name} - #{chn})")
+                        return None
+                    apply_published(record.result)
+                else:
+                    # the interaction is published in the background, the embed doesn't wait for it. the create
+                    # waits a bit for the response time below, so both go in a single request
+                    record = interaction_outbox.submit(interaction_data, on_published=on_published)
+
+                comp = build_components(clip.clyppy_id)
 
                 # send message
                 # Check if it's a SlashContext (or MinimalContext with send method)
                 delete_message = self.bot.guild_settings.get_auto_delete(respond_to.guild.id)
-                if isinstance(respond_to, SlashContext) or (hasattr(respond_to, 'send') and not hasattr(respond_to, 'reply')):
-                    # slash command
-                    if uploading_to_discord:
-                        bot_message = await respond_to.send(file=response.local_file_path, components=comp)
-                    else:
-                        bot_message = await respond_to.send(clip.clyppy_url, components=comp)
-                else:
-                    # message
-                    msg_content = f'<@!{respond_to.author.id}> ' if delete_message else ''
-                    try:
-                        if uploading_to_discord:
-                            bot_message = await respond_to.reply(msg_content, file=response.local_file_path, components=comp)
-                        else:
-                            bot_message = await respond_to.reply(f'{msg_content}{clip.clyppy_url}', components=comp)
-                    except Exception as e:
-                        self.logger.info(f"Error replying to message: {str(e)} - sending to channel instead")
-                        delete_message = False
-                        # assume message to reply to was deleted
+                try:
+                    if isinstance(respond_to, SlashContext) or (hasattr(respond_to, 'send') and not hasattr(respond_to, 'reply')):
+                        # slash command
                         if uploading_to_discord:
-                            bot_message = await respond_to.channel.send(
-                                content=f'<@!{respond_to.author.id}>',
-                                file=response.local_file_path,
-                                components=comp
-                            )
+                            bot_message = await respond_to.send(file=response.local_file_path, components=comp)
                         else:
-                            bot_message = await respond_to.channel.send(
-                                content=f'<@!{respond_to.author.id}> {clip.clyppy_url}',
-                                components=comp
-                            )
+                            bot_message = await respond_to.send(clip.clyppy_url, components=comp)
+                    else:
+                        # message
+                        msg_content = f'<@!{respond_to.author.id}> ' if delete_message else ''
+                        try:
+                            if uploading_to_discord:
+                                bot_message = await respond_to.reply(msg_content, file=response.local_file_path, components=comp)
+                            else:
+                                bot_message = await respond_to.reply(f'{msg_content}{clip.clyppy_url}', components=comp)
+                        except Exception as e:
+                            self.logger.info(f"Error replying to message: {str(e)} - sending to channel instead")
+                            delete_message = False
+                            # assume message to reply to was deleted
+                            if uploading_to_discord:
+                                bot_message = await respond_to.channel.send(
+                                    content=f'<@!{respond_to.author.id}>',
+                                    file=response.local_file_path,
+                                    components=comp
+                                )
+                            else:
+                                bot_message = await respond_to.channel.send(
+                                    content=f'<@!{respond_to.author.id}> {clip.clyppy_url}',
+                                    components=comp
+                                )
+                except BaseException:
+                    message_sent.set_result(None)
+                    raise
+                message_sent.set_result(bot_message)
 
                 my_response_time = 0
                 if isinstance(respond_to, Message):
@@ -696,18 +775,9 @@ class AutoEmbedder:
                     except Exception as e:
                         self.logger.warning(f"Error while trying to delete pparent message: {str(e)}")
 
-                if result['success']:
-                    # Handle both Message objects and dict responses (from restored tasks)
-                    msg_id = bot_message.id if hasattr(bot_message, 'id') else bot_message.get('id', 0)
-                    await publish_interaction(
-                        interaction_data={'response_time': my_response_time, 'msg_id': msg_id},
-                        apikey=self.api_key,
-                        edit_id=result['id'],
-                        edit_type='response_time',
-                        logger=self.logger
-                    )
-                else:
-                    self.logger.info(f"Failed to publish BotInteraction to server for {clip.id} ({guild.name} - #{chn})")
+                # Handle both Message objects and dict responses (from restored tasks)
+                msg_id = bot_message.id if hasattr(bot_message, 'id') else bot_message.get('id', 0)
+                interaction_outbox.set_response_time(record, my_response_time, msg_id)
             except Exception as e:
                 # Handle error
                 self.logger.info(f"Could not send interaction: {e}")
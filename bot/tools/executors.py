@@ -0,0 +1,191 @@
+"""Named thread pools, one per kind of blocking work.
+
+Everything used to go through the loop's default executor, so a handful of multi-minute YouTube downloads could
+take every thread and leave a 50ms S3 thumbnail upload queued behind them. Each kind of work now has its own
+pool, sized for it:
+
+extraction: yt-dlp metadata extraction (network bound, short)
+downloads:  yt-dlp downloads (network and disk bound, long)
+media:      ffmpeg / moviepy probing and frame extraction (CPU bound)
+storage:    boto3 uploads and other blocking storage I/O (short)
+
+Every pool reports its queue depth, how long work waited for a thread and how long it ran (in /metrics), and
+shuts down gracefully with the bot: queued work is cancelled and running work gets some time to finish.
+
+A thread can't be interrupted, so cancelling the coroutine awaiting run() doesn't stop the work. Long jobs use
+run_cancellable() instead. The job gets a CancelToken and checks it as it goes (yt-dlp does it from its progress
+hooks). When the caller is cancelled (a timeout, the bot shutting down...), the token is cancelled and the caller
+waits for the job to actually stop, so it can clean up after it.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Set, TypeVar
+from bot.utils.metrics import LatencyHistogram, register_metrics
+from os import getenv
+import contextvars
+import threading
+import functools
+import asyncio
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+WAIT_BUCKETS = (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RUN_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+CANCEL_GRACE = 10  # seconds a cancelled job gets to notice and stop
+
+
+class JobCancelled(Exception):
+    """Raised in a job by CancelToken.check() once whoever was waiting for it has given up"""
+
+
+class CancelToken:
+    def __init__(self):
+        self._event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        self._event.set()
+
+    def check(self):
+        if self._event.is_set():
+            raise JobCancelled()
+
+
+class NamedExecutor:
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max(1, max_workers)
+        self._pool = ThreadPoolExecutor(self.max_workers, thread_name_prefix=f'{name}-pool')
+        self._lock = threading.Lock()
+        self.wait_time = LatencyHistogram(WAIT_BUCKETS)
+        self.run_time = LatencyHistogram(RUN_BUCKETS)
+        self.queued = 0
+        self.running = 0
+        self.max_queued = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.abandoned = 0
+        self.closed = False
+        self._tokens: Set[CancelToken] = set()
+
+    def _call(self, fn: Callable[..., T], enqueued: float) -> T:
+        started = time.monotonic()
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+            self.wait_time.observe(started - enqueued)
+        error = False
+        try:
+            return fn()
+        except BaseException:
+            error = True
+            raise
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.run_time.observe(time.monotonic() - started, error=error)
+                if error:
+                    self.failed += 1
+                else:
+                    self.completed += 1
+
+    def _submit(self, fn: Callable[..., T], *args, **kwargs) -> 'Future[T]':
+        if self.closed:
+            raise RuntimeError(f"The {self.name} executor is shut down")
+        call = functools.partial(contextvars.copy_context().run, fn, *args, **kwargs)
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        try:
+            return self._pool.submit(self._call, call, time.monotonic())
+        except RuntimeError:
+            with self._lock:
+                self.queued -= 1
+            raise
+
+    async def run(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """Run fn(*args, **kwargs) on this pool, in the caller's context (like asyncio.to_thread)"""
+        return await asyncio.wrap_future(self._submit(fn, *args, **kwargs))
+
+    async def run_cancellable(self, fn: Callable[..., T], *args, **kwargs) -> T:
+        """
+        Run fn(token, *args, **kwargs) on this pool. If the caller is cancelled, the token is cancelled too, and
+        the CancelledError is only raised once fn has stopped (or after CANCEL_GRACE, if it doesn't).
+        """
+        token = CancelToken()
+        future = self._submit(fn, token, *args, **kwargs)
+        job = asyncio.wrap_future(future)
+        self._tokens.add(token)
+        try:
+            return await asyncio.shield(job)
+        except asyncio.CancelledError:
+            token.cancel()
+            with self._lock:
+                self.cancelled += 1
+                if not future.done() and future.cancel():  # it hadn't started, so it never will
+                    self.queued -= 1
+            if not future.cancelled():
+                await asyncio.wait([job], timeout=CANCEL_GRACE)
+                if not job.done():
+                    self.abandoned += 1
+                    logger.warning(f"[Executors] A cancelled {self.name} job is still running after {CANCEL_GRACE}s")
+            job.add_done_callback(lambda f: f.cancelled() or f.exception())  # nobody is waiting for its result
+            raise
+        finally:
+            self._tokens.discard(token)
+
+    async def shutdown(self, timeout: float):
+        """Stop taking work, cancel what's queued and what's cancellable, and wait up to `timeout` for the rest"""
+        self.closed = True
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        for token in list(self._tokens):
+            token.cancel()
+        with self._lock:
+            self.queued = 0  # cancelled futures never reach _call
+        deadline = time.monotonic() + timeout
+        while self.running and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self.running:
+            logger.warning(f"[Executors] {self.running} {self.name} job(s) still running after {timeout}s, leaving them")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            wait, run = self.wait_time.snapshot(), self.run_time.snapshot()
+            return {
+                'max_workers': self.max_workers,
+                'running': self.running,
+                'queued': self.queued,
+                'max_queued': self.max_queued,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'abandoned': self.abandoned,
+                'wait_p50': wait['p50'],
+                'wait_p99': wait['p99'],
+                'run_p50': run['p50'],
+                'run_p99': run['p99'],
+            }
+
+
+extraction = NamedExecutor('extraction', int(getenv('EXTRACTION_WORKERS', 16)))
+downloads = NamedExecutor('downloads', int(getenv('DOWNLOAD_WORKERS', 6)))
+media = NamedExecutor('media', int(getenv('MEDIA_WORKERS', os.cpu_count() or 2)))
+storage = NamedExecutor('storage', int(getenv('STORAGE_WORKERS', 8)))
+
+ALL = (extraction, downloads, media, storage)
+
+
+async def shutdown(timeout: float = 30):
+    """Shut every pool down, in parallel"""
+    await asyncio.gather(*(executor.shutdown(timeout) for executor in ALL))
+
+
+register_metrics('executors', lambda: {executor.name: executor.stats() for executor in ALL})
@@ -0,0 +1,174 @@
+"""Per-guild fair queueing for quickembeds.
+
+Quickembeds are admitted through a fixed number of slots. When they're all busy, waiting work is queued per
+guild and slots are handed out with deficit round robin across guilds, so a guild posting dozens of links
+takes turns with everyone else instead of filling every slot. Each guild also has a cap on how many of its
+quickembeds run at once, and on how many may wait; past that, new ones are rejected with GuildQueueFull.
+"""
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Hashable
+from bot.errors import GuildQueueFull
+from bot.utils.metrics import LatencyHistogram, register_metrics
+from os import getenv
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class _Waiter:
+    __slots__ = ('future', 'cost', 'enqueued_at')
+
+    def __init__(self, future: asyncio.Future, cost: float):
+        self.future = future
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+
+
+class _GuildQueue:
+    __slots__ = ('waiters', 'deficit', 'running', 'served', 'rejected')
+
+    def __init__(self):
+        self.waiters: Deque[_Waiter] = deque()
+        self.deficit = 0.0
+        self.running = 0
+        self.served = 0
+        self.rejected = 0
+
+
+class FairQueue:
+    def __init__(self, workers: int, per_guild_concurrency: int = 2, per_guild_queue_limit: int = 10,
+                 quantum: float = 1.0):
+        self.workers = workers
+        self.per_guild_concurrency = per_guild_concurrency
+        self.per_guild_queue_limit = per_guild_queue_limit
+        self.quantum = quantum
+        self.running = 0
+        self._guilds: Dict[Hashable, _GuildQueue] = {}
+        self._active: "OrderedDict[Hashable, None]" = OrderedDict()  # round robin order of guilds with waiters
+        # metrics
+        self.admitted = 0
+        self.rejected = 0
+        self.wait_times = LatencyHistogram(WAIT_BUCKETS)
+
+    def _guild(self, guild_id: Hashable) -> _GuildQueue:
+        g = self._guilds.get(guild_id)
+        if g is None:
+            g = self._guilds[guild_id] = _GuildQueue()
+        return g
+
+    def _forget_if_idle(self, guild_id: Hashable, g: _GuildQueue):
+        if not g.waiters and g.running == 0:
+            self._guilds.pop(guild_id, None)
+            self._active.pop(guild_id, None)
+
+    def queued(self) -> int:
+        return sum(len(g.waiters) for g in self._guilds.values())
+
+    def _dispatch(self):
+        """Hand free slots to waiting guilds, deficit round robin"""
+        eligible = True
+        while self.running < self.workers and self._active and eligible:
+            # keep going round while some guild below its cap is waiting - its deficit grows every round
+            eligible = False
+            for guild_id in list(self._active):
+                if self.running >= self.workers:
+                    break
+                g = self._guilds[guild_id]
+                while g.waiters and g.waiters[0].future.done():
+                    g.waiters.popleft()  # cancelled while queued
+                if not g.waiters:
+                    g.deficit = 0.0
+                    self._active.pop(guild_id, None)
+                    self._forget_if_idle(guild_id, g)
+                    continue
+                if g.running >= self.per_guild_concurrency:
+                    continue  # at its cap, doesn't earn credit while it waits
+
+                eligible = True
+                g.deficit += self.quantum
+                while g.waiters and g.running < self.per_guild_concurrency and self.running < self.workers \
+                        and g.deficit >= g.waiters[0].cost:
+                    waiter = g.waiters.popleft()
+                    if waiter.future.done():
+                        continue
+                    g.deficit -= waiter.cost
+                    g.running += 1
+                    self.running += 1
+                    waiter.future.set_result(None)
+                # move to the back of the round
+                self._active.move_to_end(guild_id)
+                if not g.waiters:
+                    g.deficit = 0.0
+                    self._active.pop(guild_id, None)
+
+    def _release(self, guild_id: Hashable):
+        g = self._guilds.get(guild_id)
+        self.running -= 1
+        if g is not None:
+            g.running -= 1
+            g.served += 1
+            self._forget_if_idle(guild_id, g)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, guild_id: Hashable, cost: float = 1.0):
+        """
+        Hold a slot for one quickembed from `guild_id` for the duration of the block.
+        Raises GuildQueueFull if the guild already has too much work waiting.
+        """
+        g = self._guild(guild_id)
+        if not g.waiters and g.running < self.per_guild_concurrency and self.running < self.workers:
+            g.running += 1
+            self.running += 1
+            self.wait_times.observe(0)
+        else:
+            if len(g.waiters) >= self.per_guild_queue_limit:
+                g.rejected += 1
+                self.rejected += 1
+                raise GuildQueueFull(guild_id, len(g.waiters))
+            waiter = _Waiter(asyncio.get_running_loop().create_future(), cost)
+            g.waiters.append(waiter)
+            self._active.setdefault(guild_id, None)
+            self._dispatch()
+            try:
+                await waiter.future
+            except asyncio.CancelledError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    self._release(guild_id)  # got a slot just as we were cancelled
+                else:
+                    waiter.future.cancel()
+                    self._dispatch()
+                raise
+            self.wait_times.observe(time.monotonic() - waiter.enqueued_at)
+
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self._release(guild_id)
+
+    def stats(self) -> Dict[str, Any]:
+        busiest = sorted(self._guilds.items(), key=lambda kv: len(kv[1].waiters) + kv[1].running, reverse=True)[:5]
+        return {
+            'workers': self.workers,
+            'running': self.running,
+            'queued': self.queued(),
+            'active_guilds': len(self._active),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'wait_seconds': self.wait_times.snapshot(),
+            'busiest_guilds': {str(gid): {'running': g.running, 'queued': len(g.waiters)} for gid, g in busiest},
+        }
+
+
+quickembed_queue = FairQueue(
+    workers=int(getenv('QUICKEMBED_WORKERS', 20)),
+    per_guild_concurrency=int(getenv('QUICKEMBED_PER_GUILD_CONCURRENCY', 2)),
+    per_guild_queue_limit=int(getenv('QUICKEMBED_PER_GUILD_QUEUE_LIMIT', 10)),
+)
+register_metrics('quickembed_queue', quickembed_queue.stats)
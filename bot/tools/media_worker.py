@@ -0,0 +1,556 @@
+"""Out-of-process media worker service.
+
+The gateway process keeps the Discord I/O and hands the heavy media work - yt-dlp extraction, downloads,
+moviepy/ffmpeg probing, thumbnails and uploads to clyppy.io - to media worker processes over a Unix socket.
+Workers are started (and scaled) on their own:
+
+    python -m bot.tools.media_worker --socket /tmp/clyppybot_media.sock --workers 4
+
+The parent binds the socket and forks the workers, which all accept connections on it, and restarts any that
+die. Each worker also listens on a socket of its own, <socket>.<pid>. MEDIA_WORKER_SOCKET tells the gateway where
+to find them. When it's unset, or nothing is listening, the
+gateway does the work itself like before.
+
+Protocol: frames of a 4-byte big-endian length followed by a JSON object. The gateway opens a connection per
+job and sends one request, {"op", "args"}. The worker answers with progress frames ({"type": "progress"}, at
+least every PROGRESS_INTERVAL seconds) and then one {"type": "result"} or {"type": "error"} frame. Closing the
+connection cancels the job.
+
+get_clip leaves the clip object in the worker and returns a handle to it, along with the worker's own socket.
+The gateway wraps that in a RemoteClip, which forwards download, thumbnail and upload calls to that socket, so
+they reach the worker holding the clip rather than whichever one accepts on the shared socket.
+
+Downloads and thumbnails pass file paths both ways (the gateway sends or uploads the files and deletes them), so
+workers must run on the same host and in the same working directory as the gateway. The gateway checks this
+with a probe file before its first job, and does the work itself if they don't.
+
+SIGTERM/SIGINT drain a worker: it stops taking new clips, finishes its jobs and the follow-up calls on clips it
+holds (for up to MEDIA_WORKER_DRAIN_TIMEOUT seconds), then flushes what it owes clyppy.io. Each worker slot
+has its own spool database.
+"""
+from dataclasses import asdict, is_dataclass
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Optional
+from bot.classes import BaseClip
+from bot.types import DownloadResponse, LocalFileInfo
+from bot.utils.cache import TTLCache
+from bot.utils.metrics import register_metrics
+from bot.utils import deadline
+from os import getenv
+import bot.errors
+import builtins
+import argparse
+import asyncio
+import logging
+import signal
+import socket
+import struct
+import json
+import time
+import uuid
+import os
+
+logger = logging.getLogger(__name__)
+
+MEDIA_WORKER_SOCKET = getenv('MEDIA_WORKER_SOCKET')
+MEDIA_WORKER_MAX_JOBS = int(getenv('MEDIA_WORKER_MAX_JOBS', 8))  # per worker process
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+PROGRESS_INTERVAL = 5
+PROGRESS_TIMEOUT = 60  # a worker that goes quiet for this long is presumed dead
+MEDIA_WORKER_DRAIN_TIMEOUT = float(getenv('MEDIA_WORKER_DRAIN_TIMEOUT', 120))
+MEDIA_WORKER_DRAIN_IDLE = 5  # a draining worker exits once no job ran for this long
+CLIP_HANDLE_TTL = 60 * 60
+
+# what the gateway may call on a clip held by a worker
+REMOTE_CLIP_METHODS = {'download', 'dl_download', 'create_first_frame_webp', 'download_first_frame_webp',
+                       'upload_to_clyppyio', 'get_thumbnail'}
+# clip attributes kept in sync between the gateway and the worker around every call
+SYNCED_CLIP_ATTRS = ('clyppy_id', 'is_discord_attachment', 'title', 'duration', 'tokens_used')
+
+_VALUE_TYPES = {'DownloadResponse': DownloadResponse, 'LocalFileInfo': LocalFileInfo}
+
+
+class MediaWorkerUnavailable(ConnectionError):
+    """No media worker could take the job (started=False), or the worker was lost while running it"""
+
+    def __init__(self, message: str, started: bool = False):
+        super().__init__(message)
+        self.started = started
+
+
+class MediaWorkerError(Exception):
+    """An error raised in the worker that has no equivalent in this process"""
+
+
+async def read_frame(reader: asyncio.StreamReader) -> dict:
+    (size,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Media worker frame of {size} bytes is too large")
+    return json.loads(await reader.readexactly(size))
+
+
+def write_frame(writer: asyncio.StreamWriter, msg: dict):
+    data = json.dumps(msg, default=str).encode()
+    writer.write(FRAME_HEADER.pack(len(data)) + data)
+
+
+def encode_value(value: Any) -> Any:
+    if is_dataclass(value) and type(value).__name__ in _VALUE_TYPES:
+        return {'__type__': type(value).__name__, **asdict(value)}
+    return value
+
+
+def decode_value(value: Any) -> Any:
+    if isinstance(value, dict) and value.get('__type__') in _VALUE_TYPES:
+        fields = dict(value)
+        return _VALUE_TYPES[fields.pop('__type__')](**fields)
+    return value
+
+
+def encode_error(e: BaseException) -> dict:
+    attrs = {}
+    for k, v in vars(e).items():
+        try:
+            json.dumps(v)
+            attrs[k] = v
+        except (TypeError, ValueError):
+            pass
+    return {'type': 'error', 'error': type(e).__name__, 'message': str(e), 'attrs': attrs}
+
+
+def decode_error(frame: dict) -> Exception:
+    """Rebuild the worker's exception, as the same class when we know it, so callers handle it the same way"""
+    name = frame.get('error', '')
+    cls = getattr(bot.errors, name, None) or getattr(builtins, name, None)
+    if not (isinstance(cls, type) and issubclass(cls, Exception)):
+        return MediaWorkerError(f"{name}: {frame.get('message')}")
+    err = cls.__new__(cls)
+    Exception.__init__(err, frame.get('message'))
+    err.__dict__.update(frame.get('attrs') or {})
+    return err
+
+
+def worker_address(path: str, pid: int) -> str:
+    """The socket a worker listens on by itself, next to the shared one at `path`"""
+    return f"{path}.{pid}"
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def clip_state(clip: BaseClip) -> Dict[str, Any]:
+    return {attr: getattr(clip, attr, None) for attr in SYNCED_CLIP_ATTRS}
+
+
+def describe_message(msg) -> Optional[dict]:
+    """The parts of a Message/SlashContext that clip extraction needs (token checks), for a worker"""
+    if msg is None:
+        return None
+    guild = getattr(msg, 'guild', None)
+    return {
+        'id': str(msg.id),
+        'author': {'id': str(msg.author.id), 'username': getattr(msg.author, 'username', None)},
+        'guild': {'id': str(guild.id)} if guild is not None else None,
+    }
+
+
+def _message_stub(desc: Optional[dict]):
+    if desc is None:
+        return None
+    return SimpleNamespace(
+        id=int(desc['id']),
+        author=SimpleNamespace(id=int(desc['author']['id']), username=desc['author']['username']),
+        guild=SimpleNamespace(id=int(desc['guild']['id'])) if desc['guild'] else None,
+    )
+
+
+class RemoteClip(BaseClip):
+    """A clip whose object lives in a media worker. Media operations run there, everything else here."""
+
+    def __init__(self, client: 'MediaWorkerClient', desc: dict, cdn_client):
+        self._client = client
+        self._handle = desc['handle']
+        self._worker = desc.get('worker')  # the socket of the worker holding the clip
+        self._service = desc['service']
+        self._url = desc['url']
+        self._share_url = desc.get('share_url')
+        super().__init__(desc['id'], cdn_client, desc.get('tokens_used'), desc.get('duration'))
+        self._clyppy_id_input = desc['clyppy_id_input']
+        self._apply(desc)
+
+    @property
+    def service(self) -> str:
+        return self._service
+
+    @property
+    def url(self) -> str:
+        return self._url
+
+    @property
+    def share_url(self) -> Optional[str]:
+        return self._share_url
+
+    def _apply(self, state: dict):
+        for attr in SYNCED_CLIP_ATTRS:
+            if attr in state:
+                setattr(self, attr, state[attr])
+
+    def _on_progress(self, frame: dict):
+        self.logger.debug(f"[MediaWorker] {self.id}: {frame.get('stage')} ({frame.get('elapsed')}s)")
+
+    async def _call(self, method: str, *args, **kwargs):
+        result = await self._client.call(
+            'clip', progress=self._on_progress, worker=self._worker, handle=self._handle, method=method, state=clip_state(self),
+            args=[encode_value(a) for a in args], kwargs={k: encode_value(v) for k, v in kwargs.items()}
+        )
+        self._apply(result['state'])
+        return decode_value(result['value'])
+
+    async def download(self, *args, **kwargs) -> DownloadResponse:
+        return await self._call('download', *args, **kwargs)
+
+    async def dl_download(self, *args, **kwargs) -> Optional[LocalFileInfo]:
+        return await self._call('dl_download', *args, **kwargs)
+
+    async def create_first_frame_webp(self, *args, **kwargs) -> str:
+        return await self._call('create_first_frame_webp', *args, **kwargs)
+
+    async def download_first_frame_webp(self, *args, **kwargs) -> str:
+        return await self._call('download_first_frame_webp', *args, **kwargs)
+
+    async def upload_to_clyppyio(self, *args, **kwargs) -> DownloadResponse:
+        return await self._call('upload_to_clyppyio', *args, **kwargs)
+
+    async def get_thumbnail(self):
+        return await self._call('get_thumbnail')
+
+
+class MediaWorkerClient:
+    """The gateway's side: sends jobs to whichever media worker accepts the connection"""
+
+    def __init__(self, path: Optional[str] = MEDIA_WORKER_SOCKET):
+        self.path = path
+        self._checked = False
+        # metrics
+        self.jobs = 0
+        self.failures = 0
+        self.unavailable = 0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    async def call(self, op: str, progress: Callable[[dict], None] = None, worker: Optional[str] = None,
+                   **args) -> Any:
+        """Run `op` on any worker, or on the one listening at `worker`"""
+        path = worker or self.path
+        try:
+            reader, writer = await asyncio.open_unix_connection(path)
+        except (FileNotFoundError, ConnectionRefusedError) as e:
+            self.unavailable += 1
+            raise MediaWorkerUnavailable(f"No media worker listening on {path}") from e
+
+        self.jobs += 1
+        try:
+            # the job gets what's left of the caller's deadline (see bot/utils/deadline.py)
+            write_frame(writer, {'op': op, 'args': args, 'deadline': deadline.remaining()})
+            await writer.drain()
+            while True:
+                try:
+                    frame = await asyncio.wait_for(read_frame(reader), PROGRESS_TIMEOUT)
+                except (asyncio.IncompleteReadError, ConnectionError, asyncio.TimeoutError) as e:
+                    self.unavailable += 1
+                    raise MediaWorkerUnavailable(f"Lost the media worker during {op}", started=True) from e
+                if frame['type'] == 'progress':
+                    if progress is not None:
+                        progress(frame)
+                elif frame['type'] == 'error':
+                    self.failures += 1
+                    raise decode_error(frame)
+                else:
+                    return frame['value']
+        finally:
+            writer.close()
+
+    async def _check_shared_files(self):
+        """Make sure the workers see our files at the same relative paths, or stop using them"""
+        name = f".media_worker_probe_{uuid.uuid4().hex}"
+        with open(name, 'w') as f:
+            f.write(name)
+        try:
+            seen = await self.call('probe', name=name)
+        finally:
+            _unlink(name)
+        if seen != name:
+            logger.error(f"[MediaWorker] Workers on {self.path} don't share this process's working directory "
+                         f"({os.getcwd()}), doing media work here instead")
+            path, self.path = self.path, None
+            raise MediaWorkerUnavailable(f"Media workers on {path} don't share our files")
+        self._checked = True
+
+    async def get_clip(self, platform, url: str, basemsg=None, **kwargs) -> RemoteClip:
+        if not self._checked:
+            await self._check_shared_files()
+        desc = await self.call('get_clip', platform=platform.platform_name, url=url,
+                               basemsg=describe_message(basemsg), kwargs=kwargs)
+        return RemoteClip(self, desc, platform.cdn_client)
+
+    def stats(self) -> Dict[str, Any]:
+        return {'enabled': self.enabled, 'jobs': self.jobs, 'failures': self.failures, 'unavailable': self.unavailable}
+
+
+media_worker = MediaWorkerClient()
+register_metrics('media_worker', media_worker.stats)
+
+
+class MediaWorkerServer:
+    """The worker's side. `bot` needs platform_list (and optionally base_embedder) like the real bot."""
+
+    def __init__(self, bot, max_jobs: int = MEDIA_WORKER_MAX_JOBS, address: Optional[str] = None):
+        """
+        Args:
+            address: Socket this worker alone listens on (see worker_address()), for calls on the clips it holds
+        """
+        self.bot = bot
+        self.address = address
+        self.clips = TTLCache(maxsize=10000, ttl=CLIP_HANDLE_TTL)
+        self._jobs = asyncio.Semaphore(max_jobs)
+        self._active = 0
+        self._last_job = 0.0
+        # metrics
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def _platform(self, name: str):
+        platforms = list(getattr(self.bot, 'platform_list', []))
+        base = getattr(self.bot, 'base_embedder', None)
+        if base is not None:
+            platforms.append(base.platform)
+        for platform in platforms:
+            if (platform.platform_name or '').lower() == (name or '').lower():
+                return platform
+        raise ValueError(f"Unknown platform {name}")
+
+    async def run(self, op: str, args: dict) -> Any:
+        if op == 'ping':
+            return {'pid': os.getpid(), **self.stats()}
+        if op == 'probe':
+            try:
+                with open(args['name']) as f:
+                    return f.read()
+            except OSError:
+                return None
+        if op == 'get_clip':
+            platform = self._platform(args['platform'])
+            clip = await platform.get_clip(args['url'], basemsg=_message_stub(args.get('basemsg')), **args.get('kwargs', {}))
+            handle = uuid.uuid4().hex
+            self.clips.set(handle, clip)
+            return {'handle': handle, 'worker': self.address, 'service': clip.service, 'id': clip.id, 'url': clip.url,
+                    'share_url': clip.share_url, 'clyppy_id_input': clip._clyppy_id_input, **clip_state(clip)}
+        if op == 'clip':
+            clip = self.clips.get(args['handle'])
+            if clip is None:
+                raise bot.errors.UnknownError(f"Clip handle {args['handle']} expired on this media worker")
+            if args['method'] not in REMOTE_CLIP_METHODS:
+                raise ValueError(f"{args['method']} can't be called on a remote clip")
+            for attr, value in (args.get('state') or {}).items():
+                if attr in SYNCED_CLIP_ATTRS:
+                    setattr(clip, attr, value)
+            call_args = [decode_value(a) for a in args.get('args', [])]
+            call_kwargs = {k: decode_value(v) for k, v in args.get('kwargs', {}).items()}
+            value = await getattr(clip, args['method'])(*call_args, **call_kwargs)
+            return {'value': encode_value(value), 'state': clip_state(clip)}
+        raise ValueError(f"Unknown media worker op {op}")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await read_frame(reader)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            writer.close()
+            return
+
+        progress = {'stage': 'queued'}
+        started = time.monotonic()
+        self._active += 1
+
+        async def report():
+            while True:
+                write_frame(writer, {'type': 'progress', 'stage': progress['stage'],
+                                     'elapsed': round(time.monotonic() - started, 1)})
+                await asyncio.sleep(PROGRESS_INTERVAL)
+
+        async def job():
+            with deadline.deadline_after(request.get('deadline')):
+                async with self._jobs:
+                    progress['stage'] = 'running'
+                    return await self.run(request.get('op'), request.get('args') or {})
+
+        reporter = asyncio.create_task(report())
+        job_task = asyncio.create_task(job())
+        hangup = asyncio.create_task(reader.read(1))  # the gateway only writes again by closing the connection
+        try:
+            await asyncio.wait([job_task, hangup], return_when=asyncio.FIRST_COMPLETED)
+            if not job_task.done():
+                self.cancelled += 1
+                job_task.cancel()
+                logger.info(f"[MediaWorker] Gateway went away, cancelled {request.get('op')}")
+                return
+            try:
+                frame = {'type': 'result', 'value': job_task.result()}
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                frame = encode_error(e)
+            write_frame(writer, frame)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._active -= 1
+            self._last_job = time.monotonic()
+            reporter.cancel()
+            hangup.cancel()
+            writer.close()
+
+    async def serve(self, sock: socket.socket):
+        """Serve until SIGTERM/SIGINT, then drain"""
+        from bot.utils.watchdog import loop_watchdog
+        from bot.utils.eventloop import add_signal_handler
+        loop_watchdog.start()
+        stopping = asyncio.Event()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            add_signal_handler(asyncio.get_running_loop(), sig, stopping.set)
+        shared = await asyncio.start_unix_server(self.handle, sock=sock)
+        own = None
+        try:
+            if self.address is not None:
+                own = await asyncio.start_unix_server(self.handle, path=self.address)
+            await stopping.wait()
+            # no new clips, but the address stays open for calls on the clips we hold
+            shared.close()
+            await self.drain()
+        finally:
+            shared.close()
+            if own is not None:
+                own.close()
+            if self.address is not None:
+                _unlink(self.address)
+
+    async def drain(self):
+        """Wait for running jobs, and until no job ran for MEDIA_WORKER_DRAIN_IDLE seconds"""
+        logger.info(f"[MediaWorker] Worker {os.getpid()} draining ({self._active} jobs running)")
+        give_up_at = time.monotonic() + MEDIA_WORKER_DRAIN_TIMEOUT
+        while time.monotonic() < give_up_at:
+            if not self._active and time.monotonic() - self._last_job >= MEDIA_WORKER_DRAIN_IDLE:
+                return
+            await asyncio.sleep(0.1)
+        logger.warning(f"[MediaWorker] Worker {os.getpid()} stopping with {self._active} jobs still running")
+
+    def stats(self) -> Dict[str, Any]:
+        return {'completed': self.completed, 'failed': self.failed, 'cancelled': self.cancelled,
+                'clips': len(self.clips)}
+
+
+def _headless_bot():
+    """What the platforms need from the bot, without a Discord connection"""
+    from bot.io.cdn import CdnSpacesClient
+    from bot.setup import init_misc
+    return init_misc(SimpleNamespace(cdn_client=CdnSpacesClient()))
+
+
+def _run_worker(sock: socket.socket, path: str, max_jobs: int, slot: int):
+    from bot.io import token_ledger
+    from bot.io.spool import spool, SPOOL_DB_PATH
+    media_worker.path = None  # never forward our own jobs to another worker
+    # like cluster workers, each slot keeps its own spool, which its next worker picks up after a restart
+    base, ext = os.path.splitext(SPOOL_DB_PATH)
+    spool.path = f"{base}_media_{slot}{ext}"
+    server = MediaWorkerServer(_headless_bot(), max_jobs, address=worker_address(path, os.getpid()))
+    register_metrics('media_worker_server', server.stats)
+    logger.info(f"[MediaWorker] Worker {os.getpid()} ready")
+
+    async def run():
+        spool.start()
+        await server.serve(sock)
+        # the token debits and refunds made here are this worker's to send
+        await token_ledger.flush_refunds()
+        await spool.drain(timeout=5)
+
+    from bot.utils.eventloop import new_event_loop
+    with asyncio.Runner(loop_factory=new_event_loop) as runner:
+        runner.run(run())
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--socket', default=MEDIA_WORKER_SOCKET or '/tmp/clyppybot_media.sock')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--jobs', type=int, default=MEDIA_WORKER_MAX_JOBS, help="concurrent jobs per worker")
+    args = parser.parse_args()
+
+    _unlink(args.socket)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(args.socket)
+    sock.listen(128)
+
+    children: Dict[int, int] = {}  # pid -> slot
+    stopping = False
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            # the parent's handlers would signal our siblings. the worker's event loop sets its own
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            _run_worker(sock, args.socket, args.jobs, slot)
+            os._exit(0)
+        children[pid] = slot
+
+    def stop(*_):
+        nonlocal stopping
+        if stopping:
+            return
+        stopping = True
+        # new connections fail right away, so gateways fall back to doing the work themselves
+        _unlink(args.socket)
+        sock.close()
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(args.workers):
+        spawn(slot)
+    logger.info(f"[MediaWorker] {args.workers} workers listening on {args.socket}")
+
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        slot = children.pop(pid, None)
+        _unlink(worker_address(args.socket, pid))  # its clips are gone with it
+        if not stopping and slot is not None:
+            logger.warning(f"[MediaWorker] Worker {pid} exited ({status}), starting a new one")
+            time.sleep(1)
+            spawn(slot)
+    _unlink(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+"""Load shedding for quickembeds.
+
+When downloads back up, every new quickembed link is work that will most likely time out: it takes a slot,
+bandwidth and CPU, and makes the backlog everyone is waiting on longer. The overload controller watches how
+loaded the bot is and tells on_message_create what to do with new links, in steps:
+
+NORMAL     embed everything
+SHED_LONG  only embed links that are short clips by nature (Twitch/Kick/Medal clips, TikToks, Shorts...), skip
+           the ones that could be long videos and need a length check first
+DEFER      also put the short ones in the task queue, they're embedded once the bot is back to NORMAL (or after
+           a restart, like the ones queued during shutdown). Once OVERLOAD_DEFERRED_LIMIT are waiting, they're
+           dropped instead.
+DROP       don't embed anything, react to the message so its author knows the bot is busy
+
+Slash commands are never shed: someone is watching the "thinking..." state, and they go before quickembeds in
+the download scheduler anyway.
+
+The level is the highest one reached by any of these signals:
+queue_depth          quickembeds waiting for a fair queue slot, plus work waiting for a download scheduler slot
+in_flight_mb         megabytes being downloaded or uploaded right now
+executor_saturation  (running + queued) / threads, of the busiest of the extraction and download pools
+loop_lag             worst event loop lag over the last couple of seconds
+
+Each signal's thresholds are set with OVERLOAD_<SIGNAL>="shed,defer,drop", or "off" to ignore it. The level goes
+up as soon as a threshold is crossed, and only comes down once every signal has stayed under RECOVERY_RATIO of
+its thresholds for OVERLOAD_HOLD seconds, so it doesn't flap at the edge.
+"""
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Any, Callable, Dict, Optional, Tuple
+from datetime import datetime, timedelta
+from bot.errors import GuildQueueFull
+from bot.tools.fairqueue import quickembed_queue
+from bot.tools import executors
+from bot.utils.watchdog import loop_watchdog
+from bot.utils.metrics import register_metrics
+from bot.utils.deadline import create_task_without_deadline
+from os import getenv
+import threading
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+RECOVERY_RATIO = 0.8
+OVERLOAD_HOLD = float(getenv('OVERLOAD_HOLD', 15))  # seconds
+DROP_REACTION = '\N{VERTICAL TRAFFIC LIGHT}'
+RESUME_BATCH = 5  # deferred quickembeds started per resume_deferred() call
+DEFERRED_MAX_AGE = timedelta(minutes=30)  # past that, nobody is waiting for the embed anymore
+DEFERRED_LIMIT = int(getenv('OVERLOAD_DEFERRED_LIMIT', 500))  # past that, quickembeds are dropped instead
+MB = 1024 * 1024
+
+
+class Level(IntEnum):
+    NORMAL = 0
+    SHED_LONG = 1
+    DEFER = 2
+    DROP = 3
+
+
+Thresholds = Optional[Tuple[float, float, float]]
+
+
+def thresholds_from_env(name: str, default: Thresholds) -> Thresholds:
+    """(shed, defer, drop) from a "shed,defer,drop" env var, None if it's "off" """
+    value = getenv(name, '').strip().lower()
+    if not value:
+        return default
+    if value == 'off':
+        return None
+    try:
+        shed, defer, drop = (float(v) for v in value.split(','))
+    except ValueError:
+        logger.warning(f"[Overload] Invalid {name}={value!r}, expected 'shed,defer,drop' or 'off', using {default}")
+        return default
+    return shed, defer, drop
+
+
+class Signal:
+    __slots__ = ('read', 'thresholds')
+
+    def __init__(self, read: Callable[[], float], thresholds: Thresholds):
+        self.read = read
+        self.thresholds = thresholds
+
+    def level(self, value: float, ratio: float = 1.0) -> Level:
+        """The highest level whose threshold (times ratio) value is at"""
+        reached = Level.NORMAL
+        if self.thresholds is not None:
+            for level, threshold in zip((Level.SHED_LONG, Level.DEFER, Level.DROP), self.thresholds):
+                if value >= threshold * ratio:
+                    reached = level
+        return reached
+
+
+class OverloadController:
+    def __init__(self, signals: Dict[str, Signal], hold: float = OVERLOAD_HOLD,
+                 clock: Callable[[], float] = time.monotonic):
+        self.signals = signals
+        self.hold = hold
+        self.clock = clock
+        self.current = Level.NORMAL
+        self.changed_at = clock()
+        self._calm_since: Optional[float] = None
+        self.values: Dict[str, float] = {}
+        self.in_flight_bytes = 0
+        self._lock = threading.Lock()
+        # metrics
+        self.transitions = 0
+        self.seconds_at = {level: 0.0 for level in Level}
+        self.decisions = {'shed': 0, 'deferred': 0, 'dropped': 0, 'resumed': 0, 'expired': 0}
+
+    def _read(self) -> Dict[str, float]:
+        values = {}
+        for name, signal in self.signals.items():
+            try:
+                values[name] = float(signal.read())
+            except Exception as e:
+                logger.warning(f"[Overload] Failed to read {name}: {e}")
+        return values
+
+    def _set(self, level: Level, now: float):
+        self.seconds_at[self.current] += now - self.changed_at
+        log = logger.warning if level > self.current else logger.info
+        log(f"[Overload] {self.current.name} -> {level.name} "
+            f"({', '.join(f'{k}={v:g}' for k, v in self.values.items())})")
+        self.current = level
+        self.changed_at = now
+        self.transitions += 1
+        self._calm_since = None
+
+    def level(self) -> Level:
+        """The current level, updated from the signals' current values"""
+        now = self.clock()
+        self.values = self._read()
+        target = max((self.signals[k].level(v) for k, v in self.values.items()), default=Level.NORMAL)
+        if target > self.current:
+            self._set(target, now)
+        elif target < self.current:
+            calm = max((self.signals[k].level(v, RECOVERY_RATIO) for k, v in self.values.items()),
+                       default=Level.NORMAL)
+            if calm >= self.current:
+                self._calm_since = None
+            elif self._calm_since is None:
+                self._calm_since = now
+            elif now - self._calm_since >= self.hold:
+                self._set(calm, now)
+        else:
+            self._calm_since = None
+        return self.current
+
+    def action(self, level: Level, platform, url: str, deferred: int = 0) -> Level:
+        """
+        What to do with one quickembed link at `level`, with `deferred` quickembeds already waiting in the task
+        queue: NORMAL embeds it, the others shed, defer or drop it
+        """
+        if level == Level.NORMAL:
+            return Level.NORMAL
+        if not platform.is_shortform_link(url):
+            return Level.SHED_LONG
+        if level == Level.SHED_LONG:
+            return Level.NORMAL
+        if level == Level.DEFER and deferred >= DEFERRED_LIMIT:
+            return Level.DROP
+        return level
+
+    def record(self, decision: str, count: int = 1):
+        self.decisions[decision] += count
+
+    @contextmanager
+    def carrying(self, nbytes: int = 0):
+        """
+        Count bytes as in flight for the duration of the block. Yields a function to update how many bytes the
+        block is carrying (downloads only know as they go), safe to call from any thread.
+        """
+        held, done = 0, False
+
+        def update(total: int):
+            nonlocal held
+            with self._lock:
+                if not done:  # an abandoned job may still report after the block is over
+                    self.in_flight_bytes += total - held
+                    held = total
+
+        update(nbytes)
+        try:
+            yield update
+        finally:
+            with self._lock:
+                self.in_flight_bytes -= held
+                done = True
+
+    def stats(self) -> Dict[str, Any]:
+        # as of the last level() call: re-evaluating here would let reading /metrics change the shedding state
+        level = self.current
+        seconds_at = dict(self.seconds_at)
+        seconds_at[level] += self.clock() - self.changed_at
+        return {
+            'level': level.name,
+            'signals': {k: round(v, 3) for k, v in self.values.items()},
+            'thresholds': {k: s.thresholds for k, s in self.signals.items()},
+            'transitions': self.transitions,
+            'seconds_at': {k.name.lower(): round(v) for k, v in seconds_at.items()},
+            **self.decisions,
+        }
+
+
+_queues: Dict[str, Callable[[], int]] = {}
+
+
+def watch_queue(name: str, depth: Callable[[], int]):
+    """Count `depth()` in the queue_depth signal"""
+    _queues[name] = depth
+
+
+def _queue_depth() -> float:
+    return quickembed_queue.queued() + sum(depth() for depth in _queues.values())
+
+
+def _executor_saturation() -> float:
+    return max((e.running + e.queued) / e.max_workers for e in (executors.extraction, executors.downloads))
+
+
+QUEUE_DEPTH_THRESHOLDS = thresholds_from_env('OVERLOAD_QUEUE_DEPTH', (25, 60, 150))
+IN_FLIGHT_MB_THRESHOLDS = thresholds_from_env('OVERLOAD_IN_FLIGHT_MB', (1024, 2048, 4096))
+EXECUTOR_SATURATION_THRESHOLDS = thresholds_from_env('OVERLOAD_EXECUTOR_SATURATION', (1.5, 3, 6))
+LOOP_LAG_THRESHOLDS = thresholds_from_env('OVERLOAD_LOOP_LAG', (0.5, 1, 2.5))
+
+controller = OverloadController({
+    'queue_depth': Signal(_queue_depth, QUEUE_DEPTH_THRESHOLDS),
+    'in_flight_mb': Signal(lambda: controller.in_flight_bytes / MB, IN_FLIGHT_MB_THRESHOLDS),
+    'executor_saturation': Signal(_executor_saturation, EXECUTOR_SATURATION_THRESHOLDS),
+    'loop_lag': Signal(loop_watchdog.recent_lag, LOOP_LAG_THRESHOLDS),
+})
+
+
+async def _resume(bot, task):
+    from bot.task_queue import process_quickembed_task
+    try:
+        async with quickembed_queue.slot(task.guild_id):
+            await process_quickembed_task(bot, task)
+    except GuildQueueFull as e:
+        logger.info(f"[Overload] Dropping deferred quickembed {task.clip_url}: {e}")
+
+
+def resume_deferred(bot, limit: int = RESUME_BATCH) -> int:
+    """Start up to `limit` deferred quickembeds, if the bot is back to NORMAL. Returns how many were started."""
+    tasks = bot.task_queue.quickembed_tasks
+    started = 0
+    while tasks and started < limit and not bot.is_shutting_down and controller.level() == Level.NORMAL:
+        task = tasks.pop(0)
+        if datetime.now() - task.created_at > DEFERRED_MAX_AGE:
+            controller.record('expired')
+            continue
+        controller.record('resumed')
+        create_task_without_deadline(_resume(bot, task), name=f'resume-quickembed-{task.message_id}')
+        started += 1
+    return started
+
+
+register_metrics('overload', controller.stats)
@@ -0,0 +1,152 @@
+"""Bounded, prioritised worker pool for expensive clip work (metadata extraction and downloads).
+
+At most `workers` jobs hold a slot at once. When the pool is full, callers queue and are handed a free slot
+in priority order: slash commands before quickembeds, then shorter clips before longer ones, then first come
+first served. A caller that waits in the queue longer than its timeout is removed from the queue and gets
+QueueWaitTimeout, without ever having started its job.
+"""
+from contextlib import asynccontextmanager
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from bot.errors import QueueWaitTimeout
+from bot.utils.metrics import LatencyHistogram
+from bot.utils import deadline
+from os import getenv
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# queue waits are seconds to minutes, not milliseconds
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+DEFAULT_MAX_QUEUE_WAIT = float(getenv('MAX_DOWNLOAD_QUEUE_WAIT', 300))
+
+
+class Priority(IntEnum):
+    COMMAND = 0  # someone ran /embed or /extend and is watching the "thinking..." state
+    QUICKEMBED = 1
+
+
+class _Waiter:
+    __slots__ = ('key', 'future', 'priority', 'enqueued_at')
+
+    def __init__(self, key: tuple, future: asyncio.Future, priority: Priority):
+        self.key = key
+        self.future = future
+        self.priority = priority
+        self.enqueued_at = time.monotonic()
+
+    def __lt__(self, other: '_Waiter') -> bool:
+        return self.key < other.key
+
+
+class WorkScheduler:
+    def __init__(self, name: str, workers: int, max_queue_wait: Optional[float] = DEFAULT_MAX_QUEUE_WAIT):
+        self.name = name
+        self.workers = workers
+        self.max_queue_wait = max_queue_wait
+        self.running = 0
+        self._queue: List[_Waiter] = []
+        self._waiting = 0
+        self._seq = itertools.count()
+        # metrics
+        self.started = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.cancelled = 0
+        self.max_queue_depth = 0
+        self.wait_times: Dict[Priority, LatencyHistogram] = {p: LatencyHistogram(WAIT_BUCKETS) for p in Priority}
+
+    @property
+    def queue_depth(self) -> int:
+        return self._waiting
+
+    async def _acquire(self, priority: Priority, size: float, timeout: Optional[float]):
+        if self.running < self.workers and self._waiting == 0:
+            self.running += 1
+            self.wait_times[priority].observe(0)
+            return
+
+        waiter = _Waiter((priority, size, next(self._seq)), asyncio.get_running_loop().create_future(), priority)
+        heapq.heappush(self._queue, waiter)
+        self._waiting += 1
+        self.max_queue_depth = max(self.max_queue_depth, self._waiting)
+        try:
+            if timeout is None:
+                await waiter.future
+            else:
+                await asyncio.wait_for(waiter.future, timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.info(f"[Scheduler:{self.name}] Gave up on a queued {priority.name.lower()} job after {timeout}s")
+            raise QueueWaitTimeout(self.name, timeout)
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()  # the slot was handed over just as we were cancelled, pass it on
+            else:
+                self.cancelled += 1
+            raise
+        finally:
+            self._waiting -= 1
+            if not waiter.future.done():
+                waiter.future.cancel()
+        self.wait_times[priority].observe(time.monotonic() - waiter.enqueued_at)
+
+    def _release(self):
+        while self._queue:
+            waiter = heapq.heappop(self._queue)
+            if not waiter.future.done():  # skip callers that timed out or were cancelled while queued
+                waiter.future.set_result(None)  # hand the slot straight over, `running` stays the same
+                return
+        self.running -= 1
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.QUICKEMBED, size: float = 0, timeout: Optional[float] = -1):
+        """
+        Hold one of the pool's slots for the duration of the block.
+
+        Args:
+            priority: Lower runs first
+            size: Tie-breaker within a priority, smaller runs first (e.g. the clip's duration)
+            timeout: Max seconds to wait in the queue (-1 for the scheduler default, None to wait forever).
+                     Never longer than what's left before the caller's deadline.
+        """
+        timeout = self.max_queue_wait if timeout == -1 else timeout
+        left = deadline.remaining()
+        if left is not None:
+            timeout = max(0.0, left if timeout is None else min(timeout, left))
+        await self._acquire(priority, size or 0, timeout)
+        self.started += 1
+        try:
+            yield
+        except BaseException:
+            self.failed += 1
+            raise
+        else:
+            self.completed += 1
+        finally:
+            self._release()
+
+    async def run(self, fn: Callable[..., Awaitable[Any]], *args, priority: Priority = Priority.QUICKEMBED,
+                  size: float = 0, timeout: Optional[float] = -1, **kwargs) -> Any:
+        """Await fn(*args, **kwargs) inside a slot"""
+        async with self.slot(priority, size, timeout):
+            return await fn(*args, **kwargs)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'workers': self.workers,
+            'running': self.running,
+            'queue_depth': self._waiting,
+            'max_queue_depth': self.max_queue_depth,
+            'started': self.started,
+            'completed': self.completed,
+            'failed': self.failed,
+            'queue_timeouts': self.timeouts,
+            'cancelled_while_queued': self.cancelled,
+            'wait_seconds': {p.name.lower(): h.snapshot() for p, h in self.wait_times.items()},
+        }
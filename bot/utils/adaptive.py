@@ -0,0 +1,223 @@
+"""Adaptive (AIMD) concurrency limits per platform.
+
+Each platform gets a concurrency limit between a floor and a ceiling. Every successful request raises it
+additively (by about 1 per limit's worth of successes, like TCP congestion avoidance), and every sign of
+throttling - 429s, 403s, IP blocks, timeouts, as mapped by handle_yt_dlp_err - cuts it multiplicatively.
+Cuts are at most once per cooldown, so one burst of failures from requests that were already in flight
+only counts once.
+
+A slot covers the platform's part of the work. Work that follows it in the same block, like the upload to our
+CDN, calls leave_platform_slot() first: the slot goes to the next request and that work's errors (an upload
+timeout...) aren't held against the platform.
+
+Configure with ADAPTIVE_PLATFORM_LIMITS, e.g. "twitch=1:2:6,youtube=1:1:3" (floor:initial:ceiling).
+"""
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, Optional
+from bot.errors import YtDlpForbiddenError, RemoteTimeoutError, IPBlockedError, RateLimitExceededError, DeadlineExceeded
+from bot.utils.metrics import register_metrics
+from bot.utils import deadline
+from os import getenv
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# (floor, initial, ceiling)
+DEFAULT_LIMITS = {
+    'twitch': (1, 2, 6),
+    'youtube': (1, 1, 3),
+    'tiktok': (1, 2, 6),
+    'twitter': (1, 2, 6),
+    'kick': (1, 2, 6),
+    'instagram': (1, 1, 4),
+    'facebook': (1, 1, 4),
+}
+FALLBACK_LIMITS = (1, 4, 10)
+
+# platform_name (lowercased) -> clip service name, where they differ
+ALIASES = {
+    'google drive': 'drive',
+    'rule34video': 'rule34',
+    'x': 'twitter',
+}
+
+THROTTLE_ERRORS = (YtDlpForbiddenError, RemoteTimeoutError, IPBlockedError, RateLimitExceededError,
+                   asyncio.TimeoutError, TimeoutError)
+THROTTLE_MARKERS = ('HTTP Error 429', 'Too Many Requests', 'rate-limit', 'rate limit')
+
+
+class _HeldSlot:
+    __slots__ = ('limiter', 'released')
+
+    def __init__(self, limiter: 'AdaptiveLimiter'):
+        self.limiter = limiter
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.limiter.in_flight -= 1
+            self.limiter._wake()
+
+
+_held_slot: ContextVar[Optional[_HeldSlot]] = ContextVar('platform_slot', default=None)
+
+
+def leave_platform_slot():
+    """The platform's part of the work in the current slot is done (and went fine): free the slot now"""
+    slot = _held_slot.get()
+    if slot is not None and not slot.released:
+        slot.limiter.on_success()
+        slot.release()
+
+
+def is_throttle_error(e: BaseException) -> bool:
+    """Whether an error means the platform wants us to slow down"""
+    if isinstance(e, THROTTLE_ERRORS):
+        return True
+    msg = str(e)
+    return any(marker in msg for marker in THROTTLE_MARKERS)
+
+
+class AdaptiveLimiter:
+    def __init__(self, name: str, floor: int = 1, initial: int = 2, ceiling: int = 8,
+                 decrease: float = 0.5, cooldown: float = 5.0):
+        self.name = name
+        self.floor = floor
+        self.ceiling = max(floor, ceiling)
+        self.limit = float(min(max(initial, floor), self.ceiling))
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_cut = 0.0
+        # metrics
+        self.successes = 0
+        self.throttles = 0
+        self.cuts = 0
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self.in_flight += 1  # handed straight to the waiter
+                fut.set_result(None)
+
+    @property
+    def concurrency(self) -> int:
+        return int(self.limit)
+
+    def on_success(self):
+        self.successes += 1
+        if self.limit < self.ceiling:
+            self.limit = min(self.ceiling, self.limit + 1 / self.limit)
+            self._wake()
+
+    def on_throttle(self):
+        self.throttles += 1
+        now = time.monotonic()
+        if now - self._last_cut < self.cooldown:
+            return
+        self._last_cut = now
+        old = self.limit
+        self.limit = max(float(self.floor), self.limit * self.decrease)
+        if int(self.limit) < int(old):
+            self.cuts += 1
+            logger.info(f"[AdaptiveLimiter:{self.name}] Throttled, concurrency {int(old)} -> {int(self.limit)}")
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Hold one of the platform's slots. The outcome of the block adjusts the limit.
+        Raises DeadlineExceeded if the caller's deadline passes while waiting for one.
+        """
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+        else:
+            fut = asyncio.get_running_loop().create_future()
+            self._waiters.append(fut)
+            left = deadline.remaining()
+            try:
+                await (fut if left is None else asyncio.wait_for(fut, max(0.0, left)))
+            except asyncio.TimeoutError:
+                if fut.done() and not fut.cancelled():
+                    self.in_flight -= 1  # handed over just as we gave up, pass it on
+                    self._wake()
+                raise DeadlineExceeded(f"{self.name} work", deadline.remaining() or 0)
+            except asyncio.CancelledError:
+                if fut.done() and not fut.cancelled():
+                    self.in_flight -= 1
+                    self._wake()
+                else:
+                    fut.cancel()
+                raise
+
+        held = _HeldSlot(self)
+        token = _held_slot.set(held)
+        try:
+            yield
+        except Exception as e:
+            if not held.released and is_throttle_error(e):
+                self.on_throttle()
+            raise
+        else:
+            if not held.released:
+                self.on_success()
+        finally:
+            _held_slot.reset(token)
+            held.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limit': int(self.limit),
+            'floor': self.floor,
+            'ceiling': self.ceiling,
+            'in_flight': self.in_flight,
+            'waiting': sum(1 for f in self._waiters if not f.done()),
+            'successes': self.successes,
+            'throttles': self.throttles,
+            'cuts': self.cuts,
+        }
+
+
+def _parse_limits(spec: str) -> Dict[str, tuple]:
+    limits = {}
+    for part in spec.split(','):
+        if '=' not in part:
+            continue
+        name, values = part.split('=', 1)
+        try:
+            floor, initial, ceiling = (int(v) for v in values.split(':'))
+        except ValueError:
+            logger.warning(f"Ignoring bad ADAPTIVE_PLATFORM_LIMITS entry '{part}' (expected name=floor:initial:ceiling)")
+            continue
+        limits[name.strip().lower()] = (floor, initial, ceiling)
+    return limits
+
+
+class PlatformLimits:
+    def __init__(self, limits: Optional[Dict[str, tuple]] = None):
+        self.limits = dict(DEFAULT_LIMITS)
+        self.limits.update(limits or {})
+        self._limiters: Dict[str, AdaptiveLimiter] = {}
+
+    def get(self, platform: Optional[str]) -> AdaptiveLimiter:
+        """The limiter for a platform, by clip service ('twitch') or platform_name ('Twitch')"""
+        name = (platform or 'base').lower()
+        name = ALIASES.get(name, name)
+        limiter = self._limiters.get(name)
+        if limiter is None:
+            floor, initial, ceiling = self.limits.get(name, FALLBACK_LIMITS)
+            limiter = self._limiters[name] = AdaptiveLimiter(name, floor, initial, ceiling)
+        return limiter
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: limiter.stats() for name, limiter in sorted(self._limiters.items())}
+
+
+platform_limits = PlatformLimits(_parse_limits(getenv('ADAPTIVE_PLATFORM_LIMITS', '')))
+register_metrics('platform_limits', platform_limits.stats)
@@ -0,0 +1,265 @@
+"""In-memory caches shared by the bot's API wrappers."""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+from bot.utils.deadline import create_task_without_deadline
+import asyncio
+import json
+import time
+import sys
+
+_MISSING = object()
+
+
+def json_size(value: Any) -> int:
+    """Approximate memory held by a JSON-like API response: the length of its serialized form"""
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+
+class TTLCache:
+    """
+    Bounded LRU cache whose entries expire `ttl` seconds after they were set.
+    get_or_load() coalesces concurrent loads of the same key into a single call.
+
+    With `max_bytes`, the cache also keeps the total `sizeof(value)` of its entries under that many bytes,
+    evicting least recently used entries first. Expired entries are swept every `ttl / 4` seconds on writes,
+    so they don't hold memory until they happen to be read again.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, max_bytes: int = None,
+                 sizeof: Callable[[Any], int] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof or json_size
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (expires_at, value, size)
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+        self._next_sweep = time.monotonic() + ttl / 4
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.prefetched = 0
+
+    def _remove(self, key: Hashable) -> tuple:
+        item = self._data.pop(key)
+        self.bytes -= item[2]
+        return item
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value, _ = item
+        if time.monotonic() >= expires_at:
+            self._remove(key)
+            self.expirations += 1
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self.purge_expired()
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if key in self._data:
+            self._remove(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # would evict everything else and still not fit
+        self._data[key] = (now + (self.ttl if ttl is None else ttl), value, size)
+        self.bytes += size
+        while len(self._data) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            self._remove(next(iter(self._data)))
+            self.evictions += 1
+
+    def purge_expired(self):
+        """Drop every expired entry"""
+        now = time.monotonic()
+        self._next_sweep = now + self.ttl / 4
+        for key in [k for k, item in self._data.items() if now >= item[0]]:
+            self._remove(key)
+            self.expirations += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        if key not in self._data:
+            return default
+        return self._remove(key)[1]
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+              should_cache: Optional[Callable[[Any], bool]]) -> asyncio.Future:
+        """Start loading `key` (or join the load that's already running)"""
+        fut = self._loading.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return fut
+        self.misses += 1
+
+        async def run():
+            try:
+                value = await loader()
+                if should_cache is None or should_cache(value):
+                    self.set(key, value)
+                return value
+            finally:
+                self._loading.pop(key, None)
+
+        # its own task, so one caller giving up (or running out of time) doesn't cancel it for everyone else
+        fut = self._loading[key] = create_task_without_deadline(run())
+        fut.add_done_callback(self._load_done)
+        return fut
+
+    @staticmethod
+    def _load_done(fut: asyncio.Future):
+        if not fut.cancelled():
+            fut.exception()  # every waiter may have given up already, a failure just means no cache entry
+
+    async def get_or_load(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                          should_cache: Callable[[Any], bool] = None) -> Any:
+        """
+        Return the cached value for `key`, or await `loader()` and cache its result.
+        Results for which `should_cache(result)` is False are returned but not cached.
+        """
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+        return await asyncio.shield(self._load(key, loader, should_cache))
+
+    def prefetch(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                 should_cache: Callable[[Any], bool] = None):
+        """Start loading `key` in the background, unless it's already cached or being loaded"""
+        if key in self._loading or key in self:
+            return
+        self.prefetched += 1
+        self._load(key, loader, should_cache)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {'size': len(self._data), 'hits': self.hits, 'misses': self.misses, 'coalesced': self.coalesced,
+                 'evictions': self.evictions, 'expirations': self.expirations, 'prefetched': self.prefetched}
+        if self.max_bytes is not None:
+            stats['bytes'] = self.bytes
+            stats['max_bytes'] = self.max_bytes
+        return stats
+
+
+class StaleWhileRevalidateCache:
+    """
+    Cache for slow lookups that are fine to show slightly out of date.
+    Entries younger than `soft_ttl` are served as is. Older entries (up to `hard_ttl`) are still served
+    immediately, and refreshed in the background. Concurrent loads and refreshes of a key share one call.
+    """
+
+    def __init__(self, soft_ttl: float = 60, hard_ttl: float = 3600, maxsize: int = 5000):
+        self.soft_ttl = soft_ttl
+        self.hard_ttl = hard_ttl
+        self.maxsize = maxsize
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (fetched_at, value)
+        self._loading: Dict[Hashable, asyncio.Future] = {}
+        self.fresh_hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    def _store(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _load(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+              should_cache: Optional[Callable[[Any], bool]]) -> asyncio.Future:
+        """Start loading `key` (or join the load that's already running)"""
+        fut = self._loading.get(key)
+        if fut is not None:
+            self.coalesced += 1
+            return fut
+
+        async def run():
+            try:
+                value = await loader()
+                if should_cache is None or should_cache(value):
+                    self._store(key, value)
+                return value
+            finally:
+                self._loading.pop(key, None)
+
+        fut = self._loading[key] = create_task_without_deadline(run())  # shared by every caller waiting on key
+        return fut
+
+    def _refresh(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                 should_cache: Optional[Callable[[Any], bool]]):
+        if key in self._loading:
+            self.coalesced += 1
+            return
+        self.refreshes += 1
+
+        def done(f: asyncio.Future):
+            if f.cancelled():
+                return
+            if f.exception() is not None:
+                # keep serving the stale value until it hard-expires
+                self.refresh_failures += 1
+
+        self._load(key, loader, should_cache).add_done_callback(done)
+
+    async def get(self, key: Hashable, loader: Callable[[], Awaitable[Any]],
+                  should_cache: Callable[[Any], bool] = None) -> Any:
+        """
+        Return the value for `key`, calling `loader()` only when there's nothing usable cached.
+        Results for which `should_cache(result)` is False are returned but not cached.
+        """
+        item = self._data.get(key)
+        if item is not None:
+            fetched_at, value = item
+            age = time.monotonic() - fetched_at
+            if age < self.soft_ttl:
+                self.fresh_hits += 1
+                self._data.move_to_end(key)
+                return value
+            if age < self.hard_ttl:
+                self.stale_hits += 1
+                self._data.move_to_end(key)
+                self._refresh(key, loader, should_cache)
+                return value
+            del self._data[key]
+
+        if key not in self._loading:
+            self.misses += 1
+        return await asyncio.shield(self._load(key, loader, should_cache))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'size': len(self._data),
+            'fresh_hits': self.fresh_hits,
+            'stale_hits': self.stale_hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'refreshes': self.refreshes,
+            'refresh_failures': self.refresh_failures,
+        }
@@ -0,0 +1,76 @@
+"""How much time the embed in progress has left.
+
+/embed gives up on a clip after the platform's dl_timeout_secs, but the stages under it (get_clip, the download,
+the CDN upload, clyppy.io calls...) had no idea how much of it was left. They would start a multi-second download
+or API call that couldn't finish in time anyway.
+
+The deadline is set once per embed with `deadline_after()`, and lives in a ContextVar. It therefore follows the
+embed into every coroutine and task it starts, into the executors' threads (they run in the caller's context) and
+across to the media worker (see media_worker.py). Each stage asks for what's left:
+ - `timeout(default)` caps a network timeout to the time left
+ - `check(stage, needed)` raises DeadlineExceeded instead of starting work that needs more than what's left
+ - `has_time_for(seconds)` decides whether optional work (thumbnails) is still worth doing
+
+Without a deadline (background jobs, commands that don't set one) every function behaves as if time was unlimited.
+Work that's shared by several callers or outlives the current one (background workers, batched lookups, single
+flight loads) is started with `create_task_without_deadline()`, so it doesn't inherit one caller's deadline.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from typing import Coroutine, Optional
+from bot.errors import DeadlineExceeded
+import asyncio
+import time
+
+GET_CLIP_MIN_BUDGET = 3  # seconds needed to bother extracting a clip's metadata
+DOWNLOAD_MIN_BUDGET = 15  # seconds needed to bother starting a download
+UPLOAD_MIN_BUDGET = 10  # seconds needed to bother uploading a video to the CDN
+OPTIONAL_WORK_MIN_BUDGET = 20  # seconds that must be left to do optional work, such as thumbnails
+
+_deadline: ContextVar[Optional[float]] = ContextVar('deadline', default=None)
+
+
+@contextmanager
+def deadline_after(seconds: Optional[float]):
+    """Everything run (or started) in this block must finish within `seconds`. A closer deadline set by a caller wins."""
+    if seconds is None:
+        yield
+        return
+    at = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(at if current is None else min(at, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the deadline (can be negative), None without one"""
+    at = _deadline.get()
+    return None if at is None else at - time.monotonic()
+
+
+def timeout(default: float) -> float:
+    """`default`, or what's left before the deadline if that's sooner"""
+    left = remaining()
+    return default if left is None else max(0.0, min(default, left))
+
+
+def has_time_for(seconds: float) -> bool:
+    left = remaining()
+    return left is None or left >= seconds
+
+
+def check(stage: str, needed: float = 0):
+    """Raise DeadlineExceeded if there's less than `needed` seconds left to run `stage`"""
+    left = remaining()
+    if left is not None and (left <= 0 or left < needed):
+        raise DeadlineExceeded(stage, left)
+
+
+def create_task_without_deadline(coro: Coroutine, **kwargs) -> asyncio.Task:
+    """asyncio.create_task() for work that isn't bound to the current caller's deadline"""
+    context = copy_context()
+    context.run(_deadline.set, None)
+    return asyncio.create_task(coro, context=context, **kwargs)
@@ -0,0 +1,92 @@
+"""Event loop selection, and fallbacks for the bits that depend on which loop we run on.
+
+EVENT_LOOP=uvloop runs the bot on uvloop (libuv) instead of the default pure-Python selector loop, which
+dispatches callbacks, timers and socket I/O considerably faster. It's opt-in. If uvloop isn't installed, or
+the platform doesn't support it, we log it and use the default loop.
+"""
+from typing import Callable
+from os import getenv
+import subprocess
+import threading
+import asyncio
+import logging
+import signal
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOP = getenv('EVENT_LOOP', 'asyncio').strip().lower()
+
+
+def new_event_loop(kind: str = EVENT_LOOP) -> asyncio.AbstractEventLoop:
+    if kind == 'uvloop':
+        try:
+            import uvloop
+            loop = uvloop.new_event_loop()
+            logger.info(f"Running on uvloop {uvloop.__version__}")
+            return loop
+        except ImportError:
+            logger.warning("EVENT_LOOP=uvloop but uvloop isn't installed, using the default asyncio loop")
+        except Exception as e:
+            logger.warning(f"Couldn't start uvloop ({e}), using the default asyncio loop")
+    elif kind != 'asyncio':
+        logger.warning(f"Unknown EVENT_LOOP '{kind}', using the default asyncio loop")
+    return asyncio.new_event_loop()
+
+
+def loop_name(loop: asyncio.AbstractEventLoop) -> str:
+    return 'uvloop' if type(loop).__module__.startswith('uvloop') else 'asyncio'
+
+
+def add_signal_handler(loop: asyncio.AbstractEventLoop, sig: int, callback: Callable[[], None]):
+    """loop.add_signal_handler(), or a plain signal handler that hands off to the loop where that's unsupported"""
+    try:
+        loop.add_signal_handler(sig, callback)
+    except (NotImplementedError, RuntimeError, ValueError):
+        signal.signal(sig, lambda *_: loop.call_soon_threadsafe(callback))
+
+
+class _ThreadedProcess:
+    """Enough of asyncio.subprocess.Process for reading a child's output as it runs, using threads"""
+
+    def __init__(self, popen: subprocess.Popen, loop: asyncio.AbstractEventLoop):
+        self._popen = popen
+        self.pid = popen.pid
+        self.stdout = self._pipe(popen.stdout, loop)
+        self.stderr = self._pipe(popen.stderr, loop)
+
+    @staticmethod
+    def _pipe(pipe, loop: asyncio.AbstractEventLoop):
+        if pipe is None:
+            return None
+        reader = asyncio.StreamReader(loop=loop)
+
+        def pump():
+            for chunk in iter(pipe.readline, b''):
+                loop.call_soon_threadsafe(reader.feed_data, chunk)
+            loop.call_soon_threadsafe(reader.feed_eof)
+
+        threading.Thread(target=pump, daemon=True).start()
+        return reader
+
+    @property
+    def returncode(self):
+        return self._popen.returncode
+
+    async def wait(self) -> int:
+        return await asyncio.to_thread(self._popen.wait)
+
+    def terminate(self):
+        self._popen.terminate()
+
+    def kill(self):
+        self._popen.kill()
+
+
+async def create_subprocess_exec(*cmd, stdout=None, stderr=None, **kwargs):
+    """asyncio.create_subprocess_exec(), falling back to threads on loops without subprocess support"""
+    try:
+        return await asyncio.create_subprocess_exec(*cmd, stdout=stdout, stderr=stderr, **kwargs)
+    except NotImplementedError:
+        logger.info(f"{loop_name(asyncio.get_running_loop())} can't run subprocesses, running {cmd[0]} in a thread")
+        popen = subprocess.Popen(cmd, stdout=stdout, stderr=stderr, **kwargs)
+        return _ThreadedProcess(popen, asyncio.get_running_loop())
@@ -0,0 +1,134 @@
+"""Process-wide budget for the bytes held in memory by uploads and AI extends.
+
+Uploads read whole videos into memory (and the clyppy.io API wants them base64'd inside a JSON body, several
+copies), and an AI extend runs a subprocess that decodes the video. A handful of large ones at once could take
+the container past its memory limit, and the OOM kill takes every shard with it.
+
+Large buffers are acquired from `memory_budget` before they're created and released once they're gone:
+
+    async with memory_budget.hold(nbytes):
+        ...
+
+When the budget is used up, callers wait their turn (first come first served, so a large buffer isn't starved
+by small ones). A buffer larger than the whole budget waits for it to be empty, then runs alone. Waiting is
+bounded by the caller's deadline (DeadlineExceeded).
+"""
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Tuple
+from bot.errors import DeadlineExceeded
+from bot.utils.metrics import LatencyHistogram, register_metrics
+from bot.utils import deadline
+from os import getenv
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+WAIT_BUCKETS = (0.01, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def base64_upload_size(nbytes: int) -> int:
+    """Peak memory of sending nbytes base64'd in a JSON body: the bytes, the base64 text, the JSON and its encoding"""
+    return nbytes + 3 * (4 * ((nbytes + 2) // 3))
+
+
+class ByteBudget:
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.used = 0
+        self.high_water = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+        # metrics
+        self.acquired = 0
+        self.waited = 0
+        self.oversized = 0
+        self.wait_times = LatencyHistogram(WAIT_BUCKETS)
+
+    def _take(self, nbytes: int):
+        self.used += nbytes
+        self.high_water = max(self.high_water, self.used)
+
+    def _wake(self):
+        while self._waiters:
+            nbytes, fut = self._waiters[0]
+            if fut.done():
+                self._waiters.popleft()  # cancelled or timed out while waiting
+                continue
+            if self.used + nbytes > self.limit:
+                break
+            self._waiters.popleft()
+            self._take(nbytes)  # handed straight to the waiter
+            fut.set_result(None)
+
+    async def acquire(self, nbytes: int) -> int:
+        """
+        Wait until nbytes fit in the budget and take them. Returns what was taken (nbytes, or the whole budget for
+        a buffer larger than it), to be given back to release().
+        Raises DeadlineExceeded if the caller's deadline passes while waiting.
+        """
+        if nbytes > self.limit:
+            self.oversized += 1
+            nbytes = self.limit
+        self.acquired += 1
+        if not self._waiters and self.used + nbytes <= self.limit:
+            self._take(nbytes)
+            self.wait_times.observe(0)
+            return nbytes
+
+        self.waited += 1
+        logger.info(f"[MemoryBudget:{self.name}] Waiting for {nbytes / MB:.0f}MB "
+                    f"({self.used / MB:.0f}/{self.limit / MB:.0f}MB in use)")
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append((nbytes, fut))
+        started = time.monotonic()
+        left = deadline.remaining()
+        try:
+            await (fut if left is None else asyncio.wait_for(fut, max(0.0, left)))
+        except asyncio.TimeoutError:
+            if fut.done() and not fut.cancelled():
+                self.release(nbytes)  # handed over just as we gave up, pass it on
+            else:
+                self._wake()
+            raise DeadlineExceeded(f"work that needs {nbytes / MB:.0f}MB of memory", deadline.remaining() or 0)
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                self.release(nbytes)
+            else:
+                fut.cancel()
+                self._wake()  # a large waiter at the front may have been holding everyone else back
+            raise
+        self.wait_times.observe(time.monotonic() - started)
+        return nbytes
+
+    def release(self, nbytes: int):
+        self.used -= nbytes
+        self._wake()
+
+    @asynccontextmanager
+    async def hold(self, nbytes: int):
+        """Hold nbytes of the budget for the duration of the block"""
+        taken = await self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(taken)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'limit_mb': round(self.limit / MB),
+            'used_mb': round(self.used / MB, 1),
+            'high_water_mb': round(self.high_water / MB, 1),
+            'waiting': sum(1 for _, f in self._waiters if not f.done()),
+            'acquired': self.acquired,
+            'waited': self.waited,
+            'oversized': self.oversized,
+            'wait_seconds': self.wait_times.snapshot(),
+        }
+
+
+memory_budget = ByteBudget('process', int(float(getenv('MEMORY_BUDGET_MB', 1536)) * MB))
+register_metrics('memory_budget', memory_budget.stats)
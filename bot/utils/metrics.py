@@ -0,0 +1,74 @@
+"""Process-wide registry of runtime metrics, viewable with the owner-only /metrics command."""
+from typing import Any, Callable, Dict, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+_providers: Dict[str, Callable[[], Dict[str, Any]]] = {}
+
+
+def register_metrics(name: str, provider: Callable[[], Dict[str, Any]]):
+    """
+    Register a callable that returns a snapshot of some component's metrics.
+    Registering the same name twice replaces the previous provider.
+    """
+    _providers[name] = provider
+
+
+def collect_metrics() -> Dict[str, Any]:
+    """Return {name: snapshot} for every registered provider. A failing provider never breaks the others."""
+    out = {}
+    for name, provider in list(_providers.items()):
+        try:
+            out[name] = provider()
+        except Exception as e:
+            logger.warning(f"Metrics provider {name} failed: {e}")
+            out[name] = {'error': str(e)}
+    return out
+
+
+class LatencyHistogram:
+    """Fixed-bucket latency histogram (seconds)."""
+
+    BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+
+    def __init__(self, buckets: Tuple[float, ...] = None):
+        if buckets is not None:
+            self.BUCKETS = tuple(buckets) if buckets[-1] == float('inf') else tuple(buckets) + (float('inf'),)
+        self.counts = [0] * len(self.BUCKETS)
+        self.total = 0
+        self.sum = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False):
+        for i, upper in enumerate(self.BUCKETS):
+            if seconds <= upper:
+                self.counts[i] += 1
+                break
+        self.total += 1
+        self.sum += seconds
+        if error:
+            self.errors += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Upper bound of the bucket holding the p-th percentile (0 < p <= 100)"""
+        if self.total == 0:
+            return None
+        target = self.total * p / 100
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return self.BUCKETS[i]
+        return self.BUCKETS[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'count': self.total,
+            'errors': self.errors,
+            'avg': round(self.sum / self.total, 3) if self.total else None,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': {('inf' if b == float('inf') else str(b)): c for b, c in zip(self.BUCKETS, self.counts)},
+        }
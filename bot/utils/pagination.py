@@ -1,17 +1,31 @@
 from dataclasses import dataclass, asdict
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
+from math import ceil
+import asyncio
 import aiohttp
 import json
 from os import getenv
 import base64
 from interactions import Embed, Button, ButtonStyle, ActionRow
 from bot.env import CLYPPYIO_USER_AGENT, is_contrib_instance, log_api_bypass
+from bot.utils.cache import TTLCache
+from bot.utils.metrics import register_metrics
 import logging
 import time
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# upper bound for each ranking cache, so memory stays flat no matter how long the bot runs
+RANKING_CACHE_MAX_BYTES = int(getenv('RANKING_CACHE_MAX_BYTES', 8 * 1024 * 1024))
+MAX_RANKING_API_PAGES = 100  # safety limit when walking the whole leaderboard
+RANK_INDEX_CONCURRENCY = 8
+RANK_INDEX_MIN_AGE = 60
+
+
+def _is_success(data: Dict[str, Any]) -> bool:
+    return bool(data.get("success"))
+
 
 @dataclass
 class ServerRankPaginationState:
@@ -29,8 +43,8 @@ class ServerRankPagination:
     """Utilities for server ranking pagination."""
 
     API_BASE_URL = "https://clyppy.io/api/servers/ranking/"
-    CACHE = {}  # Simple in-memory cache: {cache_key: (data, timestamp)}
     CACHE_TTL = 3600  # 1 hour in seconds
+    CACHE = TTLCache(maxsize=256, ttl=CACHE_TTL, max_bytes=RANKING_CACHE_MAX_BYTES)
 
     @staticmethod
     async def fetch_ranking_data(guild_id: str, page: int = 1,
@@ -46,8 +60,6 @@ class ServerRankPagination:
         Returns:
             API response dict with 'success', 'data', 'page', 'total_count', etc.
         """
-        import time
-
         if is_contrib_instance(logger):
             log_api_bypass(logger, ServerRankPagination.API_BASE_URL, "GET", {
                 "guild_id": guild_id,
@@ -62,14 +74,22 @@ class ServerRankPagination:
                 "has_more": False
             }
 
-        # Check cache first
         cache_key = f"server_ranking_{time_period}_{page}"
-        if cache_key in ServerRankPagination.CACHE:
-            cached_data, timestamp = ServerRankPagination.CACHE[cache_key]
-            if time.time() - timestamp < ServerRankPagination.CACHE_TTL:
-                return cached_data
+        data = await ServerRankPagination.CACHE.get_or_load(
+            cache_key, lambda: ServerRankPagination._load_page(page, time_period), should_cache=_is_success
+        )
 
-        # Fetch from API
+        # the next page is the likeliest click, have it ready
+        if data.get("success") and data.get("has_more"):
+            ServerRankPagination.CACHE.prefetch(
+                f"server_ranking_{time_period}_{page + 1}",
+                lambda: ServerRankPagination._load_page(page + 1, time_period), should_cache=_is_success
+            )
+        return data
+
+    @staticmethod
+    async def _load_page(page: int, time_period: str) -> Dict[str, Any]:
+        """Fetch one page of the server ranking from the API (uncached)"""
         try:
             params = {
                 "page": page,
@@ -83,12 +103,7 @@ class ServerRankPagination:
                     'Content-Type': 'application/json'
                 }) as response:
                     if response.status == 200:
-                        data = await response.json()
-
-                        # Cache the result
-                        ServerRankPagination.CACHE[cache_key] = (data, time.time())
-
-                        return data
+                        return await response.json()
                     else:
                         return {
                             "success": False,
@@ -308,8 +323,10 @@ class UserRankPagination:
     """Utilities for user ranking pagination."""
 
     API_BASE_URL = "https://clyppy.io/api/users/ranking/"
-    CACHE = {}  # Simple in-memory cache: {cache_key: (data, timestamp)}
     CACHE_TTL = 3600  # 1 hour in seconds
+    CACHE = TTLCache(maxsize=512, ttl=CACHE_TTL, max_bytes=RANKING_CACHE_MAX_BYTES)
+    RANK_INDEX = TTLCache(maxsize=16, ttl=CACHE_TTL)  # (time_period, include_bots) -> ({user_id: overall_rank}, complete)
+    _rank_index_built_at: Dict[tuple, float] = {}
     API_ENTRIES_PER_PAGE = 100  # API returns 100 entries per page
 
     @staticmethod
@@ -361,14 +378,24 @@ class UserRankPagination:
                 "has_more": False
             }
 
-        # Check cache first
         cache_key = f"user_ranking_{time_period}_{api_page}_{include_bots}"
-        if cache_key in UserRankPagination.CACHE:
-            cached_data, timestamp = UserRankPagination.CACHE[cache_key]
-            if time.time() - timestamp < UserRankPagination.CACHE_TTL:
-                return cached_data
+        return await UserRankPagination.CACHE.get_or_load(
+            cache_key, lambda: UserRankPagination._load_api_page(api_page, time_period, requester_id, include_bots),
+            should_cache=_is_success
+        )
 
-        # Fetch from API
+    @staticmethod
+    def _prefetch_api_page(api_page: int, time_period: str, requester_id: str, include_bots: bool):
+        UserRankPagination.CACHE.prefetch(
+            f"user_ranking_{time_period}_{api_page}_{include_bots}",
+            lambda: UserRankPagination._load_api_page(api_page, time_period, requester_id, include_bots),
+            should_cache=_is_success
+        )
+
+    @staticmethod
+    async def _load_api_page(api_page: int, time_period: str, requester_id: str,
+                             include_bots: bool) -> Dict[str, Any]:
+        """Fetch one full API page of the user ranking (uncached)"""
         try:
             params = {
                 "page": api_page,
@@ -385,12 +412,7 @@ class UserRankPagination:
                     'Content-Type': 'application/json'
                 }) as response:
                     if response.status == 200:
-                        data = await response.json()
-
-                        # Cache the result
-                        UserRankPagination.CACHE[cache_key] = (data, time.time())
-
-                        return data
+                        return await response.json()
                     else:
                         return {
                             "success": False,
@@ -432,16 +454,71 @@ class UserRankPagination:
         if not data.get("success"):
             return data
 
+        # the next display page is the likeliest click - if it's on the next API page, have that ready
+        next_api_page, _ = UserRankPagination._convert_display_page_to_api_page(page + 1)
+        if next_api_page != api_page and data.get("has_more"):
+            UserRankPagination._prefetch_api_page(next_api_page, time_period, requester_id, include_bots)
+
         # Slice to get only the entries for this display page
         data_copy = dict(data)
         data_copy["data"] = data["data"][start_index:start_index + ENTRIES_PER_PAGE]
         return data_copy
 
+    @staticmethod
+    async def _build_rank_index(time_period: str, requester_id: str,
+                                include_bots: bool) -> Tuple[Dict[str, int], bool]:
+        """
+        Fetch the whole leaderboard and map each user_id to their overall rank.
+        Pages after the first are fetched concurrently (at most RANK_INDEX_CONCURRENCY at a time).
+
+        Returns:
+            (index, complete) - complete is False if a page failed, in which case the index isn't cached
+        """
+        fetch_page = UserRankPagination._fetch_api_page
+        first = await fetch_page(1, time_period, requester_id, include_bots)
+        if not first.get("success", False):
+            return {}, False
+        pages = {1: first}
+
+        sem = asyncio.Semaphore(RANK_INDEX_CONCURRENCY)
+
+        async def fetch(api_page: int):
+            async with sem:
+                pages[api_page] = await fetch_page(api_page, time_period, requester_id, include_bots)
+
+        if first.get("has_more", False):
+            total_count = first.get("total_count")
+            if total_count:
+                # the page count is known up front, so fetch the rest all at once
+                last_page = min(MAX_RANKING_API_PAGES, ceil(total_count / UserRankPagination.API_ENTRIES_PER_PAGE))
+                await asyncio.gather(*(fetch(p) for p in range(2, last_page + 1)))
+            else:
+                # fetch in waves until a page says there's nothing after it
+                next_page = 2
+                while next_page <= MAX_RANKING_API_PAGES:
+                    wave = range(next_page, min(next_page + RANK_INDEX_CONCURRENCY, MAX_RANKING_API_PAGES + 1))
+                    await asyncio.gather(*(fetch(p) for p in wave))
+                    if any(not pages[p].get("success", False) or not pages[p].get("has_more", False) for p in wave):
+                        break
+                    next_page = wave[-1] + 1
+
+        UserRankPagination._rank_index_built_at[(time_period, include_bots)] = time.monotonic()
+        index = {}
+        complete = True
+        for api_page, data in sorted(pages.items()):
+            if not data.get("success", False):
+                complete = False
+                continue
+            for idx, user in enumerate(data.get("data", [])):
+                index.setdefault(user.get("user_id"), (api_page - 1) * UserRankPagination.API_ENTRIES_PER_PAGE + idx + 1)
+        return index, complete
+
     @staticmethod
     async def find_user_page(user_id: str, time_period: str = "all",
                               requester_id: str = None, include_bots: bool = False) -> Optional[int]:
         """
         Find which display page the user appears on in the ranking.
+        Looks the user up in a cached rank index of the whole leaderboard, building it if needed.
 
         Args:
             user_id: Discord user ID to find
@@ -452,33 +529,32 @@ class UserRankPagination:
         Returns:
             Display page number where user appears, or None if not found
         """
-        # Fetch full API pages to search for user
-        api_page = 1
-        while True:
-            data = await UserRankPagination._fetch_api_page(api_page, time_period, requester_id, include_bots)
-
-            if not data.get("success", False):
-                return None
-
-            # Search for user_id in this page's data
-            for idx, user in enumerate(data.get("data", [])):
-                if user.get("user_id") == user_id:
-                    # Calculate which display page this user is on
-                    # API page has 100 entries, we show 10 per page
-                    overall_rank = (api_page - 1) * 100 + idx + 1
-                    display_page = (overall_rank + 9) // 10  # Ceiling division
-                    return display_page
-
-            # Check if there are more pages
-            if not data.get("has_more", False):
-                # User not found in ranking
-                return None
+        index, _ = await UserRankPagination.RANK_INDEX.get_or_load(
+            (time_period, include_bots),
+            lambda: UserRankPagination._build_rank_index(time_period, requester_id, include_bots),
+            should_cache=lambda result: result[1]
+        )
+        overall_rank = index.get(user_id)
+        if overall_rank is None:
+            return None
+        return (overall_rank + ENTRIES_PER_PAGE - 1) // ENTRIES_PER_PAGE  # Ceiling division
 
-            api_page += 1
+    @staticmethod
+    def invalidate_rank_index(time_period: str = "all", include_bots: bool = False) -> bool:
+        """
+        Drop the rank index (and the pages it was built from) so the next lookup rebuilds it.
+        Indexes younger than RANK_INDEX_MIN_AGE are kept, so users who aren't ranked can't force constant rebuilds.
 
-            # Safety limit to avoid infinite loops
-            if api_page > 100:
-                return None
+        Returns:
+            True if the index was dropped
+        """
+        key = (time_period, include_bots)
+        built_at = UserRankPagination._rank_index_built_at.get(key)
+        if built_at is not None and time.monotonic() - built_at < RANK_INDEX_MIN_AGE:
+            return False
+        UserRankPagination.RANK_INDEX.pop(key)
+        UserRankPagination.CACHE.clear()
+        return True
 
     @staticmethod
     def create_embed(ranking_data: List[Dict], page: int, total_pages: int,
@@ -621,3 +697,8 @@ class UserRankPagination:
         ]
 
         return [ActionRow(*buttons)]
+
+
+register_metrics('server_rank_cache', ServerRankPagination.CACHE.stats)
+register_metrics('user_rank_cache', UserRankPagination.CACHE.stats)
+register_metrics('user_rank_index', UserRankPagination.RANK_INDEX.stats)
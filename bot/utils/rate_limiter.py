@@ -1,42 +1,55 @@
+from bot.broker import broker_client, BrokerUnavailable
+from bot.utils.metrics import register_metrics
+from typing import Any, Dict
+from os import getenv
 import asyncio
 import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+# what each kind of request costs in tokens - a download hits the platform much harder than a metadata lookup
+METADATA_COST = 1.0
+DOWNLOAD_COST = 2.0
 
-class RateLimiter:
+
+class SharedTokenBucket:
     """
-    A rate limiter that ensures only one request goes through at a time,
-    with a configurable delay between requests.
+    A token-bucket rate limiter shared by every bot process on the host.
 
-    This prevents simultaneous requests from all firing at once -
-    each request must wait for the lock and the delay.
+    The bucket itself lives in the lock broker (see bot/broker.py), so running more processes doesn't
+    multiply the request rate against the platform. Up to `burst` tokens can be spent at once, after which
+    requests are let through as the bucket refills at `rate` tokens per second. Waiting requests are served
+    in FIFO order and woken by the broker when enough tokens are available, without polling.
     """
 
-    def __init__(self, delay_seconds: float = 5.0, name: str = "default"):
-        self.delay_seconds = delay_seconds
+    def __init__(self, name: str, rate: float, burst: float = 1.0):
         self.name = name
-        self._lock = asyncio.Lock()
-        self._last_request_time = 0.0
-
-    async def acquire(self):
-        """
-        Acquire the rate limiter. This will:
-        1. Wait for any other request to finish (via lock)
-        2. Wait for the delay period since the last request
-        """
-        async with self._lock:
-            now = time.monotonic()
-            time_since_last = now - self._last_request_time
-
-            if time_since_last < self.delay_seconds:
-                wait_time = self.delay_seconds - time_since_last
-                logger.info(f"[RateLimiter:{self.name}] Waiting {wait_time:.2f}s before next request")
-                await asyncio.sleep(wait_time)
-
-            self._last_request_time = time.monotonic()
-            logger.debug(f"[RateLimiter:{self.name}] Request acquired")
+        self.rate = rate
+        self.burst = burst
+        # metrics
+        self.acquired = 0
+        self.tokens = 0.0
+        self.waited = 0.0
+
+    async def acquire(self, cost: float = METADATA_COST):
+        """Wait until `cost` tokens can be taken from the bucket"""
+        started = time.monotonic()
+        while True:
+            try:
+                await broker_client.request('take', name=f'bucket:{self.name}', rate=self.rate,
+                                            burst=self.burst, cost=cost)
+                break
+            except BrokerUnavailable:
+                # the broker process went away while we were queued - requeue with whoever takes over
+                await asyncio.sleep(0)
+
+        waited = time.monotonic() - started
+        self.acquired += 1
+        self.tokens += cost
+        self.waited += waited
+        if waited >= 1:
+            logger.info(f"[RateLimiter:{self.name}] Waited {waited:.2f}s for {cost:g} token(s)")
 
     async def __aenter__(self):
         await self.acquire()
@@ -45,7 +58,22 @@ class RateLimiter:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         pass
 
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'rate': self.rate,
+            'burst': self.burst,
+            'acquired': self.acquired,
+            'tokens': self.tokens,
+            'avg_wait': round(self.waited / self.acquired, 3) if self.acquired else 0.0,
+        }
+
 
 # Global rate limiters for different platforms
-# YouTube: 5 second delay between requests to avoid rate limiting
-youtube_rate_limiter = RateLimiter(delay_seconds=5.0, name="youtube")
+# YouTube: across the whole host, one embed (is_shortform, channel info and download: 1 + 1 + 2 tokens) per
+# 15 seconds on average - the old three requests 5 seconds apart - with small bursts allowed
+youtube_rate_limiter = SharedTokenBucket(
+    name="youtube",
+    rate=float(getenv('YOUTUBE_RATE_LIMIT', 4 / 15)),
+    burst=float(getenv('YOUTUBE_RATE_BURST', 3)),
+)
+register_metrics('youtube_rate_limiter', youtube_rate_limiter.stats)
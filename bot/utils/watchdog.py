@@ -0,0 +1,143 @@
+"""Event loop lag watchdog.
+
+A background thread keeps asking the event loop to run a callback and times how long it takes to get
+scheduled. That delay is how long the loop was stuck on something else - blocking work like a synchronous S3
+put, a sqlite query or moviepy probing, which is what starves gateway heartbeats.
+
+Every measurement goes into a histogram (the percentiles show in /metrics). When the loop is stuck past the
+threshold, the watchdog captures the main thread's stack and the running task's name while it's still stuck,
+so the stall shows exactly what was blocking. The last stalls are kept in a ring buffer for the owner-only
+/lagreport command.
+"""
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+from bot.utils.metrics import LatencyHistogram, register_metrics
+from os import getenv
+import traceback
+import threading
+import asyncio
+import logging
+import time
+import sys
+import os
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_THRESHOLD = float(getenv('LOOP_LAG_THRESHOLD', 0.25))  # seconds
+LOOP_LAG_INTERVAL = 0.1  # between probes
+LOOP_LAG_KEEP = 50  # stalls kept for /lagreport
+LOOP_LAG_RECENT = 20  # probes recent_lag() looks at (about 2 seconds)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STACK_DEPTH = 15
+
+_REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _culprit(stack: List[traceback.FrameSummary]) -> str:
+    """The innermost frame in our own code, which is usually the call that blocked"""
+    for frame in reversed(stack):
+        path = os.path.abspath(frame.filename)
+        if path.startswith(_REPO_ROOT) and 'site-packages' not in path and 'venv' not in path:
+            return f"{os.path.relpath(path, _REPO_ROOT)}:{frame.lineno} in {frame.name}"
+    if stack:
+        return f"{stack[-1].filename}:{stack[-1].lineno} in {stack[-1].name}"
+    return "unknown"
+
+
+class LoopWatchdog:
+    def __init__(self, threshold: float = LOOP_LAG_THRESHOLD, interval: float = LOOP_LAG_INTERVAL,
+                 keep: int = LOOP_LAG_KEEP):
+        self.threshold = threshold
+        self.interval = interval
+        self.lag = LatencyHistogram(LAG_BUCKETS)
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=keep)
+        self.max_lag = 0.0
+        self.recent: Deque[float] = deque(maxlen=LOOP_LAG_RECENT)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """Start watching the running event loop (from a coroutine on it)"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='loop-watchdog', daemon=True)
+        self._thread.start()
+        logger.info(f"[Watchdog] Watching the event loop for stalls over {self.threshold * 1000:.0f}ms")
+
+    def stop(self):
+        self._stopped.set()
+        self.recent.clear()
+
+    def _capture(self) -> Dict[str, Any]:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = traceback.extract_stack(frame)[-STACK_DEPTH:] if frame is not None else []
+        try:
+            task = asyncio.current_task(self._loop)
+        except RuntimeError:
+            task = None
+        return {
+            'task': task.get_name() if task is not None else None,
+            'coro': getattr(task.get_coro(), '__qualname__', None) if task is not None else None,
+            'culprit': _culprit(stack),
+            'stack': ''.join(traceback.format_list(stack)),
+        }
+
+    def _run(self):
+        while not self._stopped.is_set():
+            scheduled = time.monotonic()
+            ran = threading.Event()
+            try:
+                self._loop.call_soon_threadsafe(ran.set)
+            except RuntimeError:
+                return  # the loop was closed
+
+            if not ran.wait(self.threshold):
+                # still stuck: look at what it's doing before it moves on
+                stall = self._capture()
+                while not ran.wait(1) and not self._stopped.is_set():
+                    if self._loop.is_closed():
+                        return
+                stall['lag'] = round(time.monotonic() - scheduled, 3)
+                stall['at'] = time.time()
+                self.stalls.append(stall)
+                logger.warning(f"[Watchdog] Event loop blocked for {stall['lag']:.2f}s "
+                               f"(task {stall['task']}, at {stall['culprit']})")
+
+            lag = time.monotonic() - scheduled
+            self.lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            self.recent.append(lag)
+            self._stopped.wait(self.interval)
+
+    def recent_lag(self) -> float:
+        """Worst lag over the last few probes, 0 when the watchdog isn't running"""
+        return max(self.recent, default=0.0)
+
+    def worst(self, count: int = 10) -> List[Dict[str, Any]]:
+        return sorted(self.stalls, key=lambda s: s['lag'], reverse=True)[:count]
+
+    def stats(self) -> Dict[str, Any]:
+        snapshot = self.lag.snapshot()
+        by_culprit: Dict[str, int] = {}
+        for stall in self.stalls:
+            by_culprit[stall['culprit']] = by_culprit.get(stall['culprit'], 0) + 1
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'threshold': self.threshold,
+            'samples': snapshot['count'],
+            'p50': snapshot['p50'],
+            'p90': snapshot['p90'],
+            'p99': snapshot['p99'],
+            'max': round(self.max_lag, 3),
+            'stalls': len(self.stalls),
+            'top_culprits': dict(sorted(by_culprit.items(), key=lambda kv: kv[1], reverse=True)[:5]),
+        }
+
+
+loop_watchdog = LoopWatchdog()
+register_metrics('loop_lag', loop_watchdog.stats)
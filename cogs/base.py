@@ -7,13 +7,18 @@ from interactions import (Extension, Embed, slash_command, SlashContext, SlashCo
 from bot.env import SUPPORT_SERVER_URL, MONTHLY_WINNER_CHANNEL_ID, MONTHLY_WINNER_TOKENS
 from bot.env import POSSIBLE_ON_ERRORS, POSSIBLE_EMBED_BUTTONS, APPUSE_LOG_WEBHOOK, VERSION, EMBED_TXT_COMMAND, is_contrib_instance, log_api_bypass, CLYPPYBOT_ID
 from interactions.api.events.discord import GuildJoin, GuildLeft, MessageCreate
-from bot.io import get_clip_info, callback_clip_delete_msg, add_reqqed_by, subtract_tokens, refresh_clip
+from bot.io import get_clip_info, callback_clip_delete_msg, add_reqqed_by, subtract_tokens, refresh_clip, token_ledger
 from bot.types import COLOR_GREEN, COLOR_RED
+from bot.utils.metrics import collect_metrics
+from bot.utils.watchdog import loop_watchdog
+from bot.tools import overload
+from bot.cluster import cluster
 from typing import Tuple, Optional
 from re import compile, search as re_search
 import logging
 from random import choice as random_choice
 import aiohttp
+import json
 import os
 
 
@@ -44,6 +49,7 @@ class Base(Extension):
         self.cookie_refresh_task = Task(self.refresh_cookies_task, IntervalTrigger(seconds=60 * 60))  # refresh cookies every
         self.status_update_task = Task(self.update_status, IntervalTrigger(seconds=60 * 5))  # update status every few minutes
         self.monthly_winner_task = Task(self.check_monthly_winner, IntervalTrigger(seconds=60 * 60))  # check every hour
+        self.resume_deferred_task = Task(self.resume_deferred_quickembeds, IntervalTrigger(seconds=5))
         self.last_winner_month = None
         self.base_embedder = self.bot.base_embedder.embedder
 
@@ -544,6 +550,7 @@ class Base(Extension):
             value *= -1  # because the api endpoint is for subtraction
         try:
             s = await subtract_tokens(u, value, reason=reason)
+            token_ledger.invalidate(u.id)
             await ctx.send(f"The change returned {s}")
         except Exception as e:
             await ctx.send(str(e))
@@ -553,7 +560,7 @@ class Base(Extension):
         await ctx.defer()
         await ctx.send("Saving DB...")
         await self.bot.guild_settings.save()
-        await self.post_servers(len(self.bot.guilds))
+        await self.post_servers()
         await ctx.send("You can now safely exit.")
 
     @slash_command(name="viewsettings", description="View settings for a guild", scopes=[759798762171662399], options=[
@@ -590,6 +597,39 @@ class Base(Extension):
 
         await ctx.send(embed=embed)
 
+    @slash_command(name="metrics", description="View runtime metrics", scopes=[759798762171662399], options=[
+        SlashCommandOption(name="name", type=OptionType.STRING, required=False, description="Only show this component")])
+    async def metrics(self, ctx: SlashContext, name: str = None):
+        await ctx.defer()
+        snapshot = collect_metrics()
+        if name is not None:
+            if name not in snapshot:
+                await ctx.send(f"Unknown metrics component `{name}`. Available: {', '.join(sorted(snapshot)) or 'none'}")
+                return
+            snapshot = {name: snapshot[name]}
+        text = json.dumps(snapshot, indent=1, default=str)
+        # discord messages are capped at 2000 chars
+        for i in range(0, len(text), 1900):
+            await ctx.send(f"```json\n{text[i:i + 1900]}\n```")
+
+    @slash_command(name="lagreport", description="View the worst event loop stalls", scopes=[759798762171662399], options=[
+        SlashCommandOption(name="count", type=OptionType.INTEGER, required=False, description="How many stalls to show"),
+        SlashCommandOption(name="stacks", type=OptionType.BOOLEAN, required=False, description="Include stack traces")])
+    async def lagreport(self, ctx: SlashContext, count: int = 5, stacks: bool = False):
+        await ctx.defer()
+        stats = loop_watchdog.stats()
+        lines = [f"Loop lag p50={stats['p50']}s p90={stats['p90']}s p99={stats['p99']}s max={stats['max']}s "
+                 f"over {stats['samples']} samples, {stats['stalls']} stalls over {stats['threshold']}s"]
+        for stall in loop_watchdog.worst(count):
+            lines.append(f"\n{stall['lag']:.2f}s <t:{int(stall['at'])}:R> task={stall['task']} ({stall['coro']})\n"
+                         f"  at {stall['culprit']}")
+            if stacks:
+                lines.append(stall['stack'])
+        text = '\n'.join(lines)
+        # discord messages are capped at 2000 chars
+        for i in range(0, len(text), 1900):
+            await ctx.send(f"```\n{text[i:i + 1900]}\n```")
+
     @slash_command(
         name="refresh_cookies",
         description="Manually refresh cookies from server",
@@ -1070,7 +1110,7 @@ class Base(Extension):
         )
 
     async def check_monthly_winner(self):
-        if not self.ready:
+        if not self.ready or not cluster.is_primary:
             return
 
         now = datetime.now(tz=timezone.utc)
@@ -1123,6 +1163,7 @@ class Base(Extension):
                         reason='Monthly Vote Champion Reward',
                         description=f'Won the {month_display} voting competition with {winner_votes} votes'
                     )
+                    token_ledger.invalidate(winner_user.id)
                     self.logger.info(f"Awarded {MONTHLY_WINNER_TOKENS} tokens to {winner['username']} ({winner['user_id']})")
                 except Exception as e:
                     self.logger.error(f"Failed to award tokens to monthly winner {winner['user_id']}: {e}")
@@ -1181,10 +1222,18 @@ class Base(Extension):
         except Exception as e:
             self.logger.error(f"Error in check_monthly_winner: {e}")
 
+    async def resume_deferred_quickembeds(self):
+        """Embed the quickembeds deferred while the bot was overloaded, a few at a time, once it isn't anymore"""
+        started = overload.resume_deferred(self.bot)
+        if started:
+            self.logger.info(f"Resumed {started} deferred quickembed(s), {len(self.bot.task_queue.quickembed_tasks)} left")
+
     async def db_save_task(self):
         if not self.ready:
             self.logger.info("Bot not ready, skipping database save task")
             return
+        if not cluster.is_primary:
+            return  # every cluster worker shares one database, the primary saves it
 
         self.logger.info("Saving database to the server...")
         await self.bot.guild_settings.save()
@@ -1245,7 +1294,7 @@ class Base(Extension):
                 logger=self.logger,
                 embed=False
             )
-            await self.post_servers(len(self.bot.guilds))
+            await self.post_servers()
 
     @listen()
     async def on_guild_left(self, event: GuildLeft):
@@ -1265,7 +1314,7 @@ class Base(Extension):
                 logger=self.logger,
                 embed=False
             )
-            await self.post_servers(len(self.bot.guilds))
+            await self.post_servers()
 
     @listen()
     async def on_ready(self):
@@ -1280,9 +1329,10 @@ class Base(Extension):
             self.logger.info(f"bot logged in as {self.bot.user.username}")
             self.logger.info(f"total shards: {len(self.bot.shards)}")
             self.logger.info(f"my guilds: {len(self.bot.guilds)}")
+            cluster.report(self.bot)
             self.logger.info(f"CLYPPY VERSION: {VERSION}")
             if os.getenv("TEST") is not None:
-                await self.post_servers(len(self.bot.guilds))
+                await self.post_servers()
 
             # Process queued tasks from previous session
             from bot.task_queue import process_queued_tasks
@@ -1290,10 +1340,12 @@ class Base(Extension):
                 await process_queued_tasks(self.bot, self.bot.task_queue)
             except Exception as e:
                 self.logger.error(f"Error processing queued tasks: {e}")
+            self.resume_deferred_task.start()
             self.logger.info("--------------")
 
     async def update_status(self):
         """Fetch embed count and update bot status"""
+        cluster.report(self.bot)
         try:
             async with aiohttp.ClientSession() as session:
                 async with session.get("https://clyppy.io/api/stats/embeds-count/") as resp:
@@ -1307,12 +1359,13 @@ class Base(Extension):
         except Exception as e:
             self.logger.warning(f"Failed to fetch embed count: {e}")
 
-    async def post_servers(self, num: int):
+    async def post_servers(self):
+        cluster.report(self.bot)
         if os.getenv("TEST") is not None:
             return
 
-        # Calculate total user count across all guilds
-        total_users = sum(guild.member_count or 0 for guild in self.bot.guilds)
+        # Guild and user counts across the whole bot (every cluster worker, when running as a cluster)
+        num, total_users = cluster.totals(self.bot)
 
         try:
             async with aiohttp.ClientSession() as session:
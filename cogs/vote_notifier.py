@@ -1,7 +1,7 @@
 import logging
 from interactions import Extension, Task, IntervalTrigger, listen
 from interactions.api.events import Startup
-from bot.io.io import get_pending_vote_notifications, mark_votes_notified
+from bot.io.io import get_pending_vote_notifications, mark_votes_notified, token_ledger
 from bot.env import CLYPPY_VOTE_URL
 
 logger = logging.getLogger(__name__)
@@ -15,6 +15,7 @@ async def _format_vote_dm(entry: dict, user, bot) -> str:
     user_id = entry['user_id']
 
     try:
+        token_ledger.invalidate(user_id)  # the vote just added tokens
         t = await bot.base_embedder.fetch_tokens(user)
         t = f'`{t}`'
     except Exception as e:
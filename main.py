@@ -5,10 +5,17 @@ load_dotenv()
 from interactions import AutoShardedClient, Intents
 from interactions.api.gateway.gateway import GatewayClient, OPCODE, FastJson
 from bot.setup import init_misc
-from bot.io import get_aiohttp_session
+from bot.io import get_aiohttp_session, token_ledger
 from bot.db import GuildDatabase
 from bot.io.cdn import CdnSpacesClient
+from bot.io.outbox import interaction_outbox
+from bot.io.webhooks import webhook_aggregator
+from bot.io.spool import spool
+from bot.utils.watchdog import loop_watchdog
+from bot.tools import executors
+from bot.utils.eventloop import new_event_loop, add_signal_handler
 from bot.env import is_contrib_instance, log_api_bypass
+from bot.cluster import cluster, configured_workers, Supervisor
 from cogs.base import format_count
 import aiohttp
 import signal
@@ -83,7 +90,13 @@ async def _identify_mobile(self) -> None:
         "compress": True,
     }
     serialized = FastJson.dumps(payload)
-    await self.ws.send_str(serialized)
+    identify_lock = cluster.identify_lock(self.state.client, self.shard[0])
+    if identify_lock is not None:
+        # other cluster workers identify too, and Discord's identify limit is per bot, not per process
+        async with identify_lock:
+            await self.ws.send_str(serialized)
+    else:
+        await self.ws.send_str(serialized)
     self.state.wrapped_logger(
         logging.DEBUG, f"Identification payload sent to gateway, requesting intents: {self.state.intents}"
     )
@@ -148,12 +161,13 @@ async def load_from_server():
             logger.error(f"Failed to get database from server: {e}")
 
 
-Bot = AutoShardedClient(intents=Intents.DEFAULT | Intents.MESSAGE_CONTENT)
+Bot = AutoShardedClient(intents=Intents.DEFAULT | Intents.MESSAGE_CONTENT, **cluster.client_kwargs())
 cdn_client = CdnSpacesClient()
 Bot.cdn_client = cdn_client
 Bot = init_misc(Bot)
 
-Bot.guild_settings = GuildDatabase(on_load=load_from_server, on_save=save_to_server)
+# cluster workers share the supervisor's copy of the database, which it loads before starting them
+Bot.guild_settings = GuildDatabase(on_load=None if cluster.is_worker else load_from_server, on_save=save_to_server)
 
 
 async def cleanup_old_videos():
@@ -254,7 +268,22 @@ async def save_state(bot):
     logger.info(f"Task queue: {queue_count[0]} quickembeds, {queue_count[1]} slash commands")
     bot.task_queue.save()
 
-    # Save database
+    # Send token refunds that are waiting to be batched
+    await token_ledger.flush_refunds()
+
+    # Publish any interactions still waiting in the outbox
+    logger.info(f"Flushing interaction outbox ({interaction_outbox.stats()['queued']} queued)...")
+    await interaction_outbox.drain(timeout=10)
+
+    # Send any log events still waiting to be batched
+    await webhook_aggregator.drain(timeout=5)
+
+    # Ship what we can from the spool, the rest is sent after the next start
+    await spool.drain(timeout=5)
+
+    # Save database (in cluster mode, the supervisor does it once every worker has stopped)
+    if cluster.is_worker:
+        return
     try:
         logger.info("Saving database...")
         await bot.guild_settings.save()
@@ -276,7 +305,7 @@ async def main():
     # Use get_running_loop() since we're inside an async function
     loop = asyncio.get_running_loop()
     for sig in (signal.SIGTERM, signal.SIGINT):
-        loop.add_signal_handler(sig, handle_shutdown_signal)
+        add_signal_handler(loop, sig, handle_shutdown_signal)
 
     Bot.load_extension('cogs.base')
     Bot.load_extension('cogs.watch')
@@ -287,6 +316,12 @@ async def main():
     logger.info("Loading task queue from previous session...")
     Bot.task_queue.load()
 
+    # Ship records spooled during the previous session
+    spool.start()
+
+    # Catch whatever blocks the event loop (and with it, gateway heartbeats)
+    loop_watchdog.start()
+
     # Start background tasks
     cleanup_task = asyncio.create_task(cleanup_old_videos())
     bot_task = asyncio.create_task(Bot.astart(token=os.getenv('CLYPP_TOKEN')))
@@ -359,6 +394,9 @@ async def main():
                 await save_state(Bot)
                 logger.info("State saved")
 
+                # Step 5: Let blocking work (uploads, downloads...) still running in the pools finish
+                await executors.shutdown(timeout=30)
+
                 logger.info("Shutdown complete")
             except Exception as e:
                 logger.error(f"Error during shutdown: {e}")
@@ -378,10 +416,16 @@ async def main():
 
 # Manually create and manage event loop to have full control over signal handling
 # (asyncio.run() installs its own signal handlers that interfere with ours)
-loop = asyncio.new_event_loop()
+# (EVENT_LOOP=uvloop opts in to uvloop, see bot/utils/eventloop.py)
+loop = new_event_loop()
 asyncio.set_event_loop(loop)
 try:
-    loop.run_until_complete(main())
+    if cluster.is_supervisor:
+        supervisor = Supervisor(configured_workers(), script=os.path.realpath(__file__),
+                                on_start=load_from_server, on_stop=save_to_server)
+        loop.run_until_complete(supervisor.run(token=os.getenv('CLYPP_TOKEN')))
+    else:
+        loop.run_until_complete(main())
 finally:
     try:
         # Cancel all remaining tasks
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""End-to-end test for the out-of-process media worker, with a fake platform instead of yt-dlp."""
+
+import os
+import sys
+import asyncio
+import logging
+import tempfile
+import multiprocessing as mp
+from types import SimpleNamespace
+
+# Add bot directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bot.classes import BaseClip
+from bot.errors import VideoTooLong
+from bot.types import DownloadResponse
+from bot.tools.dl import DownloadManager
+import bot.tools.dl as dl
+import bot.tools.media_worker as mw
+
+WORK_DIR = tempfile.mkdtemp(prefix='media_worker_test_')
+
+
+class FakeClip(BaseClip):
+    def __init__(self, slug):
+        self._service = "fake"
+        super().__init__(slug, None, 0, 12)
+        self.title = f"Fake clip {slug}"
+
+    @property
+    def service(self):
+        return self._service
+
+    @property
+    def url(self):
+        return f"https://fake.example/{self.id}"
+
+    async def download(self, filename=None, can_send_files=False, **kwargs):
+        await asyncio.sleep(0.5 if self.id != 'slow' else 30)
+        path = os.path.join(WORK_DIR, filename)
+        with open(path, 'wb') as f:
+            f.write(b'\0' * 1024)
+        return DownloadResponse(
+            remote_url=None if can_send_files else f"https://cdn.example/{self.clyppy_id}.mp4",
+            local_file_path=path, duration=self.duration, width=1280, height=720, filesize=1024,
+            video_name=f"pid {os.getpid()}", can_be_discord_uploaded=can_send_files,
+            clyppy_object_is_stored_as_redirect=False
+        )
+
+    async def create_first_frame_webp(self, video_path, output_path=None):
+        return video_path.replace('.mp4', '.webp')
+
+
+class FakeMisc:
+    platform_name = "Fake"
+    cdn_client = None
+
+    async def get_clip(self, url, extended_url_formats=False, basemsg=None, cookies=False):
+        slug = url.rsplit('/', 1)[-1]
+        if slug == 'long':
+            raise VideoTooLong(999)
+        clip = FakeClip(slug)
+        if basemsg is not None:
+            clip.title += f" for {basemsg.author.username}"
+        return clip
+
+
+def run_worker(path, sock=None, cwd=None):
+    mw.PROGRESS_INTERVAL = 0.1
+    mw.MEDIA_WORKER_DRAIN_IDLE = 0.2
+    if cwd is not None:
+        os.chdir(cwd)
+    address = None
+    if sock is None:
+        sock = mw.socket.socket(mw.socket.AF_UNIX, mw.socket.SOCK_STREAM)
+        sock.bind(path)
+        sock.listen(16)
+    else:
+        address = mw.worker_address(path, os.getpid())  # one of several workers sharing sock
+    server = mw.MediaWorkerServer(SimpleNamespace(platform_list=[FakeMisc()]), address=address)
+    asyncio.run(server.serve(sock))
+
+
+async def test_media_worker():
+    """Test clip extraction, downloads, errors, cancellation and fallback through a media worker."""
+    print("Starting media worker tests...\n")
+    path = os.path.join(WORK_DIR, 'media.sock')
+    worker = mp.Process(target=run_worker, args=(path,), daemon=True)
+    worker.start()
+    while not os.path.exists(path):
+        await asyncio.sleep(0.05)
+
+    client = mw.MediaWorkerClient(path)
+    dl.media_worker = client
+    manager = DownloadManager(SimpleNamespace(logger=logging.getLogger('test')))
+    platform = FakeMisc()
+    msg = SimpleNamespace(id=1, author=SimpleNamespace(id=42, username='tester'), guild=SimpleNamespace(id=7))
+
+    try:
+        # Test 1: get_clip runs in the worker and returns a RemoteClip
+        print("Test 1: get_clip in the worker")
+        clip = await manager.get_clip(platform, "https://fake.example/abc", basemsg=msg)
+        assert isinstance(clip, mw.RemoteClip), type(clip)
+        assert clip.service == 'fake' and clip.id == 'abc' and clip.duration == 12
+        assert clip.title == "Fake clip abc for tester", clip.title
+        info = await client.call('ping')
+        assert info['pid'] != os.getpid()
+        print(f"✓ Got {clip.title!r} from worker pid {info['pid']}\n")
+
+        # Test 2: download runs in the worker, with progress, using state set here
+        print("Test 2: download in the worker")
+        clip.clyppy_id = 'xyz123'
+        frames = []
+        clip._on_progress = frames.append
+        response = await manager.download_clip(clip)
+        assert isinstance(response, DownloadResponse)
+        assert response.remote_url == "https://cdn.example/xyz123.mp4", response.remote_url
+        assert response.video_name == f"pid {info['pid']}"
+        assert os.path.exists(response.local_file_path)
+        assert frames and {f['stage'] for f in frames} <= {'queued', 'running'}
+        thumb = await clip.create_first_frame_webp(response.local_file_path)
+        assert thumb.endswith('fake_xyz123.webp'), thumb
+        print(f"✓ Downloaded to {response.local_file_path} with {len(frames)} progress frames\n")
+
+        # Test 3: errors come back as the same exception type
+        print("Test 3: errors cross the socket")
+        try:
+            await manager.get_clip(platform, "https://fake.example/long")
+            raise AssertionError("expected VideoTooLong")
+        except VideoTooLong as e:
+            assert e.video_dur == 999
+        print("✓ VideoTooLong(999) raised in the gateway\n")
+
+        # Test 4: cancelling a job in the gateway cancels it in the worker
+        print("Test 4: cancellation")
+        slow = await manager.get_clip(platform, "https://fake.example/slow")
+        task = asyncio.create_task(slow.download(filename='slow.mp4'))
+        await asyncio.sleep(0.3)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await asyncio.sleep(0.2)
+        stats = await client.call('ping')
+        assert stats['cancelled'] == 1, stats
+        print(f"✓ Worker cancelled the job: {stats}\n")
+
+        # Test 5: with no worker listening, the gateway does the work itself
+        print("Test 5: fallback without a worker")
+        dl.media_worker = mw.MediaWorkerClient(os.path.join(WORK_DIR, 'nobody.sock'))
+        local = await manager.get_clip(platform, "https://fake.example/def")
+        assert isinstance(local, FakeClip)
+        print("✓ Extracted in-process\n")
+    finally:
+        worker.terminate()
+        worker.join()
+
+    # Test 6: with several workers on the same socket, calls on a clip reach the worker holding it
+    print("Test 6: several workers")
+    path = os.path.join(WORK_DIR, 'shared.sock')
+    sock = mw.socket.socket(mw.socket.AF_UNIX, mw.socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(16)
+    workers = [mp.Process(target=run_worker, args=(path, sock), daemon=True) for _ in range(4)]
+    for w in workers:
+        w.start()
+    addresses = [mw.worker_address(path, w.pid) for w in workers]
+    while not all(os.path.exists(a) for a in addresses):
+        await asyncio.sleep(0.05)
+
+    client = mw.MediaWorkerClient(path)
+    dl.media_worker = client
+    try:
+        clips = await asyncio.gather(*(manager.get_clip(platform, f"https://fake.example/multi{i}") for i in range(12)))
+        for i, clip in enumerate(clips):
+            clip.clyppy_id = f"multi{i}"
+        responses = await asyncio.gather(*(manager.download_clip(clip) for clip in clips))
+        thumbs = await asyncio.gather(*(clip.create_first_frame_webp(r.local_file_path)
+                                        for clip, r in zip(clips, responses)))
+        for i, (clip, response) in enumerate(zip(clips, responses)):
+            assert clip._worker in addresses, clip._worker
+            assert response.video_name == f"pid {clip._worker.rsplit('.', 1)[1]}", (clip._worker, response.video_name)
+            assert thumbs[i].endswith(f'fake_multi{i}.webp'), thumbs[i]
+        used = {clip._worker for clip in clips}
+        print(f"✓ 12 clips on {len(used)} workers, every call reached the worker holding its clip\n")
+    finally:
+        for w in workers:
+            w.terminate()
+        for w in workers:
+            w.join()
+        sock.close()
+
+    # Test 7: SIGTERM lets the worker finish the job it's running
+    print("Test 7: draining on SIGTERM")
+    path = os.path.join(WORK_DIR, 'drain.sock')
+    worker = mp.Process(target=run_worker, args=(path,), daemon=True)
+    worker.start()
+    while not os.path.exists(path):
+        await asyncio.sleep(0.05)
+    client = mw.MediaWorkerClient(path)
+    dl.media_worker = client
+    clip = await manager.get_clip(platform, "https://fake.example/drain")
+    clip.clyppy_id = 'drain1'
+    task = asyncio.create_task(manager.download_clip(clip))
+    await asyncio.sleep(0.2)
+    worker.terminate()
+    response = await task
+    assert response.remote_url == "https://cdn.example/drain1.mp4", response
+    worker.join(5)
+    assert worker.exitcode == 0, worker.exitcode
+    print("✓ The download finished after SIGTERM, then the worker exited\n")
+
+    # Test 8: a worker in another working directory isn't used
+    print("Test 8: working directory check")
+    path = os.path.join(WORK_DIR, 'elsewhere.sock')
+    worker = mp.Process(target=run_worker, args=(path, None, tempfile.mkdtemp()), daemon=True)
+    worker.start()
+    while not os.path.exists(path):
+        await asyncio.sleep(0.05)
+    client = mw.MediaWorkerClient(path)
+    dl.media_worker = client
+    try:
+        local = await manager.get_clip(platform, "https://fake.example/ghi")
+        assert isinstance(local, FakeClip), type(local)
+        assert not client.enabled
+        assert not [f for f in os.listdir('.') if f.startswith('.media_worker_probe_')]
+        print("✓ Extracted in-process and stopped using the worker\n")
+    finally:
+        worker.terminate()
+        worker.join()
+
+    print("All media worker tests passed!")
+
+
+if __name__ == "__main__":
+    asyncio.run(test_media_worker())
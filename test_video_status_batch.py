@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Test script for batched video status lookups, against a local stand-in for the clyppy.io API."""
+
+import os
+import sys
+import asyncio
+
+# Add bot directory to path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aiohttp import web
+from bot.io.client import ClyppyApiClient
+import bot.io.io as bot_io
+from bot.io.status import VideoStatusBatcher
+
+EXISTING = {'abc123', 'old99'}
+
+
+def make_app(requests_seen: list, batch_enabled: bool = True):
+    async def get_status(request):
+        body = await request.json()
+        requests_seen.append(('single', [body['clip_id']]))
+        return web.json_response({'exists': body['clip_id'] in EXISTING})
+
+    async def get_statuses(request):
+        body = await request.json()
+        requests_seen.append(('batch', body['clip_ids']))
+        return web.json_response({'statuses': {i: {'exists': i in EXISTING} for i in body['clip_ids']}})
+
+    app = web.Application()
+    app.router.add_get('/api/clips/get-status/', get_status)
+    if batch_enabled:
+        app.router.add_post('/api/clips/get-statuses/', get_statuses)
+    return app
+
+
+async def start_server(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def use_server(base_url):
+    """Point bot.io at the stand-in server with a fresh client and batcher"""
+    bot_io.api_client = ClyppyApiClient(base_url=base_url)
+    bot_io.status_batcher = VideoStatusBatcher(fetch_many=bot_io._fetch_batch_video_status,
+                                               fetch_one=bot_io._fetch_single_video_status)
+
+
+async def test_video_status_batch():
+    """Test batched and coalesced status lookups."""
+    print("Starting video status batching tests...\n")
+    os.environ.setdefault('clyppy_post_key', 'test-key')
+
+    seen = []
+    runner, base_url = await start_server(make_app(seen))
+    try:
+        use_server(base_url)
+
+        # Test 1: both ids of one embed go in a single request
+        print("Test 1: fetch_video_statuses sends one request")
+        statuses = await bot_io.fetch_video_statuses(['newid', 'old99'])
+        assert statuses['newid']['exists'] is False
+        assert statuses['old99']['exists'] is True
+        assert seen == [('batch', ['newid', 'old99'])], f"Expected one batch request but got {seen}"
+        print("✓ One round trip for both ids\n")
+
+        # Test 2: concurrent embeds are merged into the same request, duplicate ids are shared
+        print("Test 2: concurrent lookups are coalesced")
+        seen.clear()
+        results = await asyncio.gather(
+            bot_io.fetch_video_status('abc123'),
+            bot_io.fetch_video_status('abc123'),
+            bot_io.fetch_video_statuses(['x1', 'x2']),
+        )
+        assert results[0]['exists'] and results[1]['exists']
+        assert set(results[2]) == {'x1', 'x2'}
+        assert len(seen) == 1, f"Expected 1 request but got {seen}"
+        assert sorted(seen[0][1]) == ['abc123', 'x1', 'x2'], f"Unexpected batch {seen[0]}"
+        print(f"✓ 4 lookups resolved with 1 request: {bot_io.status_batcher.stats()}\n")
+    finally:
+        await bot_io.api_client.close()
+        await runner.cleanup()
+
+    # Test 3: servers without the batch endpoint fall back to single lookups
+    print("Test 3: fallback when the batch endpoint doesn't exist")
+    seen = []
+    runner, base_url = await start_server(make_app(seen, batch_enabled=False))
+    try:
+        use_server(base_url)
+        statuses = await bot_io.fetch_video_statuses(['abc123', 'nope'])
+        assert statuses == {'abc123': {'exists': True}, 'nope': {'exists': False}}, statuses
+        assert bot_io.status_batcher.batch_supported is False
+        assert sorted(s[1][0] for s in seen) == ['abc123', 'nope'], seen
+        print("✓ Fell back to single lookups\n")
+    finally:
+        await bot_io.api_client.close()
+        await runner.cleanup()
+
+    # Test 4: the batch endpoint is tried again once the retry interval has passed
+    print("Test 4: batching is retried after the cool-down")
+    seen = []
+    runner, base_url = await start_server(make_app(seen, batch_enabled=True))
+    try:
+        use_server(base_url)
+        bot_io.status_batcher.batch_retry_interval = 0
+        assert bot_io.status_batcher.batch_supported is True
+        statuses = await bot_io.fetch_video_statuses(['abc123', 'nope'])
+        assert statuses == {'abc123': {'exists': True}, 'nope': {'exists': False}}, statuses
+        assert len(seen) == 1, f"Expected 1 batched request but got {seen}"
+        print("✓ Back to batched lookups\n")
+    finally:
+        await bot_io.api_client.close()
+        await runner.cleanup()
+
+    print("=" * 50)
+    print("ALL TESTS PASSED! ✓")
+    print("=" * 50)
+
+
+if __name__ == "__main__":
+    asyncio.run(test_video_status_batch())